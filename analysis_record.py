@@ -0,0 +1,212 @@
+"""Parse "KEY: value" email analyses once into compact records with normalized labels"""
+import re
+from enum import Enum
+from functools import lru_cache
+from collections.abc import Mapping
+
+
+class Label(str, Enum):
+    """A normalized analysis value; compares, hashes and prints like its lowercase string"""
+
+    def __str__(self):
+        return self.value
+
+    def __format__(self, spec):
+        return format(self.value, spec)
+
+    @classmethod
+    def parse(cls, text):
+        """
+        The label named in text, or None.
+
+        Tolerates casing, brackets and markdown, and takes the first known
+        label of lists like "support/sales" or "Negative (frustrated)".
+        A label just after a negation ("not", "isn't") does not count:
+
+        >>> Priority.parse("**High** (customer is waiting)")
+        <Priority.HIGH: 'high'>
+        >>> Priority.parse("Not urgent") is None
+        True
+        >>> Priority.parse("Not urgent - low")
+        <Priority.LOW: 'low'>
+        >>> Sentiment.parse("isn't very angry, neutral")
+        <Sentiment.NEUTRAL: 'neutral'>
+        """
+        # Words left in which a negation still applies ("not very urgent")
+        negated = 0
+        for word in LABEL_WORD.findall(str(text).lower()):
+            label = cls._value2member_map_.get(word)
+            if label is not None and not negated:
+                return label
+            if word in NEGATIONS:
+                negated = 2
+            else:
+                negated = 0 if label is not None else max(0, negated - 1)
+        return None
+
+
+class EmailType(Label):
+    SUPPORT = "support"
+    SALES = "sales"
+    GENERAL = "general"
+    FEEDBACK = "feedback"
+    URGENT = "urgent"
+    NEWSLETTER = "newsletter"
+    OTHER = "other"
+
+
+class Sentiment(Label):
+    POSITIVE = "positive"
+    NEGATIVE = "negative"
+    NEUTRAL = "neutral"
+    ANGRY = "angry"
+    URGENT = "urgent"
+
+
+class Priority(Label):
+    LOW = "low"
+    MEDIUM = "medium"
+    HIGH = "high"
+    URGENT = "urgent"
+
+
+class Tone(Label):
+    PROFESSIONAL = "professional"
+    FRIENDLY = "friendly"
+    APOLOGETIC = "apologetic"
+    ENTHUSIASTIC = "enthusiastic"
+
+
+# Labelled keys, in display order: (key, record attribute, label type)
+FIELDS = (
+    ("TYPE", "type", EmailType),
+    ("SENTIMENT", "sentiment", Sentiment),
+    ("PRIORITY", "priority", Priority),
+    ("TONE", "tone", Tone)
+)
+FIELD_ATTRS = {key: attr for key, attr, _ in FIELDS}
+
+# Other names models (and email_analyzer's longer prompt) use for the same keys
+KEY_ALIASES = {
+    "TONE_RECOMMENDATION": "TONE",
+    "RECOMMENDED_TONE": "TONE",
+    "EMAIL_TYPE": "TYPE",
+    "CATEGORY": "TYPE",
+    "URGENCY": "PRIORITY",
+    "MAIN_POINTS": "KEY_POINTS"
+}
+
+# Keys parse_analysis starts a new value at; any other "x: y" line belongs to the current value
+TEXT_KEYS = ("KEY_POINTS",)
+KNOWN_KEYS = set(FIELD_ATTRS) | set(TEXT_KEYS)
+
+LABEL_WORD = re.compile(r"[a-z]+")
+# Words that cancel the next label within two words ("t" is what's left of "isn't")
+NEGATIONS = {"not", "no", "non", "never", "t"}
+# "TYPE: x", "- **Type**: x", "1. Tone recommendation: x", "### PRIORITY: x"
+KEY_LINE = re.compile(r"^\s*(?:[-*•>#]+\s*|\d+[.)]\s*)?[*_`]*([A-Za-z][A-Za-z _-]{0,40}?)[*_`]*\s*:\s*(.*)$")
+MARKUP = re.compile(r"^[\s*_`\[]+|[\s*_`\]]+$")
+
+
+def normalize_key(key):
+    key = re.sub(r"[\s-]+", "_", key.strip()).upper()
+    return KEY_ALIASES.get(key, key)
+
+
+class Analysis(Mapping):
+    """
+    One email's analysis: the four labels plus any other keys as text.
+
+    Read it like the dict it replaces (analysis["TYPE"], .get(), .items()
+    yield only the keys that are set) or through the typed attributes
+    (analysis.type is an EmailType or None). Records are never mutated,
+    so one can be shared by every email with the same model output.
+    dict(analysis) is the JSON-ready form.
+    """
+
+    __slots__ = ("type", "sentiment", "priority", "tone", "extra")
+
+    def __init__(self, type=None, sentiment=None, priority=None, tone=None, extra=None):
+        self.type = type
+        self.sentiment = sentiment
+        self.priority = priority
+        self.tone = tone
+        self.extra = extra or {}
+
+    @classmethod
+    def from_dict(cls, data):
+        """A record from a {"TYPE": ..., ...} dict (journal entries, classifier output), labels re-parsed"""
+        if isinstance(data, Analysis):
+            return data
+        labels = {}
+        extra = {}
+        for key, value in (data or {}).items():
+            key = normalize_key(key)
+            attr = FIELD_ATTRS.get(key)
+            if attr is None:
+                extra[key] = "" if value is None else str(value)
+            elif attr not in labels:
+                labels[attr] = value
+        return cls(**{attr: label_type.parse(labels[attr]) for _, attr, label_type in FIELDS
+                      if labels.get(attr) is not None}, extra=extra)
+
+    def _items(self):
+        for key, attr, _ in FIELDS:
+            value = getattr(self, attr)
+            if value is not None:
+                yield key, value
+        yield from self.extra.items()
+
+    def __getitem__(self, key):
+        attr = FIELD_ATTRS.get(key)
+        value = getattr(self, attr) if attr else self.extra.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __iter__(self):
+        return (key for key, _ in self._items())
+
+    def __len__(self):
+        return sum(1 for _ in self._items())
+
+    def __repr__(self):
+        return f"Analysis({ {key: str(value) for key, value in self._items()}!r})"
+
+    def __reduce__(self):
+        # Slots plus the Mapping base: pickle (worker processes) by the fields
+        return Analysis, (self.type, self.sentiment, self.priority, self.tone, self.extra)
+
+
+@lru_cache(maxsize=4096)
+def parse_analysis(text):
+    """
+    Parse a model's "KEY: value" lines into an Analysis.
+
+    Tolerates markdown bullets, bold keys and casing. Only KNOWN_KEYS start
+    a value; any other line continues the previous one, so a bulleted
+    KEY_POINTS list keeps items like "- Refund: still pending":
+
+    >>> dict(parse_analysis("TYPE: support\\nKEY_POINTS:\\n- Refund: still pending\\n- Login fails"))
+    {'TYPE': <EmailType.SUPPORT: 'support'>, 'KEY_POINTS': '- Refund: still pending\\n- Login fails'}
+
+    Values of the labelled keys that name no known label are left unset,
+    so callers fall back to their defaults. Cached, since batches see the
+    same few short outputs over and over.
+    """
+    values = {}
+    key = None
+    for line in (text or "").strip().splitlines():
+        match = KEY_LINE.match(line)
+        if match and normalize_key(match.group(1)) in KNOWN_KEYS:
+            key = normalize_key(match.group(1))
+            values.setdefault(key, [])
+            value = MARKUP.sub("", match.group(2))
+        elif key is not None and line.strip():
+            value = line.strip()
+        else:
+            continue
+        if value:
+            values[key].append(value)
+    # Lines before the first known key (e.g. "Here is the analysis:") are dropped
+    return Analysis.from_dict({key: "\n".join(lines) for key, lines in values.items() if lines})
@@ -0,0 +1,289 @@
+"""Offline batch jobs: chat requests written as Batch API JSONL, submitted, polled and reconciled by custom_id"""
+import os
+import json
+import time
+import shutil
+import uuid
+import hashlib
+from types import SimpleNamespace
+
+ENDPOINT = "/v1/chat/completions"
+DEFAULT_BATCH_DIR = os.getenv("EMAIL_BATCH_DIR", "batch_jobs")
+DEFAULT_POLL_SECONDS = float(os.getenv("EMAIL_BATCH_POLL_SECONDS", "30"))
+DEFAULT_BACKEND = os.getenv("EMAIL_BATCH_BACKEND", "openai")
+
+# Provider limits per input file; a stage with more requests is split into several jobs
+MAX_REQUESTS_PER_FILE = 50_000
+MAX_FILE_BYTES = 200 * 1000 * 1000
+
+# OpenAI bills Batch API requests at half the synchronous price
+BATCH_PRICE_FACTOR = 0.5
+FINAL_STATES = ("completed", "failed", "expired", "cancelled")
+
+
+def request_line(custom_id, body):
+    """One Batch API input line, encoded"""
+    return (json.dumps({"custom_id": custom_id, "method": "POST", "url": ENDPOINT, "body": body},
+                       ensure_ascii=False) + "\n").encode("utf-8")
+
+
+def write_requests(directory, stage, requests, max_requests=MAX_REQUESTS_PER_FILE, max_bytes=MAX_FILE_BYTES):
+    """
+    Write (custom_id, body) pairs as Batch API input files within the provider's per-file limits.
+
+    Returns [(path, number of requests)], one per file. Files left over
+    from an earlier, bigger run of the stage are removed.
+
+    >>> import tempfile
+    >>> directory = tempfile.mkdtemp()
+    >>> requests = [(f"analysis-{i}", {"model": "m"}) for i in range(5)]
+    >>> [count for _, count in write_requests(directory, "analysis", requests, max_requests=5)]
+    [5]
+    >>> [count for _, count in write_requests(directory, "analysis", requests, max_requests=2)]
+    [2, 2, 1]
+    >>> size = len(request_line("analysis-0", {"model": "m"}))
+    >>> [count for _, count in write_requests(directory, "analysis", requests, max_bytes=size * 3)]
+    [3, 2]
+    >>> sorted(os.listdir(directory))
+    ['analysis_requests_0.jsonl', 'analysis_requests_1.jsonl']
+    """
+    files = []
+    f = None
+    try:
+        for custom_id, body in requests:
+            line = request_line(custom_id, body)
+            if len(line) > max_bytes:
+                raise ValueError(f"Batch request {custom_id} is larger than {max_bytes} bytes")
+            if f is None or files[-1][1] == max_requests or size + len(line) > max_bytes:
+                if f is not None:
+                    f.close()
+                path = os.path.join(directory, f"{stage}_requests_{len(files)}.jsonl")
+                f = open(path, "wb")
+                files.append([path, 0])
+                size = 0
+            f.write(line)
+            files[-1][1] += 1
+            size += len(line)
+    finally:
+        if f is not None:
+            f.close()
+    stale = len(files)
+    while os.path.exists(os.path.join(directory, f"{stage}_requests_{stale}.jsonl")):
+        os.remove(os.path.join(directory, f"{stage}_requests_{stale}.jsonl"))
+        stale += 1
+    return [tuple(part) for part in files]
+
+
+def file_digest(path):
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def usage_of(completion):
+    """A chat completion's usage dict as an object, like the SDK's (for calculate_cost and metrics)"""
+    usage = completion.get("usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+    return SimpleNamespace(
+        prompt_tokens=usage.get("prompt_tokens", 0),
+        completion_tokens=usage.get("completion_tokens", 0),
+        total_tokens=usage.get("total_tokens", 0),
+        prompt_tokens_details=SimpleNamespace(cached_tokens=details.get("cached_tokens", 0) or 0)
+    )
+
+
+def read_results(lines):
+    """
+    Reconcile Batch API output lines by custom_id.
+
+    Returns {custom_id: (completion dict, None)} for answered requests and
+    {custom_id: (None, error message)} for failed ones. Output order is not
+    the input order, and requests can be missing altogether.
+    """
+    results = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        body = response.get("body") or {}
+        if entry.get("error"):
+            error = entry["error"].get("message") or entry["error"].get("code") or "failed"
+            results[entry["custom_id"]] = (None, error)
+        elif response.get("status_code") != 200:
+            error = (body.get("error") or {}).get("message") or f"HTTP {response.get('status_code')}"
+            results[entry["custom_id"]] = (None, error)
+        else:
+            results[entry["custom_id"]] = (body, None)
+    return results
+
+
+class OpenAIBatchBackend:
+    """The OpenAI Batch API: upload the input file, create a batch, poll it, download its output"""
+
+    name = "openai"
+    price_factor = BATCH_PRICE_FACTOR
+
+    def __init__(self, client_for):
+        self.client_for = client_for
+
+    def submit(self, path, stage):
+        client = self.client_for(stage)
+        with open(path, "rb") as f:
+            uploaded = client.files.create(file=f, purpose="batch")
+        batch = client.batches.create(input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h",
+                                      metadata={"stage": stage})
+        return batch.id
+
+    def poll(self, job_id, stage):
+        """{"status", "done", "total"} of a job"""
+        batch = self.client_for(stage).batches.retrieve(job_id)
+        counts = batch.request_counts
+        return {"status": batch.status,
+                "done": (counts.completed + counts.failed) if counts else 0,
+                "total": counts.total if counts else 0}
+
+    def results(self, job_id, stage):
+        """Output lines of a finished job, failed requests included"""
+        client = self.client_for(stage)
+        batch = client.batches.retrieve(job_id)
+        lines = []
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if file_id:
+                lines.extend(client.files.content(file_id).text.splitlines())
+        return lines
+
+
+class LocalBatchBackend:
+    """
+    File-based stand-in for a batch API, for tests and local servers.
+
+    A job is a directory holding a copy of the input file. The first poll
+    runs its requests one at a time through call(stage, body) (the usual
+    rate-limited chat-completions call, so the mock server or a local model
+    can answer) and writes output.jsonl in the Batch API's result format.
+    Its calls are ordinary requests, billed at the full price.
+    """
+
+    name = "local"
+    price_factor = 1.0
+
+    def __init__(self, directory, call):
+        self.directory = directory
+        self.call = call
+
+    def _job_dir(self, job_id):
+        return os.path.join(self.directory, job_id)
+
+    def submit(self, path, stage):
+        job_id = f"local-{stage}-{uuid.uuid4().hex[:12]}"
+        os.makedirs(self._job_dir(job_id), exist_ok=True)
+        shutil.copyfile(path, os.path.join(self._job_dir(job_id), "input.jsonl"))
+        return job_id
+
+    def poll(self, job_id, stage):
+        output = os.path.join(self._job_dir(job_id), "output.jsonl")
+        if not os.path.exists(output):
+            self._run(job_id, stage, output)
+        with open(output, "r", encoding="utf-8") as f:
+            total = sum(1 for _ in f)
+        return {"status": "completed", "done": total, "total": total}
+
+    def _run(self, job_id, stage, output):
+        with open(os.path.join(self._job_dir(job_id), "input.jsonl"), "r", encoding="utf-8") as f:
+            requests = [json.loads(line) for line in f if line.strip()]
+        # Written under a temporary name, so an interrupted run starts over
+        with open(output + ".tmp", "w", encoding="utf-8") as out:
+            for number, request in enumerate(requests):
+                entry = {"id": f"batch_req_{number}", "custom_id": request["custom_id"]}
+                try:
+                    completion = self.call(stage, request["body"])
+                    entry.update(response={"status_code": 200, "body": completion.model_dump()}, error=None)
+                except Exception as e:
+                    entry.update(response=None, error={"code": type(e).__name__, "message": str(e)})
+                out.write(json.dumps(entry) + "\n")
+        os.replace(output + ".tmp", output)
+
+    def results(self, job_id, stage):
+        with open(os.path.join(self._job_dir(job_id), "output.jsonl"), "r", encoding="utf-8") as f:
+            return f.read().splitlines()
+
+
+def run_job(backend, directory, stage, requests, poll_seconds=DEFAULT_POLL_SECONDS, verbose=True,
+            max_requests=MAX_REQUESTS_PER_FILE, max_bytes=MAX_FILE_BYTES):
+    """
+    Submit one stage's requests as batch jobs, wait for them and reconcile the output.
+
+    Requests beyond one file's limits are split into several jobs, and the
+    results of all of them are merged by custom_id. The input files and job
+    ids are kept in directory, so rerunning the same inbox after an
+    interruption picks the submitted jobs up again instead of paying for
+    them twice. Returns (read_results() dict, seconds from the first
+    submission to results).
+
+    >>> import tempfile
+    >>> class Completion(dict):
+    ...     def model_dump(self):
+    ...         return dict(self)
+    >>> backend = LocalBatchBackend(tempfile.mkdtemp(), lambda stage, body: Completion(model=body["model"]))
+    >>> requests = [(f"analysis-{i}", {"model": "m"}) for i in range(5)]
+    >>> results, _ = run_job(backend, tempfile.mkdtemp(), "analysis", requests, verbose=False, max_requests=2)
+    >>> sorted(results) == [f"analysis-{i}" for i in range(5)]
+    True
+    """
+    os.makedirs(directory, exist_ok=True)
+    state_path = os.path.join(directory, f"{stage}_job.json")
+    files = write_requests(directory, stage, requests, max_requests, max_bytes)
+    if not files:
+        return {}, 0.0
+
+    submitted = {}
+    state = None
+    if os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    if state and state["backend"] == backend.name:
+        submitted = {job["digest"]: job["job_id"] for job in state.get("jobs", [])}
+    started = state["submitted"] if submitted else time.time()
+    digests = [file_digest(path) for path, _ in files]
+    jobs = [{"job_id": submitted.get(digest), "digest": digest} for digest in digests]
+    resumed = sum(1 for job in jobs if job["job_id"])
+    if verbose and resumed:
+        print(f"♻️  Resuming {resumed} {stage} batch job{'s' if resumed > 1 else ''}")
+    for job, (path, part_count) in zip(jobs, files):
+        if job["job_id"]:
+            continue
+        job["job_id"] = backend.submit(path, stage)
+        # Saved after every submission, so an interruption never orphans a paid-for job
+        with open(state_path, "w", encoding="utf-8") as f:
+            json.dump({"backend": backend.name, "submitted": started,
+                       "jobs": [entry for entry in jobs if entry["job_id"]]}, f)
+        if verbose:
+            print(f"📤 Submitted {stage} batch job {job['job_id']} ({part_count} requests)")
+
+    statuses = {}
+    while True:
+        for job in jobs:
+            if job["job_id"] not in statuses or statuses[job["job_id"]]["status"] not in FINAL_STATES:
+                statuses[job["job_id"]] = backend.poll(job["job_id"], stage)
+        waiting = [status for status in statuses.values() if status["status"] not in FINAL_STATES]
+        if not waiting:
+            break
+        if verbose:
+            done = sum(status["done"] for status in statuses.values())
+            total = sum(status["total"] for status in statuses.values())
+            print(f"⏳ {stage} jobs: {len(waiting)} of {len(jobs)} still {waiting[0]['status']}, "
+                  f"{done}/{total} done")
+        time.sleep(poll_seconds)
+
+    results = {}
+    for job in jobs:
+        results.update(read_results(backend.results(job["job_id"], stage)))
+    seconds = time.time() - started
+    # Reconciled: the next run submits new jobs
+    os.remove(state_path)
+    if verbose:
+        failed = sum(1 for _, error in results.values() if error)
+        states = sorted({status["status"] for status in statuses.values()})
+        print(f"📥 {stage} job{'s' if len(jobs) > 1 else ''} {'/'.join(states)}: "
+              f"{len(results)} results, {failed} failed\n")
+    return results, seconds
@@ -0,0 +1,69 @@
+"""Benchmark: two-call (analysis, then response) vs single-call combined mode"""
+import sys
+import time
+import statistics
+
+import email_responder_pro as pro
+from response_cache import cache
+from metrics import percentile
+
+
+def two_call(email):
+    """The default pro flow: analyze_email_quick then generate_response_smart"""
+    analysis_result = pro.analyze_email_quick(email['subject'], email['body'], email['from'])
+    if not analysis_result['success']:
+        return analysis_result
+    response_result = pro.generate_response_smart(email['subject'], email['body'],
+                                                  analysis_result['analysis'], email['from'])
+    return pro.merge_results(analysis_result, response_result)
+
+
+def combined(email):
+    """Single-call mode"""
+    return pro.analyze_and_respond(email['subject'], email['body'], email['from'])
+
+
+def run_mode(name, process, emails, runs):
+    """Run one mode over all emails and print its token and latency figures"""
+    latencies = []
+    tokens = []
+    failures = 0
+
+    for _ in range(runs):
+        for email in emails:
+            start = time.perf_counter()
+            result = process(email)
+            latencies.append(time.perf_counter() - start)
+            if result['success']:
+                tokens.append(result['tokens'])
+            else:
+                failures += 1
+
+    print(f"\n{name}")
+    print("-" * 50)
+    print(f"Calls: {len(latencies)} | Failures: {failures}")
+    if tokens:
+        print(f"Tokens per email: avg {statistics.mean(tokens):.0f} | total {sum(tokens)}")
+    print(f"Latency p50: {percentile(latencies, 50)*1000:.0f} ms")
+    print(f"Latency p95: {percentile(latencies, 95)*1000:.0f} ms")
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 1
+    emails = pro.load_sample_emails()
+    if not emails:
+        return
+
+    # Measure real model calls only
+    cache.enabled = False
+    pro.fast_path["enabled"] = False
+
+    print(f"Benchmarking {len(emails)} emails x {runs} run(s) (this makes real API calls)")
+    run_mode("TWO-CALL MODE", two_call, emails, runs)
+    run_mode("COMBINED MODE", combined, emails, runs)
+    print(f"\nCombined-mode fallbacks: {pro.session_stats['combined_fallbacks']}")
+    print(f"Total cost: ${pro.session_stats['total_cost']:.6f}")
+
+
+if __name__ == "__main__":
+    main()
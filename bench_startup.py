@@ -0,0 +1,105 @@
+"""
+Startup benchmark: how long each script takes to import, against a budget.
+
+The SDK, asyncio and the mbox readers must not load until they are needed.
+Exits non-zero when a module is over budget or imports one of them early,
+so it can run as a CI check. Example:
+    python bench_startup.py --runs 15 --json startup.json
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+# Milliseconds of import time allowed per module, on top of bare interpreter start
+IMPORT_BUDGET_MS = {
+    "email_analyzer": 100,
+    "email_responder": 100,
+    "email_responder_pro": 150
+}
+
+# Modules that only the first model call, batch mode or an mbox inbox should load
+DEFERRED_MODULES = ("openai", "httpx", "httpx2", "pydantic", "dotenv", "asyncio", "mailbox",
+                    "multiprocessing", "concurrent.futures")
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_python(code):
+    """Wall time in ms of a fresh interpreter running code, and what it printed"""
+    start = time.perf_counter()
+    done = subprocess.run([sys.executable, "-c", code], cwd=HERE, capture_output=True, text=True, check=True)
+    return (time.perf_counter() - start) * 1000, done.stdout
+
+
+def import_time(module, runs):
+    """Median ms to import module, minus the median of an empty interpreter"""
+    baseline = statistics.median(run_python("pass")[0] for _ in range(runs))
+    total = statistics.median(run_python(f"import {module}")[0] for _ in range(runs))
+    return max(0.0, total - baseline)
+
+
+def loaded_early(module):
+    """Which DEFERRED_MODULES are in sys.modules right after importing module"""
+    code = (f"import sys, json, {module}\n"
+            f"print(json.dumps([m for m in {DEFERRED_MODULES!r} if m in sys.modules]))")
+    return json.loads(run_python(code)[1])
+
+
+def first_client_ms():
+    """In-process cost of building the first client, which is where the SDK import moved"""
+    code = ("import time, os\n"
+            "os.environ.setdefault('OPENAI_API_KEY', 'bench')\n"
+            "from llm_clients import get_client\n"
+            "start = time.perf_counter()\n"
+            "get_client()\n"
+            "print((time.perf_counter() - start) * 1000)")
+    return float(run_python(code)[1])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Import-time budget check for the email scripts")
+    parser.add_argument("--runs", type=int, default=9, help="interpreter starts per measurement (median)")
+    parser.add_argument("--budget-scale", type=float, default=1.0,
+                        help="multiply every budget, e.g. 2 on a slow CI machine")
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    report = {"modules": {}, "first_client_ms": None}
+    failed = False
+
+    print(f"{'MODULE':<24}{'import ms':>10}{'budget':>9}  loaded early")
+    for module, budget_ms in IMPORT_BUDGET_MS.items():
+        budget_ms *= args.budget_scale
+        elapsed = import_time(module, args.runs)
+        early = loaded_early(module)
+        ok = elapsed <= budget_ms and not early
+        failed = failed or not ok
+        report["modules"][module] = {"import_ms": round(elapsed, 1), "budget_ms": budget_ms,
+                                     "loaded_early": early, "ok": ok}
+        print(f"{module:<24}{elapsed:>10.1f}{budget_ms:>9.0f}  {', '.join(early) or '-'}"
+              f"{'' if ok else '  ❌'}")
+
+    try:
+        report["first_client_ms"] = round(first_client_ms(), 1)
+        print(f"\nFirst client build (SDK import + connection pool): {report['first_client_ms']:.1f}ms")
+    except (subprocess.CalledProcessError, ValueError) as e:
+        print(f"\n⚠️  Could not build a client: {e}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📈 Report written to {args.json}")
+
+    print("\n❌ Startup budget exceeded" if failed else "\n✅ Startup within budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,245 @@
+"""
+Offline throughput benchmark: runs the scripts against mock_openai_server.py.
+
+No real API calls are made. Example:
+    python bench_throughput.py --emails 10000 --concurrency 64 --latency-ms 300
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+FIRST_NAMES = ["john", "sarah", "mike", "lisa", "anna", "raj", "chen", "maria", "tom", "fatima"]
+DOMAINS = ["email.com", "company.com", "business.com", "techcorp.com", "example.org"]
+
+
+def synthetic_inbox(count, templates, seed=0):
+    """
+    Yield count emails built from the sample_emails.json templates.
+
+    Names, order numbers and a trailing sentence vary per email so the
+    cache does not turn the benchmark into a lookup test.
+    """
+    rng = random.Random(seed)
+    for i in range(1, count + 1):
+        template = templates[rng.randrange(len(templates))]
+        name = rng.choice(FIRST_NAMES)
+        yield {
+            "id": i,
+            "from": f"{name}.{i}@{rng.choice(DOMAINS)}",
+            "subject": template['subject'],
+            "body": f"{template['body']} Reference #{rng.randrange(10**5, 10**6)}. Regards, {name.title()}",
+            "type": template.get('type'),
+            "priority": template.get('priority')
+        }
+
+
+def start_mock_server(args):
+    """Run the mock server in a subprocess (so it does not share our GIL)"""
+    command = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "mock_openai_server.py"),
+        "--port", "0",
+        "--latency-ms", str(args.latency_ms),
+        "--jitter", str(args.jitter),
+        "--error-rate", str(args.error_rate),
+        "--rate-limit-rate", str(args.rate_limit_rate),
+        "--retry-after", str(args.retry_after),
+        "--seed", "1"
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    banner = server.stdout.readline()
+    match = re.search(r"(http://\S+/v1)", banner)
+    if not match:
+        server.kill()
+        raise RuntimeError(f"Mock server failed to start: {banner!r}")
+    return server, match.group(1)
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB (None where unsupported)"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS reports bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_function(name, call, emails, percentile):
+    """Call one blocking function per email and report its latency figures"""
+    latencies = []
+    failures = 0
+    start = time.perf_counter()
+    for email in emails:
+        call_start = time.perf_counter()
+        result = call(email)
+        latencies.append(time.perf_counter() - call_start)
+        failures += not result['success']
+    elapsed = time.perf_counter() - start
+
+    report = {
+        "emails": len(emails),
+        "failures": failures,
+        "emails_per_sec": len(emails) / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000
+    }
+    print(f"{name:<28}{report['emails_per_sec']:>9.1f}/s"
+          f"{report['p50_ms']:>9.0f}{report['p95_ms']:>9.0f}{report['p99_ms']:>9.0f}   fail={failures}")
+    return report
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Offline throughput benchmark")
+    parser.add_argument("--emails", type=int, default=1000, help="synthetic inbox size for batch mode")
+    parser.add_argument("--sync-emails", type=int, default=50,
+                        help="emails per blocking function benchmark (0 to skip)")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--combined", action="store_true", help="use single-call mode in the batch run")
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--jitter", type=float, default=0.5)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--rpm", type=int, default=1_000_000, help="scheduler requests/minute budget")
+    parser.add_argument("--tpm", type=int, default=1_000_000_000, help="scheduler tokens/minute budget")
+    parser.add_argument("--with-cache", action="store_true", help="leave the response cache on")
+    parser.add_argument("--with-fast-path", action="store_true", help="leave the local classifier on")
+    parser.add_argument("--with-prefilter", action="store_true",
+                        help="leave the newsletter/no-reply pre-filter on")
+    parser.add_argument("--cluster", action="store_true",
+                        help="answer near-duplicates from shared drafts and report the reuse rate")
+    parser.add_argument("--with-history", action="store_true",
+                        help="record and look up sender history (in a throwaway store)")
+    parser.add_argument("--trace-memory", action="store_true",
+                        help="measure Python heap peak with tracemalloc (slows the run)")
+    parser.add_argument("--json", help="also write the report to this JSON file")
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    server, base_url = start_mock_server(args)
+
+    # Must be set before the scripts are imported: clients and limits read them once
+    os.environ["OPENAI_BASE_URL"] = base_url
+    os.environ["OPENAI_API_KEY"] = "mock"
+    os.environ["OPENAI_RPM_LIMIT"] = str(args.rpm)
+    os.environ["OPENAI_TPM_LIMIT"] = str(args.tpm)
+
+    try:
+        import email_analyzer
+        import email_responder
+        import email_responder_pro as pro
+        from response_cache import cache
+        from metrics import metrics, percentile
+        from llm_scheduler import scheduler
+        from prefilter import prefilter
+        from llm_clients import configure_pool
+        from concurrency_limit import start_at
+        from context_store import context
+
+        cache.enabled = args.with_cache
+        pro.fast_path["enabled"] = args.with_fast_path
+        prefilter.enabled = args.with_prefilter
+        context.enabled = args.with_history
+        # Never the real store: every run would add to it and change the next run's prompts
+        context.path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "context.sqlite")
+
+        with open("sample_emails.json", "r", encoding="utf-8") as f:
+            templates = json.load(f)["emails"]
+
+        print(f"🧪 Mock server at {base_url} | latency {args.latency_ms:.0f}ms "
+              f"(σ={args.jitter}) | errors {args.error_rate:.0%} | 429s {args.rate_limit_rate:.0%}\n")
+
+        report = {"settings": vars(args), "functions": {}}
+
+        if args.sync_emails:
+            emails = list(synthetic_inbox(args.sync_emails, templates, seed=1))
+            analysis = {"TYPE": "support", "SENTIMENT": "negative", "PRIORITY": "high", "TONE": "apologetic"}
+            print(f"{'BLOCKING CALLS':<28}{'rate':>11}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}")
+            functions = {
+                "analyze_email": lambda e: email_analyzer.analyze_email(e['subject'], e['body']),
+                "analyze_email_quick": lambda e: pro.analyze_email_quick(e['subject'], e['body'], e['from']),
+                "generate_response": lambda e: email_responder.generate_response(
+                    e['subject'], e['body'], "professional", e.get('type') or "general"),
+                "generate_response_smart": lambda e: pro.generate_response_smart(
+                    e['subject'], e['body'], analysis)
+            }
+            for name, call in functions.items():
+                report["functions"][name] = bench_function(name, call, emails, percentile)
+
+        metrics.reset()
+        configure_pool(args.concurrency)
+        start_at(args.concurrency)
+        if args.trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        results = asyncio.run(pro.run_batch(
+            synthetic_inbox(args.emails, templates, seed=2),
+            args.concurrency,
+            combined=args.combined,
+            verbose=False,
+            cluster=args.cluster
+        ))
+        elapsed = time.perf_counter() - start
+        heap_peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024) if args.trace_memory else None
+        if args.trace_memory:
+            tracemalloc.stop()
+
+        snapshot = metrics.snapshot()["stages"]
+        failures = sum(1 for result in results if not result['success'] and not result.get('skipped'))
+        report["batch"] = {
+            "emails": len(results),
+            "failures": failures,
+            "seconds": elapsed,
+            "emails_per_sec": len(results) / elapsed if elapsed else 0.0,
+            "stages": {stage: {k: group["latency"][k] * 1000 for k in ("p50", "p95", "p99")}
+                       for stage, group in snapshot.items()},
+            "scheduler": dict(scheduler.stats),
+            "clusters": pro.session_stats["clusters"],
+            "cluster_reuses": pro.session_stats["cluster_reuses"],
+            "heap_peak_mb": heap_peak,
+            "peak_rss_mb": peak_rss_mb()
+        }
+
+        batch = report["batch"]
+        print(f"\nBATCH ({len(results)} emails, concurrency {args.concurrency}"
+              f"{', combined' if args.combined else ''}{', cluster' if args.cluster else ''})")
+        print(f"Throughput: {batch['emails_per_sec']:.1f} emails/sec ({elapsed:.1f}s) | failures: {failures}")
+        for stage, figures in batch["stages"].items():
+            print(f"  {stage:<12} p50 {figures['p50']:>7.1f}ms  p95 {figures['p95']:>7.1f}ms  "
+                  f"p99 {figures['p99']:>7.1f}ms")
+        print(f"Retries: {scheduler.stats['retries']} | Throttled: {scheduler.stats['throttled']} | "
+              f"Hedged: {scheduler.stats['hedged']} ({scheduler.stats['hedge_wins']} won)")
+        if args.cluster:
+            reuse = batch["cluster_reuses"] / len(results) if results else 0.0
+            print(f"Clusters: {batch['clusters']} | Reused drafts: {batch['cluster_reuses']} ({reuse:.0%})")
+        if heap_peak is not None:
+            print(f"Python heap peak: {heap_peak:.1f} MB")
+        if batch["peak_rss_mb"] is not None:
+            print(f"Peak RSS: {batch['peak_rss_mb']:.1f} MB")
+
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            print(f"\n📈 Report written to {args.json}")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""Append-only checkpoint journal so interrupted batch runs can resume"""
+import os
+import json
+import time
+import hashlib
+import threading
+
+DEFAULT_JOURNAL_PATH = os.getenv("EMAIL_JOURNAL_PATH", "batch_journal.jsonl")
+
+
+def email_key(email):
+    """
+    Stable key for an email: its id (if any) plus a hash of its content.
+
+    The content hash keeps keys valid when the same inbox is re-exported
+    with different ids, and the id keeps genuinely repeated emails apart.
+    """
+    content = "\0".join((email.get('from', ''), email.get('subject', ''), email.get('body', '')))
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+    email_id = email.get('id')
+    return f"{email_id}:{digest}" if email_id is not None else digest
+
+
+class CheckpointJournal:
+    """
+    JSON Lines journal of finished emails.
+
+    Every completed email is appended and flushed immediately, so after a
+    crash or Ctrl+C only the emails that were in flight are lost. Only
+    successful entries count as done; failed emails are retried on resume.
+    """
+
+    def __init__(self, path=DEFAULT_JOURNAL_PATH, fsync=False):
+        self.path = path
+        self.fsync = fsync
+        self.done = {}
+        self._file = None
+        # Draft sinks may record from a background writer thread
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read finished entries from a previous run; returns how many"""
+        self.done = {}
+        if not os.path.exists(self.path):
+            return 0
+
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # A crash mid-write can leave a truncated last line
+                    continue
+                if entry.get("success"):
+                    self.done[entry["key"]] = entry
+        return len(self.done)
+
+    def reset(self):
+        """Forget previous runs and start a new journal"""
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.done = {}
+
+    def is_done(self, key):
+        return key in self.done
+
+    def get(self, key):
+        return self.done.get(key)
+
+    def record(self, key, result):
+        """Append one finished email's result to the journal"""
+        analysis = result.get('analysis')
+        entry = {
+            "key": key,
+            "index": result.get('index'),
+            "success": result['success'],
+            "analysis": dict(analysis) if analysis is not None else None,
+            "response": result.get('response'),
+            "tokens": result.get('tokens', 0),
+            "cost": result.get('cost', 0.0),
+            "saved_to": result.get('saved_to'),
+            "error": result.get('error'),
+            "time": time.time()
+        }
+        line = json.dumps(entry) + "\n"
+
+        with self.lock:
+            if self._file is None:
+                self._file = open(self.path, "a", encoding="utf-8")
+            self._file.write(line)
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            if result['success']:
+                self.done[key] = entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
@@ -0,0 +1,196 @@
+"""Adaptive (AIMD) limit on concurrent model calls, driven by observed latency, throttling and errors"""
+import os
+import time
+import threading
+
+from metrics import metrics
+
+# Settings shared by every endpoint's limiter; maximum is per process (see worker_pool).
+# Batch mode starts at --concurrency unless OPENAI_INITIAL_CONCURRENCY is set (see start_at)
+ADAPTIVE = {
+    "enabled": os.getenv("OPENAI_ADAPTIVE_CONCURRENCY", "1") not in ("0", "false", "no"),
+    "initial": int(os.getenv("OPENAI_INITIAL_CONCURRENCY", "4")),
+    "maximum": int(os.getenv("OPENAI_MAX_CONCURRENCY", "64"))
+}
+
+# A call slower than this many times its kind's usual latency signals a queueing server
+LATENCY_TOLERANCE = float(os.getenv("OPENAI_LATENCY_TOLERANCE", "2.0"))
+# Share of recent calls failing (other than throttling/timeouts) above which the limit stops growing
+ERROR_RATE_LIMIT = 0.1
+# Share of the limit kept after a cut: lower backs off harder, higher recovers faster
+BACKOFF_FACTOR = float(os.getenv("OPENAI_CONCURRENCY_BACKOFF", "0.75"))
+# Weight of the newest sample in the latency and error-rate averages
+SMOOTHING = 0.05
+# Calls of a kind needed before its latency is judged
+MIN_SAMPLES = 10
+
+THROTTLED_STATUS = {429}
+TIMEOUT_STATUS = {408, 504}
+
+
+def start_at(concurrency):
+    """
+    Start limiters at the requested concurrency, so --concurrency 8 is not throttled to 4 at first.
+
+    An explicit OPENAI_INITIAL_CONCURRENCY wins. Limiters that have not
+    made a call yet pick the new start up too.
+
+    >>> limiter = AdaptiveLimiter("doctest")
+    >>> start_at(8)
+    >>> limiter.capacity()
+    8
+    >>> start_at(1000)
+    >>> limiter.capacity()
+    64
+    """
+    if not os.getenv("OPENAI_INITIAL_CONCURRENCY"):
+        ADAPTIVE["initial"] = max(1, concurrency)
+
+
+def congestion_of(error):
+    """"throttled", "timeout", "error" or None (success) for a finished attempt"""
+    if error is None:
+        return None
+    status = getattr(error, "status_code", None)
+    if status in THROTTLED_STATUS:
+        return "throttled"
+    if status in TIMEOUT_STATUS or type(error).__name__ in ("APITimeoutError", "TimeoutError"):
+        return "timeout"
+    return "error"
+
+
+class AdaptiveLimiter:
+    """
+    Additive-increase/multiplicative-decrease limit on calls in flight to one endpoint.
+
+    Each healthy call made while the limit was fully used raises the limit
+    by 1/limit, i.e. by one per limit's worth of calls, unless more than
+    ERROR_RATE_LIMIT of recent calls failed. A 429, a timeout or a call over
+    LATENCY_TOLERANCE times its usual latency cuts it to BACKOFF_FACTOR of
+    itself. Calls already in flight when the limit was cut were sent under
+    the old limit, so their failures do not cut it again. Calls are grouped
+    by (max_tokens, streaming) for latency, so a 50-token analysis is never
+    compared with a 400-token draft.
+
+    The current limit and every change of it are recorded in metrics.
+    """
+
+    def __init__(self, name="default"):
+        self.name = name
+        self.limit = self._initial()
+        self.in_flight = 0
+        self.cond = threading.Condition()
+        # Event-loop futures of waiting coroutines
+        self.waiters = []
+        self.latency = {}
+        self.error_rate = 0.0
+        self.last_decrease = 0.0
+        self.used = False
+
+    def _initial(self):
+        return float(max(1, min(ADAPTIVE["initial"], ADAPTIVE["maximum"])))
+
+    def capacity(self):
+        if not self.used:
+            # Settings may change after the limiter was built (start_at), until its first call
+            self.limit = self._initial()
+        return max(1, min(int(self.limit), ADAPTIVE["maximum"]))
+
+    def _enter(self, waited_since):
+        if not self.used:
+            # Limiters that never see a call (e.g. in a worker pool's parent) stay out of the metrics
+            self.used = True
+            metrics.record_limit(self.name, self.limit)
+        self.in_flight += 1
+        if waited_since is not None:
+            metrics.record_limit_wait(self.name, self.limit, time.monotonic() - waited_since)
+        return time.monotonic()
+
+    def acquire(self):
+        """Wait for a free slot; returns the call's start time, to pass to release()"""
+        if not ADAPTIVE["enabled"]:
+            return None
+        with self.cond:
+            waited_since = None
+            while self.in_flight >= self.capacity():
+                waited_since = waited_since or time.monotonic()
+                self.cond.wait()
+            return self._enter(waited_since)
+
+    def try_acquire(self):
+        """acquire() without waiting: the start time, False if every slot is taken, None when off"""
+        if not ADAPTIVE["enabled"]:
+            return None
+        with self.cond:
+            if self.in_flight >= self.capacity():
+                return False
+            return self._enter(None)
+
+    async def acquire_async(self):
+        """acquire() for coroutines: waits without blocking the event loop"""
+        if not ADAPTIVE["enabled"]:
+            return None
+        import asyncio
+        loop = asyncio.get_running_loop()
+        waited_since = None
+        while True:
+            with self.cond:
+                if self.in_flight < self.capacity():
+                    return self._enter(waited_since)
+                waited_since = waited_since or time.monotonic()
+                future = loop.create_future()
+                self.waiters.append((loop, future))
+            await future
+
+    def _wake(self):
+        # Every waiter checks again; the ones that don't fit wait again
+        self.cond.notify_all()
+        for loop, future in self.waiters:
+            loop.call_soon_threadsafe(lambda future=future: future.done() or future.set_result(None))
+        self.waiters = []
+
+    def release(self, started, seconds, kind, error=None):
+        """Free a slot and adjust the limit to how the call went (kind groups comparable calls)"""
+        if started is None:
+            return
+        with self.cond:
+            saturated = self.in_flight >= self.capacity()
+            self.in_flight -= 1
+            decision = self._decide(started, seconds, kind, congestion_of(error), saturated)
+            self._wake()
+        if decision:
+            metrics.record_limit(self.name, self.limit, *decision)
+
+    def cancel(self, started):
+        """Free the slot of a call that was cancelled, which says nothing about the endpoint"""
+        if started is None:
+            return
+        with self.cond:
+            self.in_flight -= 1
+            self._wake()
+
+    def _decide(self, started, seconds, kind, congestion, saturated):
+        """("increase"/"decrease", reason) if the limit changed, else None"""
+        self.error_rate += SMOOTHING * ((congestion == "error") - self.error_rate)
+        reason = congestion if congestion in ("throttled", "timeout") else None
+        if congestion is None:
+            count, usual = self.latency.get(kind, (0, seconds))
+            if count >= MIN_SAMPLES and seconds > LATENCY_TOLERANCE * usual:
+                reason = "slow"
+            # Slow calls count too, so a lasting change in latency becomes the new normal
+            self.latency[kind] = (count + 1, usual + SMOOTHING * (seconds - usual) if count else seconds)
+
+        if reason is not None:
+            if started < self.last_decrease or self.limit <= 1:
+                return None
+            self.limit = max(1.0, self.limit * BACKOFF_FACTOR)
+            self.last_decrease = time.monotonic()
+            return "decrease", reason
+
+        # Only grow a limit that is actually in use, while calls succeed, and not past the ceiling
+        if (congestion is not None or not saturated or self.error_rate > ERROR_RATE_LIMIT
+                or self.limit >= ADAPTIVE["maximum"]):
+            return None
+        before = self.capacity()
+        self.limit = min(float(ADAPTIVE["maximum"]), self.limit + 1.0 / self.limit)
+        return ("increase", "healthy") if self.capacity() > before else None
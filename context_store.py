@@ -0,0 +1,221 @@
+"""Local SQLite store of past emails, analyses and drafts, looked up by sender (and their thread) for reply context"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+from prompt_budget import count_tokens, clean_body
+
+DEFAULT_CONTEXT_PATH = os.getenv("EMAIL_CONTEXT_PATH", ".email_context.sqlite")
+DEFAULT_HISTORY_TOKENS = int(os.getenv("EMAIL_HISTORY_TOKENS", "300"))
+DEFAULT_HISTORY_LIMIT = int(os.getenv("EMAIL_HISTORY_LIMIT", "5"))
+
+# Stored per message; the prompt only ever sees a short excerpt
+MAX_STORED_CHARS = 4000
+# Excerpt of each earlier email and reply in the history block
+EXCERPT_CHARS = 160
+# Rows per executemany() call when importing an inbox
+IMPORT_CHUNK = 5000
+
+ADDRESS = re.compile(r"[^\s<>\"',;]+@[^\s<>\"',;]+")
+# "Re:", "Fwd:", "AW:", "Re[2]:" and "[ticket #12]"-style tags in front of a subject
+THREAD_PREFIX = re.compile(r"^(\s*((re|fw|fwd|aw|sv|antw)(\[\d+\])?\s*:|\[[^\]]*\]))+\s*", re.IGNORECASE)
+WHITESPACE = re.compile(r"\s+")
+
+
+def sender_address(sender):
+    """The lowercase email address in a From value ("Jane <Jane@X.com>" -> "jane@x.com")"""
+    match = ADDRESS.search(sender or "")
+    return (match.group(0) if match else (sender or "").strip()).lower()
+
+
+def thread_subject(subject):
+    """A subject without reply/forward prefixes and tags, so a whole thread shares one value"""
+    return WHITESPACE.sub(" ", THREAD_PREFIX.sub("", subject or "")).strip().lower()
+
+
+def message_digest(sender, subject, body):
+    """Identifies one message, so a rerun updates its row instead of adding another"""
+    content = "\0".join((sender_address(sender), subject or "", body or ""))
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+
+def excerpt(text, limit=EXCERPT_CHARS):
+    text = WHITESPACE.sub(" ", text or "").strip()
+    return text if len(text) <= limit else text[:limit - 3].rstrip() + "..."
+
+
+def message_time(email):
+    """When a message was sent, from its Date header if it has one (else now)"""
+    date = (email.get("headers") or {}).get("date")
+    if date:
+        # Only imports of mbox/Maildir inboxes have headers to parse
+        from email.utils import parsedate_to_datetime
+        try:
+            return parsedate_to_datetime(date).timestamp()
+        except (TypeError, ValueError, IndexError):
+            pass
+    return time.time()
+
+
+class ContextStore:
+    """
+    Past emails with their analyses and the drafts sent back, by sender and thread.
+
+    Lookups only ever return the same sender's rows: a thread is the
+    normalized subject, which different customers share ("Order status"),
+    so it only ranks a sender's own emails in the thread first. Rows are
+    indexed on (sender, created) and (sender, thread, created), so a
+    lookup is an index range scan (O(log n) in the number of stored
+    messages) however large the store gets. history() turns the rows into
+    a short text block for the response prompt, within a token budget.
+
+    >>> store = ContextStore(":memory:")
+    >>> store.record("ann@a.com", "Order status", "Where is my order?", draft="It ships today.")
+    >>> store.record("bob@b.com", "Order status", "Has mine shipped?")
+    >>> "ann@a.com" in store.history("bob@b.com", "Re: Order status", "Any news?")
+    False
+    >>> store.history("bob@b.com", "Re: Order status", "Any news?").count("Has mine shipped?")
+    1
+    >>> "ships today" in store.history("ann@a.com", "Order status", "Still waiting")
+    True
+    """
+
+    def __init__(self, path=DEFAULT_CONTEXT_PATH, max_tokens=DEFAULT_HISTORY_TOKENS,
+                 limit=DEFAULT_HISTORY_LIMIT, enabled=True):
+        self.path = path
+        self.max_tokens = max_tokens
+        self.limit = limit
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self._conn = None
+
+    @property
+    def conn(self):
+        # Opened on first use so importing the module never touches disk
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS interactions (
+                id INTEGER PRIMARY KEY,
+                digest TEXT NOT NULL UNIQUE,
+                sender TEXT NOT NULL,
+                thread TEXT NOT NULL,
+                created REAL NOT NULL,
+                subject TEXT NOT NULL,
+                body TEXT NOT NULL,
+                analysis TEXT,
+                draft TEXT
+            )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sender ON interactions(sender, created)")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_sender_thread ON interactions(sender, thread, created)")
+            self._conn.commit()
+        return self._conn
+
+    def _row(self, sender, subject, body, analysis, draft, created):
+        return (message_digest(sender, subject, body), sender_address(sender), thread_subject(subject),
+                created or time.time(), subject or "", clean_body(body or "")[:MAX_STORED_CHARS],
+                json.dumps(dict(analysis)) if analysis else None, draft)
+
+    def record(self, sender, subject, body, analysis=None, draft=None, created=None):
+        """Store an email (again), with its analysis and the draft sent back if any"""
+        if not self.enabled:
+            return
+        with self.lock:
+            # A later record of the same email adds what is new but keeps an earlier draft
+            self.conn.execute(
+                "INSERT INTO interactions (digest, sender, thread, created, subject, body, analysis, draft) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT(digest) DO UPDATE SET "
+                "analysis = COALESCE(excluded.analysis, analysis), draft = COALESCE(excluded.draft, draft)",
+                self._row(sender, subject, body, analysis, draft, created)
+            )
+            self.conn.commit()
+
+    def import_emails(self, emails):
+        """Bulk-load past emails (e.g. an exported mailbox) in large transactions; returns how many"""
+        count = 0
+        rows = []
+        with self.lock:
+            for email in emails:
+                rows.append(self._row(email.get("from", ""), email.get("subject", ""), email.get("body", ""),
+                                      None, email.get("response"), message_time(email)))
+                if len(rows) == IMPORT_CHUNK:
+                    count += self._insert(rows)
+                    rows = []
+            count += self._insert(rows)
+        return count
+
+    def _insert(self, rows):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO interactions (digest, sender, thread, created, subject, body, analysis, draft) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+        self.conn.commit()
+        return len(rows)
+
+    def recent(self, sender, subject, limit=None, exclude=None):
+        """
+        The last limit interactions with sender, oldest first.
+
+        The sender's emails in subject's thread are picked before their
+        other ones. exclude is the digest of the email being answered,
+        which may already be stored from an earlier run.
+        """
+        limit = limit or self.limit
+        address, thread = sender_address(sender), thread_subject(subject)
+        if not address:
+            return []
+        columns = "SELECT id, created, subject, body, analysis, draft, digest FROM interactions "
+        queries = ((columns + "WHERE sender = ? AND thread = ? ORDER BY created DESC, id DESC LIMIT ?",
+                    (address, thread, limit + 1)),
+                   (columns + "WHERE sender = ? ORDER BY created DESC, id DESC LIMIT ?", (address, limit + 1)))
+        rows = {}
+        with self.lock:
+            for query, params in queries:
+                for row in self.conn.execute(query, params):
+                    if row[6] != exclude and len(rows) < limit:
+                        rows.setdefault(row[0], row)
+        newest = sorted(rows.values(), key=lambda row: (row[1], row[0]))
+        return [{"created": row[1], "subject": row[2], "body": row[3],
+                 "analysis": json.loads(row[4]) if row[4] else None, "draft": row[5]}
+                for row in newest]
+
+    def history(self, sender, subject, body, max_tokens=None):
+        """
+        Earlier interactions with the sender, their thread first, as prompt text.
+
+        The newest ones are kept until max_tokens is used up, then listed
+        oldest first. Returns "" when the store is off or there is nothing.
+        """
+        if not self.enabled:
+            return ""
+        max_tokens = self.max_tokens if max_tokens is None else max_tokens
+        if max_tokens <= 0:
+            return ""
+
+        header = "Earlier emails with this sender (oldest first):"
+        used = count_tokens(header)
+        lines = []
+        for entry in reversed(self.recent(sender, subject, exclude=message_digest(sender, subject, body))):
+            analysis = entry["analysis"] or {}
+            label = "/".join(filter(None, (analysis.get("TYPE"), analysis.get("SENTIMENT"))))
+            line = (f"- {time.strftime('%Y-%m-%d', time.localtime(entry['created']))} "
+                    f"\"{excerpt(entry['subject'], 80)}\"{f' ({label})' if label else ''}: "
+                    f"{excerpt(entry['body'])}")
+            if entry["draft"]:
+                line += f"\n  We replied: {excerpt(entry['draft'])}"
+            cost = count_tokens(line)
+            if used + cost > max_tokens:
+                break
+            used += cost
+            lines.append(line)
+        if not lines:
+            return ""
+        return header + "\n" + "\n".join(reversed(lines))
+
+
+# Shared by the scripts; EMAIL_HISTORY_DISABLED=1 drafts without earlier context
+context = ContextStore(enabled=os.getenv("EMAIL_HISTORY_DISABLED", "") not in ("1", "true", "yes"))
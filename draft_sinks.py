@@ -0,0 +1,264 @@
+"""Output sinks for generated drafts: batched JSONL/SQLite writers and text export"""
+import os
+import json
+import queue
+import sqlite3
+import threading
+from datetime import datetime
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_OUTPUTS = {"jsonl": "drafts.jsonl", "sqlite": "drafts.sqlite", "text": "."}
+
+
+def make_record(email, analysis, response_text, tokens=0, cost=0.0):
+    """Everything worth keeping about one draft, as a JSON-friendly dict"""
+    return {
+        "email_id": email.get('id'),
+        "from": email['from'],
+        "subject": email['subject'],
+        "analysis": dict(analysis),
+        "response": response_text,
+        "tokens": tokens,
+        "cost": cost,
+        "created": datetime.now().isoformat(timespec="seconds")
+    }
+
+
+def format_text_draft(record):
+    """Render a draft in the human-readable text format of save_response()"""
+    lines = [
+        "=" * 70,
+        "EMAIL RESPONSE DRAFT",
+        f"Generated: {record['created'].replace('T', ' ')}",
+        "=" * 70,
+        "",
+        f"To: {record['from']}",
+        f"Re: {record['subject']}",
+        "",
+        "ANALYSIS:"
+    ]
+    lines += [f"  {key}: {value}" for key, value in record['analysis'].items()]
+    lines += ["", "-" * 70, "", "DRAFT RESPONSE:", "", record['response'], "", "=" * 70, ""]
+    return "\n".join(lines)
+
+
+class BatchedDraftSink:
+    """
+    Buffers drafts and writes them batch_size at a time.
+
+    write() takes an optional on_saved(location) callback that runs once
+    the draft has actually been written, so callers (like the checkpoint
+    journal) only treat a draft as done when it is on disk.
+    """
+
+    location = None
+
+    def __init__(self, batch_size=DEFAULT_BATCH_SIZE):
+        self.batch_size = max(1, batch_size)
+        self.pending = []
+        self.written = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def write(self, record, on_saved=None):
+        with self.lock:
+            self.pending.append((record, on_saved))
+            full = len(self.pending) >= self.batch_size
+        if full:
+            self.flush()
+
+    def flush(self):
+        """Write all buffered drafts now"""
+        with self.write_lock:
+            with self.lock:
+                batch, self.pending = self.pending, []
+            if not batch:
+                return
+            self._write_batch([record for record, _ in batch])
+            self.written += len(batch)
+        for _, on_saved in batch:
+            if on_saved:
+                on_saved(self.location)
+
+    def close(self):
+        self.flush()
+        self._close()
+
+    def _write_batch(self, records):
+        raise NotImplementedError
+
+    def _close(self):
+        pass
+
+
+class JsonlDraftSink(BatchedDraftSink):
+    """Appends drafts to one JSON Lines file"""
+
+    def __init__(self, path=DEFAULT_OUTPUTS["jsonl"], batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.location = path
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _write_batch(self, records):
+        self.file.write("".join(json.dumps(record) + "\n" for record in records))
+        self.file.flush()
+
+    def _close(self):
+        self.file.close()
+
+
+class SqliteDraftSink(BatchedDraftSink):
+    """Stores drafts in a SQLite table, one transaction per batch"""
+
+    def __init__(self, path=DEFAULT_OUTPUTS["sqlite"], batch_size=DEFAULT_BATCH_SIZE):
+        super().__init__(batch_size)
+        self.location = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS drafts (
+            id INTEGER PRIMARY KEY,
+            email_id TEXT,
+            sender TEXT,
+            subject TEXT,
+            type TEXT,
+            priority TEXT,
+            analysis TEXT,
+            response TEXT,
+            tokens INTEGER,
+            cost REAL,
+            created TEXT
+        )""")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_drafts_sender ON drafts(sender)")
+        self.conn.commit()
+
+    def _write_batch(self, records):
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO drafts (email_id, sender, subject, type, priority, analysis, "
+                "response, tokens, cost, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(
+                    None if r['email_id'] is None else str(r['email_id']),
+                    r['from'],
+                    r['subject'],
+                    r['analysis'].get("TYPE"),
+                    r['analysis'].get("PRIORITY"),
+                    json.dumps(r['analysis']),
+                    r['response'],
+                    r['tokens'],
+                    r['cost'],
+                    r['created']
+                ) for r in records]
+            )
+
+    def _close(self):
+        self.conn.close()
+
+
+class TextDraftExporter:
+    """
+    One human-readable .txt file per draft (the original save format).
+
+    Filenames get a numeric suffix instead of overwriting when two drafts
+    for the same sender land in the same second.
+    """
+
+    def __init__(self, directory=DEFAULT_OUTPUTS["text"], prefix="response"):
+        self.directory = directory
+        self.prefix = prefix
+        self.written = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def write(self, record, on_saved=None):
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        sender = record['from'].split('@')[0]
+        base = os.path.join(self.directory, f"{self.prefix}_{timestamp}_{sender}")
+
+        suffix = 1
+        while True:
+            filename = f"{base}.txt" if suffix == 1 else f"{base}_{suffix}.txt"
+            try:
+                # O_EXCL makes the existence check and create one atomic step
+                fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+                break
+            except FileExistsError:
+                suffix += 1
+
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(format_text_draft(record))
+
+        self.written += 1
+        if on_saved:
+            on_saved(filename)
+        return filename
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class BackgroundDraftWriter:
+    """
+    Runs a sink on a background thread so writes never block the pipeline.
+
+    Buffered drafts are also flushed after flush_interval seconds without
+    new drafts, so a slow trickle still reaches disk promptly.
+    """
+
+    def __init__(self, sink, flush_interval=2.0, max_queue=10000):
+        self.sink = sink
+        self.location = getattr(sink, "location", None)
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue(max_queue)
+        self.error = None
+        self.thread = threading.Thread(target=self._run, name="draft-writer", daemon=True)
+        self.thread.start()
+
+    @property
+    def written(self):
+        return self.sink.written
+
+    def _run(self):
+        while True:
+            try:
+                item = self.queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                self._safely(self.sink.flush)
+                continue
+            if item is None:
+                break
+            self._safely(self.sink.write, *item)
+        self._safely(self.sink.close)
+
+    def _safely(self, action, *args):
+        try:
+            action(*args)
+        except Exception as e:
+            # Surface the first failure on close() instead of killing the thread
+            self.error = self.error or e
+
+    def write(self, record, on_saved=None):
+        self.queue.put((record, on_saved))
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        if self.error:
+            raise self.error
+
+
+def open_sink(kind="jsonl", path=None, batch_size=DEFAULT_BATCH_SIZE, background=False):
+    """Create a draft sink: kind is jsonl, sqlite or text"""
+    path = path or DEFAULT_OUTPUTS[kind]
+    if kind == "jsonl":
+        sink = JsonlDraftSink(path, batch_size)
+    elif kind == "sqlite":
+        sink = SqliteDraftSink(path, batch_size)
+    elif kind == "text":
+        sink = TextDraftExporter(path)
+    else:
+        raise ValueError(f"Unknown output format: {kind} (choose from {', '.join(DEFAULT_OUTPUTS)})")
+    return BackgroundDraftWriter(sink) if background else sink
@@ -1,22 +1,28 @@
-import os
 import json
-from openai import OpenAI
-from dotenv import load_dotenv
+from env_file import load_env
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Before the other imports: they read their settings from the environment
+load_env()
 
-def load_sample_emails():
-    """Load sample emails from JSON file"""
+from llm_clients import stage_timeout, hedge_delay
+from model_backends import model_for, client_for, scheduler_for, scheduler_stats, cost_of
+from response_cache import cache, make_key
+from email_sources import read_emails, DEFAULT_INBOX
+from analysis_record import parse_analysis
+from prompt_templates import prompts
+
+def load_sample_emails(path=DEFAULT_INBOX):
+    """Load emails from the inbox (JSON, JSON Lines, mbox or Maildir)"""
     try:
-        with open("sample_emails.json", "r") as f:
-            data = json.load(f)
-            return data["emails"]
+        return list(read_emails(path))
     except FileNotFoundError:
-        print("❌ Error: sample_emails.json not found!")
+        print(f"❌ Error: {path} not found!")
         return []
     except json.JSONDecodeError:
-        print("❌ Error: Invalid JSON in sample_emails.json!")
+        print(f"❌ Error: Invalid JSON in {path}!")
+        return []
+    except ValueError as e:
+        print(f"❌ Error: {e}")
         return []
 
 def analyze_email(email_subject, email_body):
@@ -28,35 +34,34 @@ def analyze_email(email_subject, email_body):
     - Key points to address
     """
     
-    analysis_prompt = f"""Analyze this email and provide a structured analysis:
-
-Subject: {email_subject}
-Body: {email_body}
-
-Provide the analysis in this exact format:
-TYPE: [support/sales/general/feedback/newsletter/other]
-SENTIMENT: [positive/negative/neutral/angry/urgent]
-PRIORITY: [low/medium/high/urgent]
-KEY_POINTS: [list 2-3 main points to address in response]
-TONE_RECOMMENDATION: [professional/friendly/apologetic/enthusiastic]
-
-Be concise and clear."""
+    template = prompts.get("detailed-analysis")
+    key = make_key(model_for("analysis"), template.cache_version, 0.3, email_subject, email_body)
+    cached = cache.get(key)
+    if cached:
+        return {
+            "success": True,
+            "analysis": cached["content"],
+            "tokens": 0,
+            "cost": 0.0,
+            "cached": True
+        }
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an expert email analyst. Analyze emails quickly and accurately."},
-                {"role": "user", "content": analysis_prompt}
-            ],
+        response = scheduler_for("analysis").call(
+            client_for("analysis").chat.completions.create,
+            hedge_after=hedge_delay("analysis"),
+            timeout=stage_timeout("analysis"),
+            model=model_for("analysis"),
+            messages=template.messages(email_subject, email_body),
             temperature=0.3,  # Low temperature for consistent analysis
             max_tokens=200
         )
         
         analysis = response.choices[0].message.content
         tokens = response.usage.total_tokens
-        cost = (response.usage.prompt_tokens / 1000) * 0.00015 + \
-               (response.usage.completion_tokens / 1000) * 0.0006
+        cost = cost_of(model_for("analysis"), response.usage)
+        prompts.record(template, response.usage)
+        cache.put(key, {"content": analysis, "tokens": tokens, "cost": cost})
         
         return {
             "success": True,
@@ -71,18 +76,6 @@ Be concise and clear."""
             "error": str(e)
         }
 
-def parse_analysis(analysis_text):
-    """Parse the structured analysis into a dictionary"""
-    parsed = {}
-    
-    lines = analysis_text.strip().split('\n')
-    for line in lines:
-        if ':' in line:
-            key, value = line.split(':', 1)
-            parsed[key.strip()] = value.strip()
-    
-    return parsed
-
 def display_email(email, index):
     """Display email in a nice format"""
     print("\n" + "=" * 70)
@@ -123,15 +116,16 @@ def display_analysis(analysis_dict):
         "urgent": "🔴"
     }
     
+    # Values of an Analysis record are already normalized labels
     for key, value in analysis_dict.items():
         if key == "TYPE":
-            emoji = type_emoji.get(value.lower().split('/')[0], "📧")
+            emoji = type_emoji.get(value, "📧")
             print(f"{emoji} {key}: {value}")
         elif key == "SENTIMENT":
-            emoji = sentiment_emoji.get(value.lower().split('/')[0], "😐")
+            emoji = sentiment_emoji.get(value, "😐")
             print(f"{emoji} {key}: {value}")
         elif key == "PRIORITY":
-            emoji = priority_emoji.get(value.lower(), "⚪")
+            emoji = priority_emoji.get(value, "⚪")
             print(f"{emoji} {key}: {value}")
         else:
             print(f"   {key}: {value}")
@@ -168,7 +162,8 @@ def main():
             parsed = parse_analysis(result['analysis'])
             display_analysis(parsed)
             
-            print(f"\n💰 Cost: ${result['cost']:.6f} | Tokens: {result['tokens']}")
+            cached_note = " (cached)" if result.get('cached') else ""
+            print(f"\n💰 Cost: ${result['cost']:.6f} | Tokens: {result['tokens']}{cached_note}")
             total_cost += result['cost']
         else:
             print(f"\n❌ Analysis failed: {result['error']}")
@@ -186,6 +181,14 @@ def main():
     print(f"Emails analyzed: {i}")
     print(f"Total cost: ${total_cost:.6f}")
     print(f"Average cost per email: ${total_cost/i:.6f}")
+    if cache.stats['hits']:
+        print(f"Cache hits: {cache.stats['hits']} ({cache.hit_rate()*100:.0f}%) | Saved: ${cache.stats['saved_cost']:.6f}")
+    cached, prompt_tokens, cached_share = prompts.cached_share()
+    if cached:
+        print(f"Prompt tokens from provider cache: {cached}/{prompt_tokens} ({cached_share:.0%})")
+    api = scheduler_stats()
+    if api['retries'] or api['throttled']:
+        print(f"API retries: {api['retries']} | Throttled calls: {api['throttled']}")
     print("=" * 70)
 
 if __name__ == "__main__":
@@ -1,17 +1,19 @@
-import os
-import json
-from openai import OpenAI
-from dotenv import load_dotenv
+from env_file import load_env
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Before the other imports: they read their settings from the environment
+load_env()
 
-def load_sample_emails():
-    """Load sample emails from JSON file"""
+from llm_clients import stage_timeout, hedge_delay
+from model_backends import model_for, client_for, scheduler_for, scheduler_stats, cost_of
+from response_cache import cache, make_key
+from email_sources import read_emails, DEFAULT_INBOX
+from prefilter import prefilter, SKIP
+from prompt_templates import prompts, DETAILED_PERSONAS, TONE_INSTRUCTIONS
+
+def load_sample_emails(path=DEFAULT_INBOX):
+    """Load emails from the inbox (JSON, JSON Lines, mbox or Maildir)"""
     try:
-        with open("sample_emails.json", "r") as f:
-            data = json.load(f)
-            return data["emails"]
+        return list(read_emails(path))
     except Exception as e:
         print(f"❌ Error loading emails: {e}")
         return []
@@ -27,71 +29,41 @@ def generate_response(email_subject, email_body, tone="professional", email_type
         email_type: Type of email (support, sales, general, etc.)
     """
     
-    # System prompts for different scenarios
-    system_prompts = {
-        "support": """You are a helpful customer support representative. Generate professional, 
-                     empathetic email responses that address the customer's concerns clearly. 
-                     Always acknowledge their issue, provide helpful information, and offer next steps.""",
-        
-        "sales": """You are a friendly sales representative. Generate engaging email responses 
-                   that answer questions, highlight value, and move conversations forward. 
-                   Be enthusiastic but not pushy.""",
-        
-        "general": """You are a professional business communicator. Generate clear, concise 
-                     email responses that address all points raised while maintaining a 
-                     courteous and professional tone.""",
-        
-        "urgent": """You are responding to an urgent matter. Generate a response that acknowledges 
-                    the urgency, apologizes for any delays, and provides immediate next steps. 
-                    Be empathetic but solution-focused.""",
-        
-        "feedback": """You are responding to customer feedback. Generate a warm, appreciative 
-                      response that thanks them sincerely and reinforces their decision to 
-                      share their experience."""
-    }
-    
-    system_prompt = system_prompts.get(email_type, system_prompts["general"])
-    
-    # Tone adjustments
-    tone_instructions = {
-        "professional": "Keep the tone strictly professional and formal.",
-        "friendly": "Use a warm, friendly tone while remaining professional.",
-        "apologetic": "Be apologetic and empathetic. Acknowledge mistakes if any.",
-        "enthusiastic": "Be enthusiastic and energetic while staying professional."
-    }
-    
-    tone_instruction = tone_instructions.get(tone, tone_instructions["professional"])
-    
-    user_prompt = f"""Generate a response to this email:
-
-Subject: {email_subject}
-Body: {email_body}
-
-Tone requirement: {tone_instruction}
-
-Generate a complete, ready-to-send email response including:
-- Appropriate greeting
-- Clear response addressing all points
-- Professional sign-off
-- Do NOT include "Subject:" line (we'll keep the same subject)
+    template = prompts.get("basic-response")
+    messages = template.messages(
+        email_subject, email_body,
+        persona=DETAILED_PERSONAS.get(email_type, DETAILED_PERSONAS["general"]),
+        tone_instruction=TONE_INSTRUCTIONS.get(tone, TONE_INSTRUCTIONS["professional"])
+    )
 
-Keep the response concise (2-4 paragraphs)."""
+    key = make_key(model_for("generation"), template.cache_version, 0.7, email_subject, email_body,
+                   tone=tone, email_type=email_type)
+    cached = cache.get(key)
+    if cached:
+        return {
+            "success": True,
+            "response": cached["content"],
+            "tokens": 0,
+            "cost": 0.0,
+            "cached": True
+        }
 
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+        response = scheduler_for("generation").call(
+            client_for("generation").chat.completions.create,
+            hedge_after=hedge_delay("generation"),
+            timeout=stage_timeout("generation"),
+            model=model_for("generation"),
+            messages=messages,
             temperature=0.7,
             max_tokens=400
         )
         
         generated_response = response.choices[0].message.content
         tokens = response.usage.total_tokens
-        cost = (response.usage.prompt_tokens / 1000) * 0.00015 + \
-               (response.usage.completion_tokens / 1000) * 0.0006
+        cost = cost_of(model_for("generation"), response.usage)
+        prompts.record(template, response.usage)
+        cache.put(key, {"content": generated_response, "tokens": tokens, "cost": cost})
         
         return {
             "success": True,
@@ -152,6 +124,14 @@ def main():
     for i, email in enumerate(emails, 1):
         display_email(email, i)
         
+        # Newsletters and no-reply senders never get a reply: don't pay for one
+        decision = prefilter.check(email)
+        if decision:
+            action, rule = decision
+            prefilter.record(email, action, rule)
+            print(f"\n⏭️  {'Skipped' if action == SKIP else 'Deferred'} by pre-filter ({rule})")
+            continue
+        
         # Determine tone and type
         if mode == "2":
             print("\nChoose tone for response:")
@@ -192,7 +172,8 @@ def main():
         
         if result['success']:
             display_response(result['response'])
-            print(f"\n💰 Cost: ${result['cost']:.6f} | Tokens: {result['tokens']}")
+            cached_note = " (cached)" if result.get('cached') else ""
+            print(f"\n💰 Cost: ${result['cost']:.6f} | Tokens: {result['tokens']}{cached_note}")
             total_cost += result['cost']
             responses_generated += 1
             
@@ -223,7 +204,20 @@ def main():
     print(f"Total cost: ${total_cost:.6f}")
     if responses_generated > 0:
         print(f"Average cost per response: ${total_cost/responses_generated:.6f}")
+    filtered = prefilter.stats['skipped'] + prefilter.stats['deferred']
+    if filtered:
+        saved = f" | Saved: ~${filtered * total_cost / responses_generated:.6f}" if responses_generated else ""
+        print(f"Pre-filtered: {prefilter.stats['skipped']} skipped, {prefilter.stats['deferred']} deferred{saved}")
+    if cache.stats['hits']:
+        print(f"Cache hits: {cache.stats['hits']} ({cache.hit_rate()*100:.0f}%) | Saved: ${cache.stats['saved_cost']:.6f}")
+    cached, prompt_tokens, cached_share = prompts.cached_share()
+    if cached:
+        print(f"Prompt tokens from provider cache: {cached}/{prompt_tokens} ({cached_share:.0%})")
+    api = scheduler_stats()
+    if api['retries'] or api['throttled']:
+        print(f"API retries: {api['retries']} | Throttled calls: {api['throttled']}")
     print("=" * 70)
+    prefilter.close()
 
 if __name__ == "__main__":
     try:
@@ -1,68 +1,323 @@
 import os
+import sys
 import json
+import argparse
+import time
 from datetime import datetime
-from openai import OpenAI
-from dotenv import load_dotenv
+from types import SimpleNamespace
+from env_file import load_env
 
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Before the other imports: they read their settings from the environment
+load_env()
+
+from llm_scheduler import estimate_tokens
+from llm_clients import configure_pool, stage_timeout, hedge_delay, HEDGING
+from concurrency_limit import ADAPTIVE, start_at
+from response_cache import cache, make_key
+from fast_classifier import get_classifier, DEFAULT_THRESHOLD
+from email_sources import read_emails, DEFAULT_INBOX, READERS
+from checkpoint_journal import CheckpointJournal, email_key, DEFAULT_JOURNAL_PATH
+from metrics import metrics
+from priority_queue import (AgingPriorityQueue, priority_of, PRIORITY_RANK, DEFAULT_AGING_SECONDS,
+                            DEFAULT_LOOKAHEAD)
+from worker_pool import run_workers
+from prefilter import prefilter, load_rules, SKIP
+from prompt_budget import budget, count_tokens, FIT_MODES
+from near_duplicates import (NearDuplicateIndex, personalize, renumber, names_sender, sender_first_name,
+                             DEFAULT_THRESHOLD as DEFAULT_CLUSTER_THRESHOLD)
+from prompt_templates import prompts, PERSONAS, SENTIMENT_INSTRUCTIONS
+from model_backends import (model_for, client_for, async_client_for, scheduler_for, scheduler_stats,
+                            cost_of, configure_backend, describe, DEFAULT_MODEL)
+from context_store import context
+from prefetch import Prefetcher, DEFAULT_DEPTH as DEFAULT_PREFETCH_DEPTH
+from batch_jobs import (run_job, usage_of, OpenAIBatchBackend, LocalBatchBackend, DEFAULT_BATCH_DIR,
+                        DEFAULT_POLL_SECONDS, DEFAULT_BACKEND as DEFAULT_BATCH_BACKEND)
+from analysis_record import Analysis, parse_analysis, EmailType, Sentiment, Priority, Tone
+from draft_sinks import open_sink, make_record, TextDraftExporter, DEFAULT_OUTPUTS, DEFAULT_BATCH_SIZE
+
+# Default number of emails in flight in batch mode
+DEFAULT_MAX_IN_FLIGHT = 8
+
+# Prompt template used by each stage (see prompt_templates)
+STAGE_TEMPLATES = {"analysis": "analysis", "generation": "response", "combined": "combined"}
+
+# Allowed values for the combined mode's JSON fields (None = any text)
+COMBINED_SCHEMA = {
+    "type": {"support", "sales", "general", "feedback", "urgent", "newsletter"},
+    "sentiment": {"positive", "negative", "neutral", "angry"},
+    "priority": {"low", "medium", "high", "urgent"},
+    "tone": {"professional", "friendly", "apologetic", "enthusiastic"},
+    "response": None
+}
+
+# Local classifier settings: analyses at or above the threshold skip the LLM
+fast_path = {
+    "enabled": os.getenv("FAST_CLASSIFIER_DISABLED", "") not in ("1", "true", "yes"),
+    "threshold": DEFAULT_THRESHOLD
+}
+
+# Interactive mode streams drafts into the response card as they are written
+streaming = {"enabled": os.getenv("EMAIL_STREAMING", "1") not in ("0", "false", "no")}
+
+# Interactive mode analyzes (and with drafts=True, drafts) this many emails ahead; 0 = off
+prefetching = {"depth": DEFAULT_PREFETCH_DEPTH, "drafts": False, "stats": None}
 
 # Session tracking
 session_stats = {
     "emails_processed": 0,
     "responses_generated": 0,
     "total_cost": 0.0,
+    "cache_hits": 0,
+    "cache_misses": 0,
+    "cache_saved_cost": 0.0,
+    "fast_path_hits": 0,
+    "combined_fallbacks": 0,
+    "clusters": 0,
+    "cluster_reuses": 0,
+    "cluster_saved_cost": 0.0,
+    "emails_resumed": 0,
+    "history_lookups": 0,
+    "history_hits": 0,
+    "history_tokens": 0,
     "start_time": datetime.now()
 }
 
-def load_sample_emails():
-    """Load sample emails from JSON file"""
+def count_stat(key, amount=1):
+    """Add to a session statistic; the prefetch thread counts too, so this takes the metrics lock"""
+    with metrics.lock:
+        session_stats[key] += amount
+
+def load_sample_emails(path=DEFAULT_INBOX, fmt=None):
+    """Load all emails from the inbox into a list (for interactive mode)"""
     try:
-        with open("sample_emails.json", "r") as f:
-            data = json.load(f)
-            return data["emails"]
+        return list(read_emails(path, fmt))
     except Exception as e:
         print(f"❌ Error loading emails: {e}")
         return []
 
-def analyze_email_quick(subject, body):
-    """Quick email analysis to determine type, sentiment, priority"""
+def build_analysis_messages(subject, body, record=True):
+    """Build the chat messages for the quick analysis call"""
+    return prompts.get("analysis").messages(subject, budget.fit("analysis", body, record))
+
+def calculate_cost(stage, usage):
+    """Calculate the dollar cost of a completion from its usage, at the stage's model price"""
+    return cost_of(model_for(stage), usage)
+
+def estimate_email_cost(email):
+    """Rough cost of analyzing and answering email, used to report pre-filter savings"""
+    analysis_tokens = estimate_tokens(build_analysis_messages(email['subject'], email['body'], False))
+    response_tokens = estimate_tokens(build_response_messages(email['subject'], email['body'], Analysis(), False))
+    # Assume the completions use their full max_tokens
+    return calculate_cost("analysis", SimpleNamespace(prompt_tokens=analysis_tokens, completion_tokens=50)) + \
+           calculate_cost("generation", SimpleNamespace(prompt_tokens=response_tokens, completion_tokens=400))
+
+def prefiltered_result(index, email):
+    """Result for an email the pre-filter skips or defers, or None to process it"""
+    decision = prefilter.check(email)
+    if decision is None:
+        return None
     
-    analysis_prompt = f"""Analyze this email briefly:
+    action, rule = decision
+    prefilter.record(email, action, rule, estimate_email_cost(email))
+    return {
+        "index": index,
+        "email": email,
+        "success": False,
+        "skipped": action,
+        "rule": rule,
+        "error": f"{'Skipped' if action == SKIP else 'Deferred'} by pre-filter ({rule})"
+    }
 
-Subject: {subject}
-Body: {body}
+def email_type_of(analysis):
+    """TYPE label used to group metrics"""
+    return (Analysis.from_dict(analysis).type or EmailType.GENERAL).value
 
-Return ONLY these 4 lines (no extra text):
-TYPE: [support/sales/general/feedback/urgent]
-SENTIMENT: [positive/negative/neutral/angry]
-PRIORITY: [low/medium/high/urgent]
-TONE: [professional/friendly/apologetic/enthusiastic]"""
+class StageTimer:
+    """Seconds since start(); started at creation in case the call never gets a slot"""
+    
+    def __init__(self):
+        self.begin = time.perf_counter()
+    
+    def start(self):
+        self.begin = time.perf_counter()
+    
+    def seconds(self):
+        return time.perf_counter() - self.begin
+
+def call_model(stage, **kwargs):
+    """
+    Make a chat completion through the scheduler and time it.
+    
+    Returns (response, seconds). The timer starts once the call has its
+    concurrency slot, so waiting for the rate limits or a slot is not
+    stage latency; retries are. Failures are counted in the metrics under
+    stage and re-raised.
+    """
+    kwargs.setdefault("model", model_for(stage))
+    timer = StageTimer()
+    try:
+        response = scheduler_for(stage).call(client_for(stage).chat.completions.create,
+                                             hedge_after=hedge_delay(stage), on_start=timer.start,
+                                             timeout=stage_timeout(stage), **kwargs)
+    except Exception as e:
+        metrics.record_error(stage, e)
+        raise
+    prompts.record(prompts.get(STAGE_TEMPLATES[stage]), response.usage)
+    return response, timer.seconds()
+
+def stream_model(stage, on_text, **kwargs):
+    """
+    Streaming version of call_model: on_text(piece) sees the reply as it arrives.
+    
+    Returns (text, usage, seconds, seconds to first token). Streams are
+    never hedged, since a backup stream would bill every token twice. If
+    the server does not report usage for streams, it is estimated.
+    """
+    kwargs.setdefault("model", model_for(stage))
+    timer = StageTimer()
+    pieces = []
+    usage = None
+    first_token = None
+    try:
+        # Closing the stream also frees its concurrency slot if on_text raises
+        with scheduler_for(stage).call(client_for(stage).chat.completions.create, on_start=timer.start,
+                                       timeout=stage_timeout(stage), stream=True,
+                                       stream_options={"include_usage": True}, **kwargs) as stream:
+            for chunk in stream:
+                if chunk.usage is not None:
+                    usage = chunk.usage
+                piece = chunk.choices[0].delta.content if chunk.choices else None
+                if piece:
+                    if first_token is None:
+                        first_token = timer.seconds()
+                    pieces.append(piece)
+                    on_text(piece)
+    except Exception as e:
+        metrics.record_error(stage, e)
+        raise
+    
+    seconds = timer.seconds()
+    text = "".join(pieces)
+    if usage is None:
+        prompt_tokens = estimate_tokens(kwargs.get("messages", []))
+        completion_tokens = estimate_tokens([{"content": text}])
+        usage = SimpleNamespace(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+                                total_tokens=prompt_tokens + completion_tokens)
+    if first_token is None:
+        first_token = seconds
+    metrics.record_stream(stage, first_token, seconds - first_token, usage.completion_tokens)
+    prompts.record(prompts.get(STAGE_TEMPLATES[stage]), usage)
+    return text, usage, seconds, first_token
+
+async def call_model_async(stage, **kwargs):
+    """Async version of call_model"""
+    kwargs.setdefault("model", model_for(stage))
+    timer = StageTimer()
+    try:
+        response = await scheduler_for(stage).call_async(async_client_for(stage).chat.completions.create,
+                                                         hedge_after=hedge_delay(stage), on_start=timer.start,
+                                                         timeout=stage_timeout(stage), **kwargs)
+    except Exception as e:
+        metrics.record_error(stage, e)
+        raise
+    prompts.record(prompts.get(STAGE_TEMPLATES[stage]), response.usage)
+    return response, timer.seconds()
+
+def lookup_cache(key):
+    """Look up a cached model result and record the hit/miss in session_stats"""
+    cached = cache.get(key)
+    if cached is None:
+        count_stat("cache_misses")
+    else:
+        count_stat("cache_hits")
+        count_stat("cache_saved_cost", cached["cost"])
+    return cached
+
+def analysis_cache_key(subject, body):
+    """Cache key for a quick analysis (of the trimmed body the prompt really contains)"""
+    return make_key(model_for("analysis"), prompts.get("analysis").cache_version, 0.3, subject,
+                    budget.fit("analysis", body, record=False))
+
+def response_cache_key(subject, body, analysis, sender="", history=""):
+    """Cache key for a smart response; the analysis, sender name and history shape the prompt"""
+    return make_key(model_for("generation"), prompts.get("response").cache_version, 0.7, subject,
+                    budget.fit("generation", body, record=False), analysis=dict(Analysis.from_dict(analysis)),
+                    sender=sender_first_name(sender), history=history)
+
+def history_for(subject, body, sender):
+    """Earlier emails with the sender or in the thread, for the response prompt (see context_store)"""
+    if not context.enabled or not sender:
+        return ""
+    history = context.history(sender, subject, body)
+    count_stat("history_lookups")
+    if history:
+        count_stat("history_hits")
+        count_stat("history_tokens", count_tokens(history))
+    return history
+
+def record_interaction(email, analysis, draft=None):
+    """Remember an answered email (and the draft, once kept) as context for later replies"""
+    with metrics.timer("history"):
+        context.record(email['from'], email['subject'], email['body'], analysis, draft)
+
+def classify_locally(subject, body, sender=""):
+    """Return a local analysis result if the classifier is confident enough"""
+    if not fast_path["enabled"]:
+        return None
+    
+    classifier = get_classifier()
+    if not classifier.usable:
+        return None
+    analysis, confidence = classifier.classify(subject, body, sender)
+    if confidence < fast_path["threshold"]:
+        return None
+    
+    count_stat("fast_path_hits")
+    return {
+        "success": True,
+        "analysis": analysis,
+        "tokens": 0,
+        "cost": 0.0,
+        "local": True,
+        "confidence": confidence
+    }
 
+def analyze_email_quick(subject, body, sender=""):
+    """Quick email analysis to determine type, sentiment, priority"""
+    
+    local = classify_locally(subject, body, sender)
+    if local:
+        return local
+    
+    key = analysis_cache_key(subject, body)
+    cached = lookup_cache(key)
+    if cached:
+        return {
+            "success": True,
+            "analysis": parse_analysis(cached["content"]),
+            "tokens": 0,
+            "cost": 0.0,
+            "cached": True
+        }
+    
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an email analyst. Be concise."},
-                {"role": "user", "content": analysis_prompt}
-            ],
+        response, latency = call_model(
+            "analysis",
+            messages=build_analysis_messages(subject, body),
             temperature=0.3,
             max_tokens=50
         )
         
         analysis = response.choices[0].message.content
         tokens = response.usage.total_tokens
-        cost = (response.usage.prompt_tokens / 1000) * 0.00015 + \
-               (response.usage.completion_tokens / 1000) * 0.0006
+        cost = calculate_cost("analysis", response.usage)
         
         # Parse analysis
-        parsed = {}
-        for line in analysis.strip().split('\n'):
-            if ':' in line:
-                key, value = line.split(':', 1)
-                parsed[key.strip()] = value.strip()
+        parsed = parse_analysis(analysis)
+        cache.put(key, {"content": analysis, "tokens": tokens, "cost": cost})
+        metrics.record_call("analysis", latency, response.usage, cost, email_type_of(parsed))
         
-        session_stats["total_cost"] += cost
+        count_stat("total_cost", cost)
         
         return {
             "success": True,
@@ -77,60 +332,175 @@ TONE: [professional/friendly/apologetic/enthusiastic]"""
             "error": str(e)
         }
 
-def generate_response_smart(subject, body, analysis):
-    """Generate smart response based on analysis"""
-    
-    email_type = analysis.get("TYPE", "general").lower().split('/')[0]
-    recommended_tone = analysis.get("TONE", "professional").lower().split('/')[0]
-    sentiment = analysis.get("SENTIMENT", "neutral").lower()
-    priority = analysis.get("PRIORITY", "medium").lower()
-    
-    # System prompt based on analysis
-    system_prompts = {
-        "support": "You are a helpful customer support rep. Be empathetic and solution-focused.",
-        "sales": "You are a friendly sales rep. Be enthusiastic and informative.",
-        "urgent": "You are handling an urgent matter. Be apologetic and provide immediate solutions.",
-        "feedback": "You are responding to feedback. Be grateful and warm.",
-        "general": "You are a professional communicator. Be clear and courteous."
-    }
+async def analyze_email_quick_async(subject, body, sender=""):
+    """Async version of analyze_email_quick for batch mode"""
     
-    system_prompt = system_prompts.get(email_type, system_prompts["general"])
+    local = classify_locally(subject, body, sender)
+    if local:
+        return local
     
-    # Add sentiment-based instructions
-    sentiment_instructions = ""
-    if "angry" in sentiment or "negative" in sentiment:
-        sentiment_instructions = " The sender seems upset, so be extra empathetic and apologetic."
-    elif "positive" in sentiment:
-        sentiment_instructions = " The sender seems happy, so match their positive energy."
+    key = analysis_cache_key(subject, body)
+    cached = lookup_cache(key)
+    if cached:
+        return {
+            "success": True,
+            "analysis": parse_analysis(cached["content"]),
+            "tokens": 0,
+            "cost": 0.0,
+            "cached": True
+        }
     
-    user_prompt = f"""Generate a response to this email:
-
-Subject: {subject}
-Body: {body}
+    try:
+        response, latency = await call_model_async(
+            "analysis",
+            messages=build_analysis_messages(subject, body),
+            temperature=0.3,
+            max_tokens=50
+        )
+        
+        analysis = response.choices[0].message.content
+        tokens = response.usage.total_tokens
+        cost = calculate_cost("analysis", response.usage)
+        
+        parsed = parse_analysis(analysis)
+        cache.put(key, {"content": analysis, "tokens": tokens, "cost": cost})
+        metrics.record_call("analysis", latency, response.usage, cost, email_type_of(parsed))
+        
+        # Safe without a lock: the event loop runs one coroutine at a time
+        count_stat("total_cost", cost)
+        
+        return {
+            "success": True,
+            "analysis": parsed,
+            "tokens": tokens,
+            "cost": cost
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
 
-Context: This is a {email_type} email with {sentiment} sentiment and {priority} priority.
-Tone: Use a {recommended_tone} tone.{sentiment_instructions}
+def build_response_messages(subject, body, analysis, record=True, sender="", history=""):
+    """Build the chat messages for smart response generation"""
+    body = budget.fit("generation", body, record)
+    # Plain {"TYPE": ...} dicts from callers are normalized the same way
+    analysis = Analysis.from_dict(analysis)
+    
+    email_type = analysis.type or EmailType.GENERAL
+    sentiment = analysis.sentiment or Sentiment.NEUTRAL
+    return prompts.get("response").messages(
+        subject, body,
+        persona=PERSONAS.get(email_type, PERSONAS["general"]),
+        email_type=email_type,
+        sentiment=sentiment,
+        priority=analysis.priority or Priority.MEDIUM,
+        tone=analysis.tone or Tone.PROFESSIONAL,
+        sentiment_instructions=SENTIMENT_INSTRUCTIONS.get(sentiment, ""),
+        sender_name=sender_first_name(sender) or "unknown (use a neutral greeting)",
+        history="\n" + history if history else ""
+    )
 
-Generate a complete, ready-to-send response (2-4 paragraphs). Include greeting and sign-off."""
+def generate_response_smart(subject, body, analysis, sender="", on_text=None):
+    """
+    Generate smart response based on analysis
+    
+    The prompt includes the sender's name and earlier emails with them or
+    in the same thread, from the context store.
+    
+    With on_text, the draft is streamed: on_text(piece) is called as it
+    arrives (once with the whole draft on a cache hit), and the result
+    also has "ttft" (seconds to first token) and "tokens_per_second".
+    """
+    
+    history = history_for(subject, body, sender)
+    key = response_cache_key(subject, body, analysis, sender, history)
+    cached = lookup_cache(key)
+    if cached:
+        count_stat("responses_generated")
+        if on_text is not None:
+            on_text(cached["content"])
+        return {
+            "success": True,
+            "response": cached["content"],
+            "tokens": 0,
+            "cost": 0.0,
+            "cached": True
+        }
+    
+    try:
+        request = {
+            "messages": build_response_messages(subject, body, analysis, sender=sender, history=history),
+            "temperature": 0.7,
+            "max_tokens": 400
+        }
+        streamed = {}
+        if on_text is None:
+            response, latency = call_model("generation", **request)
+            generated = response.choices[0].message.content
+            usage = response.usage
+        else:
+            generated, usage, latency, first_token = stream_model("generation", on_text, **request)
+            generating = latency - first_token
+            streamed = {"ttft": first_token,
+                        "tokens_per_second": usage.completion_tokens / generating if generating > 0 else 0.0}
+        
+        tokens = usage.total_tokens
+        cost = calculate_cost("generation", usage)
+        cache.put(key, {"content": generated, "tokens": tokens, "cost": cost})
+        metrics.record_call("generation", latency, usage, cost, email_type_of(analysis))
+        
+        count_stat("total_cost", cost)
+        count_stat("responses_generated")
+        
+        return {
+            "success": True,
+            "response": generated,
+            "tokens": tokens,
+            "cost": cost,
+            **streamed
+        }
+        
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
 
+async def generate_response_smart_async(subject, body, analysis, sender="", history=None):
+    """Async version of generate_response_smart for batch mode (history: already looked up)"""
+    
+    if history is None:
+        history = history_for(subject, body, sender)
+    key = response_cache_key(subject, body, analysis, sender, history)
+    cached = lookup_cache(key)
+    if cached:
+        count_stat("responses_generated")
+        return {
+            "success": True,
+            "response": cached["content"],
+            "tokens": 0,
+            "cost": 0.0,
+            "cached": True
+        }
+    
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ],
+        response, latency = await call_model_async(
+            "generation",
+            messages=build_response_messages(subject, body, analysis, sender=sender, history=history),
             temperature=0.7,
             max_tokens=400
         )
         
         generated = response.choices[0].message.content
         tokens = response.usage.total_tokens
-        cost = (response.usage.prompt_tokens / 1000) * 0.00015 + \
-               (response.usage.completion_tokens / 1000) * 0.0006
+        cost = calculate_cost("generation", response.usage)
+        cache.put(key, {"content": generated, "tokens": tokens, "cost": cost})
+        metrics.record_call("generation", latency, response.usage, cost, email_type_of(analysis))
         
-        session_stats["total_cost"] += cost
-        session_stats["responses_generated"] += 1
+        count_stat("total_cost", cost)
+        count_stat("responses_generated")
         
         return {
             "success": True,
@@ -145,31 +515,205 @@ Generate a complete, ready-to-send response (2-4 paragraphs). Include greeting a
             "error": str(e)
         }
 
-def save_response(email, response_text, analysis, filename_prefix="response"):
-    """Save response with metadata"""
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    sender = email['from'].split('@')[0]
-    filename = f"{filename_prefix}_{timestamp}_{sender}.txt"
+def build_combined_messages(subject, body, record=True, sender="", history=""):
+    """Build the chat messages for single-call analysis + response"""
+    return prompts.get("combined").messages(
+        subject, budget.fit("combined", body, record),
+        sender_name=sender_first_name(sender) or "unknown (use a neutral greeting)",
+        history="\n" + history if history else ""
+    )
+
+def parse_combined(content):
+    """
+    Validate the combined mode's JSON against COMBINED_SCHEMA.
     
-    with open(filename, 'w', encoding='utf-8') as f:
-        f.write("="*70 + "\n")
-        f.write("EMAIL RESPONSE DRAFT\n")
-        f.write(f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write("="*70 + "\n\n")
-        
-        f.write(f"To: {email['from']}\n")
-        f.write(f"Re: {email['subject']}\n\n")
-        
-        f.write("ANALYSIS:\n")
-        for key, value in analysis.items():
-            f.write(f"  {key}: {value}\n")
-        
-        f.write("\n" + "-"*70 + "\n\n")
-        f.write("DRAFT RESPONSE:\n\n")
-        f.write(response_text)
-        f.write("\n\n" + "="*70 + "\n")
+    Returns (analysis, response_text) where analysis is an Analysis
+    record like the one parse_analysis() makes.
+    Raises ValueError if the output does not match the schema.
+    """
+    text = content.strip()
+    if text.startswith("```"):
+        # Tolerate a markdown code fence around the JSON
+        text = text.strip("`").removeprefix("json").strip()
+    
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON: {e}")
+    if not isinstance(data, dict):
+        raise ValueError("expected a JSON object")
+    
+    analysis = {}
+    for field, allowed in COMBINED_SCHEMA.items():
+        value = data.get(field)
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"missing or empty field: {field}")
+        if allowed is not None:
+            value = value.strip().lower()
+            if value not in allowed:
+                raise ValueError(f"unexpected {field}: {value}")
+            analysis[field.upper()] = value
+    
+    return Analysis.from_dict(analysis), data["response"].strip()
+
+def combined_cache_key(subject, body, sender="", history=""):
+    """Cache key for a single-call analysis + response"""
+    return make_key(model_for("combined"), prompts.get("combined").cache_version, 0.7, subject,
+                    budget.fit("combined", body, record=False), sender=sender_first_name(sender), history=history)
+
+def merge_results(analysis_result, response_result, extra_cost=0.0, extra_tokens=0):
+    """Combine separate analysis and response results into one result dict"""
+    if not response_result['success']:
+        return {
+            "success": False,
+            "analysis": analysis_result['analysis'],
+            "error": f"Response generation failed: {response_result['error']}"
+        }
+    
+    return {
+        "success": True,
+        "analysis": analysis_result['analysis'],
+        "response": response_result['response'],
+        "tokens": analysis_result['tokens'] + response_result['tokens'] + extra_tokens,
+        "cost": analysis_result['cost'] + response_result['cost'] + extra_cost
+    }
+
+def combined_from_cache(key):
+    """Return a cached combined result, if any"""
+    cached = lookup_cache(key)
+    if not cached:
+        return None
+    
+    analysis, draft = parse_combined(cached["content"])
+    count_stat("responses_generated")
+    return {
+        "success": True,
+        "analysis": analysis,
+        "response": draft,
+        "tokens": 0,
+        "cost": 0.0,
+        "cached": True,
+        "combined": True
+    }
+
+def finish_combined(key, response, latency):
+    """
+    Turn a combined-mode completion into (result, tokens, cost).
+    
+    result is None if the output fails validation, so the caller can fall
+    back to the two-call path while still accounting for the wasted call.
+    """
+    content = response.choices[0].message.content
+    tokens = response.usage.total_tokens
+    cost = calculate_cost("combined", response.usage)
+    count_stat("total_cost", cost)
+    
+    try:
+        analysis, draft = parse_combined(content)
+    except ValueError as e:
+        count_stat("combined_fallbacks")
+        metrics.record_call("combined", latency, response.usage, cost)
+        metrics.record_error("combined", e)
+        return None, tokens, cost
     
-    return filename
+    metrics.record_call("combined", latency, response.usage, cost, email_type_of(analysis))
+    cache.put(key, {"content": content, "tokens": tokens, "cost": cost})
+    count_stat("responses_generated")
+    
+    return {
+        "success": True,
+        "analysis": analysis,
+        "response": draft,
+        "tokens": tokens,
+        "cost": cost,
+        "combined": True
+    }, tokens, cost
+
+def analyze_and_respond(subject, body, sender=""):
+    """
+    Analyze and draft a response with a single model call.
+    
+    Confident local classifications only need the response call. If the
+    model's JSON fails validation, falls back to analyze_email_quick +
+    generate_response_smart; the wasted call is included in the cost.
+    """
+    local = classify_locally(subject, body, sender)
+    if local:
+        return merge_results(local, generate_response_smart(subject, body, local['analysis'], sender))
+    
+    history = history_for(subject, body, sender)
+    key = combined_cache_key(subject, body, sender, history)
+    cached = combined_from_cache(key)
+    if cached:
+        return cached
+    
+    try:
+        response, latency = call_model(
+            "combined",
+            messages=build_combined_messages(subject, body, sender=sender, history=history),
+            temperature=0.7,
+            max_tokens=500,
+            response_format={"type": "json_object"}
+        )
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+    
+    result, tokens, cost = finish_combined(key, response, latency)
+    if result:
+        return result
+    
+    analysis_result = analyze_email_quick(subject, body, sender)
+    if not analysis_result['success']:
+        return {"success": False, "error": f"Analysis failed: {analysis_result['error']}"}
+    response_result = generate_response_smart(subject, body, analysis_result['analysis'], sender)
+    return merge_results(analysis_result, response_result, cost, tokens)
+
+async def analyze_and_respond_async(subject, body, sender="", history=None):
+    """Async version of analyze_and_respond for batch mode (history: already looked up)"""
+    if history is None:
+        history = history_for(subject, body, sender)
+    local = classify_locally(subject, body, sender)
+    if local:
+        response_result = await generate_response_smart_async(subject, body, local['analysis'], sender, history)
+        return merge_results(local, response_result)
+    
+    key = combined_cache_key(subject, body, sender, history)
+    cached = combined_from_cache(key)
+    if cached:
+        return cached
+    
+    try:
+        response, latency = await call_model_async(
+            "combined",
+            messages=build_combined_messages(subject, body, sender=sender, history=history),
+            temperature=0.7,
+            max_tokens=500,
+            response_format={"type": "json_object"}
+        )
+    except Exception as e:
+        return {
+            "success": False,
+            "error": str(e)
+        }
+    
+    result, tokens, cost = finish_combined(key, response, latency)
+    if result:
+        return result
+    
+    analysis_result = await analyze_email_quick_async(subject, body, sender)
+    if not analysis_result['success']:
+        return {"success": False, "error": f"Analysis failed: {analysis_result['error']}"}
+    response_result = await generate_response_smart_async(subject, body, analysis_result['analysis'], sender,
+                                                          history)
+    return merge_results(analysis_result, response_result, cost, tokens)
+
+def save_response(email, response_text, analysis, filename_prefix="response"):
+    """Save response with metadata"""
+    record = make_record(email, analysis, response_text)
+    return TextDraftExporter(prefix=filename_prefix).write(record)
 
 def display_email_card(email, index):
     """Display email in a card format"""
@@ -213,21 +757,30 @@ def display_analysis_card(analysis):
         "TONE": {"professional": "👔", "friendly": "😊", "apologetic": "🙏", "enthusiastic": "🎉"}
     }
     
+    # Labels are normalized when parsed; any other keys are shown as text
     for key, value in analysis.items():
-        emoji_dict = emoji_map.get(key, {})
-        first_word = value.lower().split('/')[0].split()[0]
-        emoji = emoji_dict.get(first_word, "•")
+        emoji = emoji_map.get(key, {}).get(value, "•")
         display_line = f"┃ {emoji} {key}: {value}"
         padding = 68 - len(display_line) + 1
         print(display_line + " "*padding + "┃")
     
     print("┗" + "━"*68 + "┛")
 
-def display_response_card(response_text, tokens, cost):
-    """Display response in a card format"""
+def display_response_header():
     print("\n" + "┏" + "━"*68 + "┓")
     print("┃ ✉️  GENERATED RESPONSE" + " "*45 + "┃")
     print("┣" + "━"*68 + "┫")
+
+def display_response_footer(tokens, cost, ttft=None, tokens_per_second=None):
+    print("┣" + "━"*68 + "┫")
+    print(f"┃ 📊 Tokens: {tokens:<10} | 💰 Cost: ${cost:.6f}" + " "*25 + "┃")
+    if ttft is not None:
+        print(f"┃ ⏱️  First token: {ttft:.2f}s | Speed: {tokens_per_second:.0f} tokens/s".ljust(68) + " ┃")
+    print("┗" + "━"*68 + "┛")
+
+def display_response_card(response_text, tokens, cost):
+    """Display response in a card format"""
+    display_response_header()
     
     # Display response with wrapping
     lines = response_text.split('\n')
@@ -246,9 +799,73 @@ def display_response_card(response_text, tokens, cost):
             if current_line:
                 print(f"┃ {current_line.rstrip():<66} ┃")
     
-    print("┣" + "━"*68 + "┫")
-    print(f"┃ 📊 Tokens: {tokens:<10} | 💰 Cost: ${cost:.6f}" + " "*25 + "┃")
-    print("┗" + "━"*68 + "┛")
+    display_response_footer(tokens, cost)
+
+class StreamingResponseCard:
+    """
+    The response card, drawn while the draft streams in.
+    
+    Text is written as it arrives and wrapped at word boundaries to the
+    card's 66 columns, like display_response_card, so the operator can
+    start reading after the first token instead of the last. A word is
+    held back until it is complete, to know whether it still fits.
+    """
+    
+    WIDTH = 66
+    
+    def __init__(self):
+        self.column = 0
+        self.line_open = False
+        self.space = ""
+        self.word = ""
+    
+    def start(self):
+        display_response_header()
+    
+    def write(self, text):
+        """Add a streamed piece of the draft"""
+        for char in text:
+            if char == "\n":
+                self._flush_word()
+                self._end_line()
+            elif char.isspace():
+                self._flush_word()
+                self.space += char
+            else:
+                self.word += char
+        sys.stdout.flush()
+    
+    def finish(self, tokens, cost, ttft=None, tokens_per_second=None):
+        """Close the last line and draw the footer"""
+        self._flush_word()
+        if self.line_open:
+            self._end_line()
+        display_response_footer(tokens, cost, ttft, tokens_per_second)
+    
+    def _put(self, text):
+        if not self.line_open:
+            print("┃ ", end="")
+            self.line_open = True
+        print(text, end="")
+        self.column += len(text)
+    
+    def _flush_word(self):
+        if not self.word:
+            return
+        # Spaces at a wrap point are dropped, as display_response_card does
+        if self.column and self.column + len(self.space) + len(self.word) > self.WIDTH:
+            self._end_line()
+        self._put(self.space + self.word)
+        self.space = ""
+        self.word = ""
+    
+    def _end_line(self):
+        if not self.line_open:
+            self._put("")
+        print(" " * max(0, self.WIDTH - self.column) + " ┃")
+        self.line_open = False
+        self.column = 0
+        self.space = ""
 
 def show_session_stats():
     """Display session statistics"""
@@ -266,9 +883,752 @@ def show_session_stats():
         avg = session_stats['total_cost'] / session_stats['responses_generated']
         print(f"┃ Average cost per response: ${avg:.6f}" + " "*33 + "┃")
     print(f"┃ Session duration: {minutes}m {seconds}s" + " "*42 + "┃")
+    lookups = session_stats['cache_hits'] + session_stats['cache_misses']
+    if lookups:
+        hit_rate = session_stats['cache_hits'] / lookups * 100
+        print(f"┃ Cache hits: {session_stats['cache_hits']}/{lookups} ({hit_rate:.0f}%)".ljust(68) + " ┃")
+        print(f"┃ Saved by cache: ${session_stats['cache_saved_cost']:.6f}".ljust(68) + " ┃")
+    if session_stats['emails_resumed']:
+        print(f"┃ ♻️  Resumed from journal: {session_stats['emails_resumed']}".ljust(67) + " ┃")
+    if session_stats['combined_fallbacks']:
+        print(f"┃ Combined-mode fallbacks: {session_stats['combined_fallbacks']}".ljust(68) + " ┃")
+    if session_stats['fast_path_hits']:
+        print(f"┃ ⚡ Analyzed locally: {session_stats['fast_path_hits']}".ljust(67) + " ┃")
+    if session_stats['cluster_reuses']:
+        print(f"┃ Near-duplicates answered from {session_stats['clusters']} cluster drafts: "
+              f"{session_stats['cluster_reuses']}".ljust(68) + " ┃")
+        print(f"┃ Saved by cluster drafts: ~${session_stats['cluster_saved_cost']:.6f}".ljust(68) + " ┃")
+    cached, prompt_tokens, cached_share = prompts.cached_share()
+    if prompt_tokens:
+        print(f"┃ Prompt tokens served from provider cache: {cached}/{prompt_tokens} ({cached_share:.0%})"
+              .ljust(68) + " ┃")
+    saved_tokens, saved_share = budget.tokens_saved()
+    if saved_tokens:
+        print(f"┃ ✂️  Body tokens trimmed from prompts: {saved_tokens} ({saved_share:.0%})".ljust(68) + " ┃")
+    filtered = prefilter.stats
+    if filtered['skipped'] or filtered['deferred']:
+        print(f"┃ ⏭️  Pre-filtered: {filtered['skipped']} skipped, {filtered['deferred']} deferred"
+              f" (~${filtered['saved_cost']:.6f} saved)".ljust(68) + " ┃")
+    if session_stats['history_hits']:
+        hits = session_stats['history_hits']
+        print(f"┃ 🧵 Drafts with earlier context: {hits}/{session_stats['history_lookups']}"
+              f" (~{session_stats['history_tokens'] // hits} tokens each)".ljust(67) + " ┃")
+    ahead = prefetching["stats"]
+    if ahead and (ahead['analyses'] or ahead['drafts']):
+        print(f"┃ 🔮 Prefetched: {ahead['analyses']} analyses, {ahead['drafts']} drafts"
+              f" ({ahead['ready']} ready, {ahead['waited']} waited for)".ljust(67) + " ┃")
+        print(f"┃ 🗑️  Prefetched but unused: {ahead['wasted_analyses']} analyses, {ahead['wasted_drafts']} drafts"
+              f" (~${ahead['wasted_cost']:.6f})".ljust(68) + " ┃")
+    for endpoint, limit in metrics.snapshot()["concurrency"].items():
+        if not ADAPTIVE["enabled"] or not (limit['increases'] or limit['decreases'] or limit['waits']):
+            continue
+        cuts = ", ".join(f"{count} {reason}" for reason, count in sorted(limit['decreases'].items()))
+        print(f"┃ 🎚️  Concurrency limit: {limit['limit']:.0f} (ranged {limit['low']:.0f}-{limit['peak']:.0f}),"
+              f" +{limit['increases']}/-{sum(limit['decreases'].values())}{f' ({cuts})' if cuts else ''}"
+              [:67].ljust(68) + " ┃")
+        if endpoint != "default":
+            print(f"┃     for {endpoint}"[:67].ljust(67) + " ┃")
+    api = scheduler_stats()
+    if api['throttled'] or api['retries'] or api['failures'] or api['hedged']:
+        print("┣" + "━"*68 + "┫")
+        print(f"┃ API calls: {api['calls']:<55} ┃")
+        print(f"┃ Throttled: {api['throttled']} ({api['throttle_wait']:.1f}s waiting)".ljust(68) + " ┃")
+        print(f"┃ Retried: {api['retries']} ({api['rate_limited']} rate limited)".ljust(68) + " ┃")
+        print(f"┃ Failed after retries: {api['failures']:<44} ┃")
+        if api['hedged']:
+            print(f"┃ Hedged slow calls: {api['hedged']} ({api['hedge_wins']} won by the backup)".ljust(68) + " ┃")
+    show_metrics_breakdown()
     print("┗" + "━"*68 + "┛")
 
-def main():
+def show_metrics_breakdown():
+    """Per-stage and per-type latency/token/cost rows for show_session_stats"""
+    snapshot = metrics.snapshot()
+    
+    for title, groups in (("STAGE", snapshot["stages"]), ("TYPE", snapshot["types"])):
+        if not groups:
+            continue
+        print("┣" + "━"*68 + "┫")
+        print(f"┃ {title:<11}{'calls':>6}{'p50':>8}{'p95':>8}{'p99':>8}{'tokens':>9}{'cost':>12}   ┃")
+        for name, group in groups.items():
+            latency = group["latency"]
+            tokens = group["prompt_tokens"] + group["completion_tokens"]
+            print(f"┃ {name[:11]:<11}{group['calls']:>6}"
+                  f"{latency['p50']*1000:>6.0f}ms{latency['p95']*1000:>6.0f}ms{latency['p99']*1000:>6.0f}ms"
+                  f"{tokens:>9}{group['cost']:>12.6f}   ┃")
+        
+        errors = {}
+        for group in groups.values():
+            for category, count in group["errors"].items():
+                errors[category] = errors.get(category, 0) + count
+        if errors and title == "STAGE":
+            summary = ", ".join(f"{category}={count}" for category, count in sorted(errors.items()))
+            print(f"┃ Errors: {summary}"[:67].ljust(67) + " ┃")
+    
+    # Token usage per prompt template version, to compare A/B runs
+    if prompts.stats:
+        print("┣" + "━"*68 + "┫")
+        print(f"┃ {'PROMPT':<28}{'calls':>7}{'prompt tokens':>15}{'cached':>9}" + " "*8 + "┃")
+        for version, usage in sorted(prompts.stats.items()):
+            share = usage['cached_tokens'] / usage['prompt_tokens'] if usage['prompt_tokens'] else 0.0
+            print(f"┃ {version[:28]:<28}{usage['calls']:>7}{usage['prompt_tokens']:>15}{share:>9.0%}" + " "*8 + "┃")
+    
+    # Streamed calls: how long until the first token, and how fast the rest arrived
+    if snapshot["streams"]:
+        print("┣" + "━"*68 + "┫")
+        print(f"┃ {'STREAM':<11}{'calls':>6}{'ttft p50':>10}{'ttft p95':>10}{'tokens/s':>10}" + " "*20 + "┃")
+        for name, group in snapshot["streams"].items():
+            latency = group["latency"]
+            print(f"┃ {name[:11]:<11}{group['calls']:>6}{latency['p50']:>9.2f}s{latency['p95']:>9.2f}s"
+                  f"{metrics.tokens_per_second(name):>10.0f}" + " "*20 + "┃")
+    
+    # Time from batch start until each priority's drafts were ready
+    priorities = snapshot["priorities"]
+    if priorities:
+        print("┣" + "━"*68 + "┫")
+        print(f"┃ {'PRIORITY':<11}{'drafts':>6}{'first':>9}{'p50':>9}{'p95':>9}{'max':>9}" + " "*13 + "┃")
+        for name in sorted(priorities, key=lambda name: -PRIORITY_RANK.get(name, 0)):
+            group = priorities[name]
+            latency = group["latency"]
+            print(f"┃ {name:<11}{group['calls']:>6}{group['first']:>8.1f}s{latency['p50']:>8.1f}s"
+                  f"{latency['p95']:>8.1f}s{latency['max']:>8.1f}s" + " "*13 + "┃")
+
+def export_metrics(args):
+    """Write metrics files requested on the command line"""
+    extra = {"session": {k: v for k, v in session_stats.items() if k != "start_time"},
+             "scheduler": scheduler_stats(),
+             "backends": {stage: describe(stage) for stage in ("analysis", "generation")},
+             "prefilter": prefilter.stats,
+             "prompt_budget": budget.stats,
+             "prefetch": prefetching["stats"],
+             "prompts": {"active": dict(prompts.active), "usage": prompts.stats}}
+    if args.metrics_json:
+        metrics.write_json(args.metrics_json, extra)
+        print(f"📈 Metrics written to {args.metrics_json}")
+    if args.metrics_prom:
+        metrics.write_prometheus(args.metrics_prom)
+        print(f"📈 Prometheus metrics written to {args.metrics_prom}")
+
+async def process_email_async(index, email, combined=False, analysis_result=None, anonymous=False,
+                              history=None):
+    """
+    Analyze and draft a response for one email without any prompts.
+    
+    Pass analysis_result when the email has already been analyzed (the
+    priority scheduler does this to order emails before drafting), and
+    history when the sender's history was already looked up.
+    anonymous=True drafts without the sender's name or history, for a
+    draft that other senders will get too.
+    """
+    count_stat("emails_processed")
+    
+    result = {"index": index, "email": email, "success": False}
+    sender = "" if anonymous else email['from']
+    if anonymous:
+        history = ""
+    
+    if combined:
+        outcome = await analyze_and_respond_async(email['subject'], email['body'], sender, history)
+    else:
+        if analysis_result is None:
+            analysis_result = await analyze_email_quick_async(email['subject'], email['body'], email['from'])
+        if not analysis_result['success']:
+            result["error"] = f"Analysis failed: {analysis_result['error']}"
+            return result
+        
+        response_result = await generate_response_smart_async(
+            email['subject'],
+            email['body'],
+            analysis_result['analysis'],
+            sender,
+            history
+        )
+        outcome = merge_results(analysis_result, response_result)
+    
+    result.update(outcome)
+    return result
+
+def clustered_result(index, email, template, cluster, analysis_result=None):
+    """Answer email with its near-duplicate cluster's draft, re-addressed to its sender"""
+    count_stat("emails_processed")
+    count_stat("responses_generated")
+    count_stat("cluster_reuses")
+    
+    # An analysis done up front (priority mode) was still paid for
+    analyzed = analysis_result is not None and analysis_result['success']
+    tokens = analysis_result['tokens'] if analyzed else 0
+    cost = analysis_result['cost'] if analyzed else 0.0
+    count_stat("cluster_saved_cost", max(0.0, template['cost'] - cost))
+    
+    return {
+        "index": index,
+        "email": email,
+        "success": True,
+        "analysis": analysis_result['analysis'] if analyzed else template['analysis'],
+        "response": personalize(template['response'], email['from']),
+        "tokens": tokens,
+        "cost": cost,
+        "cluster": cluster
+    }
+
+def resumed_result(index, email, entry):
+    """Rebuild a batch result from a journal entry of a previous run"""
+    count_stat("emails_resumed")
+    return {
+        "index": index,
+        "email": email,
+        "success": True,
+        "analysis": Analysis.from_dict(entry['analysis']),
+        "response": entry['response'],
+        "tokens": 0,
+        "cost": 0.0,
+        "saved_to": entry.get('saved_to'),
+        "resumed": True
+    }
+
+def finish_result(result, sink=None, journal=None, key=None, verbose=True):
+    """Save a finished batch result, record it in the journal and report it"""
+    email = result['email']
+    
+    if result.get('skipped'):
+        # Cheap to filter again, so pre-filtered emails are not journaled
+        if verbose:
+            print(f"⏭️  #{result['index']} {result['error']}")
+        return
+    
+    def on_saved(location):
+        result["saved_to"] = location
+        if journal:
+            journal.record(key, result)
+    
+    if result['success'] and sink:
+        with metrics.timer("save"):
+            sink.write(make_record(email, result['analysis'], result['response'],
+                                   result['tokens'], result['cost']), on_saved)
+    elif journal:
+        journal.record(key, result)
+    if result['success']:
+        # Worker processes only read the store: the parent records every result. Batch drafts
+        # are unreviewed, so only the email and its analysis become history, not "We replied"
+        record_interaction(email, result['analysis'])
+    
+    if not verbose:
+        return
+    index = result['index']
+    if result['success']:
+        analysis = result['analysis']
+        print(f"✅ #{index} {analysis.get('TYPE', '?')}/{analysis.get('PRIORITY', '?')}"
+              f" | 💰 ${result['cost']:.6f}")
+    else:
+        print(f"❌ #{index} {result['error']}")
+
+async def run_batch(emails, max_in_flight=DEFAULT_MAX_IN_FLIGHT, sink=None, combined=False,
+                    journal=None, verbose=True, indexed=False, on_result=None, prioritize=False,
+                    aging_seconds=DEFAULT_AGING_SECONDS, lookahead=DEFAULT_LOOKAHEAD, cluster=False,
+                    cluster_threshold=DEFAULT_CLUSTER_THRESHOLD):
+    """
+    Process emails concurrently with at most max_in_flight emails in flight.
+    
+    Drafts go to sink (see draft_sinks) when one is given. With a journal,
+    emails finished in a previous run are skipped, and each new draft is
+    recorded once the sink has actually written it.
+    
+    indexed=True means emails yields (index, email) pairs instead of
+    emails. on_result, if given, replaces the sink/journal/report handling
+    and is called with each result as soon as it is ready.
+    
+    prioritize=True analyzes up to lookahead emails ahead of drafting and
+    drafts the most urgent first (see priority_queue); in combined mode the
+    inbox's own priority field is used. Either way, the time from batch
+    start to each draft is recorded per priority.
+    
+    cluster=True groups near-duplicate emails (see near_duplicates): only
+    the first email of each cluster is drafted by the model, without its
+    sender's name, and every email of the cluster gets a copy of that draft
+    addressed to its own sender. A draft that still names the first sender
+    (e.g. from their signature) is not shared, and emails from senders with
+    history (see context_store) are never clustered.
+    
+    Returns one result dict per email, in the same order as the input.
+    """
+    import asyncio
+    results = {}
+    email_iter = iter(emails) if indexed else enumerate(emails, 1)
+    start = time.perf_counter()
+    
+    def take():
+        """Next (index, email, journal key) still to do, or None at the end"""
+        # Workers share one iterator, so each email is picked up exactly once
+        while True:
+            with metrics.timer("ingest"):
+                item = next(email_iter, None)
+            if item is None:
+                return None
+            index, email = item
+            key = email_key(email) if journal else None
+            if journal and journal.is_done(key):
+                results[index] = resumed_result(index, email, journal.get(key))
+                continue
+            skipped = prefiltered_result(index, email)
+            if skipped:
+                finish(skipped, key)
+                continue
+            return index, email, key
+    
+    def finish(result, key):
+        results[result['index']] = result
+        if result['success']:
+            metrics.record_draft(priority_of(result['email'], result['analysis']),
+                                 time.perf_counter() - start)
+        if on_result:
+            on_result(result)
+        else:
+            finish_result(result, sink, journal, key, verbose)
+    
+    clusters = NearDuplicateIndex(cluster_threshold) if cluster else None
+    templates = {}
+    
+    async def draft(index, email, analysis_result=None):
+        """process_email_async, answering near-duplicates from their cluster's draft"""
+        if clusters is None:
+            return await process_email_async(index, email, combined, analysis_result)
+        # A sender with history gets their own draft: a shared one could not follow up on it
+        history = history_for(email['subject'], email['body'], email['from'])
+        if history:
+            return await process_email_async(index, email, combined, analysis_result, history=history)
+        
+        cluster_id, created = clusters.assign(email['subject'], email['body'])
+        if created:
+            count_stat("clusters")
+            template = templates[cluster_id] = asyncio.get_running_loop().create_future()
+            shared = {"success": False}
+            try:
+                result = await process_email_async(index, email, combined, analysis_result, anonymous=True)
+                if result['success'] and not names_sender(result['response'], email['from']):
+                    shared = dict(result)
+                if result['success']:
+                    result['response'] = personalize(result['response'], email['from'])
+                return result
+            finally:
+                template.set_result(shared)
+        
+        template = await templates[cluster_id]
+        response = None
+        if template['success']:
+            source = template['email']
+            response = renumber(template['response'], f"{source['subject']}\n{source['body']}",
+                                f"{email['subject']}\n{email['body']}")
+        if response is None:
+            return await process_email_async(index, email, combined, analysis_result, history="")
+        return clustered_result(index, email, dict(template, response=response), cluster_id, analysis_result)
+    
+    async def worker():
+        while True:
+            item = take()
+            if item is None:
+                break
+            index, email, key = item
+            finish(await draft(index, email), key)
+    
+    if not prioritize:
+        await asyncio.gather(*(worker() for _ in range(max(1, max_in_flight))))
+        return [results[index] for index in sorted(results)]
+    
+    ready = AgingPriorityQueue(lookahead, aging_seconds)
+    
+    async def analysis_worker():
+        while True:
+            item = take()
+            if item is None:
+                break
+            index, email, key = item
+            if combined:
+                await ready.put(priority_of(email), (index, email, key, None))
+                continue
+            analysis_result = await analyze_email_quick_async(email['subject'], email['body'], email['from'])
+            if not analysis_result['success']:
+                finish(await process_email_async(index, email, combined, analysis_result), key)
+                continue
+            await ready.put(priority_of(email, analysis_result['analysis']),
+                            (index, email, key, analysis_result))
+    
+    async def analyze_all():
+        await asyncio.gather(*(analysis_worker() for _ in range(max(1, max_in_flight))))
+        await ready.close()
+    
+    async def draft_worker():
+        while True:
+            entry = await ready.get()
+            if entry is None:
+                break
+            index, email, key, analysis_result = entry
+            finish(await draft(index, email, analysis_result), key)
+    
+    await asyncio.gather(analyze_all(), *(draft_worker() for _ in range(max(1, max_in_flight))))
+    return [results[index] for index in sorted(results)]
+
+def batch_job_backend(name, directory):
+    """The batch backend named on the command line (see batch_jobs)"""
+    if name == "local":
+        def call(stage, body):
+            return scheduler_for(stage).call(client_for(stage).chat.completions.create,
+                                             timeout=stage_timeout(stage), **body)
+        return LocalBatchBackend(directory, call)
+    return OpenAIBatchBackend(client_for)
+
+def reconcile_call(stage, custom_id, results, backend, seconds, email_type=None):
+    """
+    Content, usage and cost of one batch request's completion (None if it failed).
+    
+    Counts the call like call_model would, at the backend's price.
+    """
+    completion, error = results.get(custom_id, (None, "missing from the batch output"))
+    if completion is None:
+        metrics.record_error(stage, RuntimeError(error))
+        return None, error
+    usage = usage_of(completion)
+    cost = calculate_cost(stage, usage) * backend.price_factor
+    prompts.record(prompts.get(STAGE_TEMPLATES[stage]), usage)
+    count_stat("total_cost", cost)
+    content = completion["choices"][0]["message"]["content"]
+    return {"content": content, "usage": usage, "cost": cost, "seconds": seconds}, None
+
+def run_batch_job(emails, backend, directory, sink=None, journal=None, poll_seconds=DEFAULT_POLL_SECONDS,
+                  verbose=True):
+    """
+    Process emails as two offline batch jobs instead of per-email calls.
+    
+    Pass 1 analyzes every email the local classifier and the cache cannot
+    answer; pass 2 feeds those analyses into response requests. Requests
+    carry a custom_id ("analysis-<index>", "response-<index>"), so results
+    are matched back to emails whatever order the backend returns them in.
+    Latency in the metrics is the job's turnaround time.
+    
+    Returns one result dict per email, in inbox order.
+    """
+    results = {}
+    pending = {}
+    for index, email in enumerate(emails, 1):
+        with metrics.timer("ingest"):
+            key = email_key(email) if journal else None
+        if journal and journal.is_done(key):
+            results[index] = resumed_result(index, email, journal.get(key))
+            continue
+        skipped = prefiltered_result(index, email)
+        if skipped:
+            results[index] = skipped
+            finish_result(skipped, verbose=verbose)
+            continue
+        count_stat("emails_processed")
+        pending[index] = (email, key)
+    
+    # Pass 1: analyses
+    analyses = {}
+    requests = []
+    for index, (email, _) in pending.items():
+        local = classify_locally(email['subject'], email['body'], email['from'])
+        cached = None if local else lookup_cache(analysis_cache_key(email['subject'], email['body']))
+        if local:
+            analyses[index] = local
+        elif cached:
+            analyses[index] = {"success": True, "analysis": parse_analysis(cached["content"]),
+                               "tokens": 0, "cost": 0.0, "cached": True}
+        else:
+            requests.append((f"analysis-{index}", {
+                "model": model_for("analysis"),
+                "messages": build_analysis_messages(email['subject'], email['body']),
+                "temperature": 0.3,
+                "max_tokens": 50
+            }))
+    job_results, seconds = run_job(backend, directory, "analysis", requests, poll_seconds, verbose)
+    for custom_id, _ in requests:
+        index = int(custom_id.split("-")[1])
+        email = pending[index][0]
+        call, error = reconcile_call("analysis", custom_id, job_results, backend, seconds)
+        if call is None:
+            analyses[index] = {"success": False, "error": error}
+            continue
+        parsed = parse_analysis(call["content"])
+        cache.put(analysis_cache_key(email['subject'], email['body']),
+                  {"content": call["content"], "tokens": call["usage"].total_tokens, "cost": call["cost"]})
+        metrics.record_call("analysis", seconds, call["usage"], call["cost"], email_type_of(parsed))
+        analyses[index] = {"success": True, "analysis": parsed, "tokens": call["usage"].total_tokens,
+                           "cost": call["cost"]}
+    
+    # Pass 2: responses to the emails whose analysis succeeded
+    responses = {}
+    histories = {}
+    requests = []
+    for index, (email, _) in pending.items():
+        analysis_result = analyses[index]
+        if not analysis_result['success']:
+            continue
+        analysis = analysis_result['analysis']
+        # Context recorded by earlier runs; this run's drafts are recorded after pass 2
+        history = history_for(email['subject'], email['body'], email['from'])
+        cached = lookup_cache(response_cache_key(email['subject'], email['body'], analysis, email['from'],
+                                                 history))
+        if cached:
+            count_stat("responses_generated")
+            responses[index] = {"success": True, "response": cached["content"], "tokens": 0, "cost": 0.0,
+                                "cached": True}
+        else:
+            requests.append((f"response-{index}", {
+                "model": model_for("generation"),
+                "messages": build_response_messages(email['subject'], email['body'], analysis,
+                                                    sender=email['from'], history=history),
+                "temperature": 0.7,
+                "max_tokens": 400
+            }))
+            histories[index] = history
+    job_results, seconds = run_job(backend, directory, "generation", requests, poll_seconds, verbose)
+    for custom_id, _ in requests:
+        index = int(custom_id.split("-")[1])
+        email = pending[index][0]
+        analysis = analyses[index]['analysis']
+        call, error = reconcile_call("generation", custom_id, job_results, backend, seconds)
+        if call is None:
+            responses[index] = {"success": False, "error": error}
+            continue
+        cache.put(response_cache_key(email['subject'], email['body'], analysis, email['from'], histories[index]),
+                  {"content": call["content"], "tokens": call["usage"].total_tokens, "cost": call["cost"]})
+        metrics.record_call("generation", seconds, call["usage"], call["cost"], email_type_of(analysis))
+        count_stat("responses_generated")
+        responses[index] = {"success": True, "response": call["content"], "tokens": call["usage"].total_tokens,
+                            "cost": call["cost"]}
+    
+    for index, (email, key) in pending.items():
+        result = {"index": index, "email": email, "success": False}
+        analysis_result = analyses[index]
+        if analysis_result['success']:
+            result.update(merge_results(analysis_result, responses[index]))
+        else:
+            result["error"] = f"Analysis failed: {analysis_result['error']}"
+        results[index] = result
+        finish_result(result, sink, journal, key, verbose)
+    
+    return [results[index] for index in sorted(results)]
+
+def main_batch(args):
+    """Non-interactive batch mode: analyze and respond to every email"""
+    # Only batch mode needs an event loop, so interactive runs don't import asyncio
+    import asyncio
+    
+    # Emails are streamed, so drafts start before the inbox is fully read
+    try:
+        emails = read_emails(args.input, args.format)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ Error loading emails: {e}")
+        return []
+    
+    print(f"\n📥 Streaming emails from {args.input}")
+    if args.batch_job:
+        print(f"📦 Offline batch jobs ({args.batch_backend} backend, files in {args.batch_dir})\n")
+    elif args.workers > 1:
+        print(f"🚀 Batch mode: {args.workers} worker processes x {args.concurrency} emails in flight\n")
+    else:
+        print(f"🚀 Batch mode: up to {args.concurrency} emails in flight\n")
+    
+    if args.combined and not args.batch_job:
+        print("🧩 Combined mode: one model call per email\n")
+    
+    if describe("analysis") != describe("generation") or describe("analysis") != DEFAULT_MODEL:
+        print(f"🤖 Models: analysis {describe('analysis')} | drafts {describe('generation')}\n")
+    
+    if args.prioritize:
+        print(f"🚨 Urgent first: looking {args.lookahead} emails ahead, aging {args.aging:g}s per level\n")
+    
+    start_at(args.concurrency)
+    if ADAPTIVE["enabled"]:
+        print(f"🎚️  Adaptive concurrency: starting at {ADAPTIVE['initial']} model calls in flight\n")
+    
+    if args.cluster:
+        print(f"🧬 Near-duplicates share one draft (similarity >= {args.cluster_threshold:g})\n")
+    
+    # One pooled connection per email in flight (llm_clients adds hedging headroom)
+    configure_pool(args.concurrency)
+    
+    batch_options = {"prioritize": args.prioritize, "aging_seconds": args.aging,
+                     "lookahead": args.lookahead, "cluster": args.cluster,
+                     "cluster_threshold": args.cluster_threshold}
+    
+    sink = None
+    if not args.no_save:
+        sink = open_sink(args.output, args.output_path, args.flush_every, args.background_writer)
+        print(f"💾 Writing drafts to {args.output_path or DEFAULT_OUTPUTS[args.output]} ({args.output})\n")
+    
+    journal = None
+    if not args.no_journal:
+        journal = CheckpointJournal(args.journal)
+        if args.fresh:
+            journal.reset()
+        finished = journal.load()
+        if finished:
+            print(f"♻️  Resuming: {finished} emails already done in {args.journal}\n")
+    
+    try:
+        if args.batch_job:
+            results = run_batch_job(emails, batch_job_backend(args.batch_backend, args.batch_dir),
+                                    args.batch_dir, sink, journal, args.poll_interval)
+        elif args.workers > 1:
+            results = run_workers(sys.modules[__name__], emails, args.workers, args.concurrency,
+                                  sink, args.combined, journal, **batch_options)
+        else:
+            results = asyncio.run(run_batch(emails, args.concurrency, sink, args.combined, journal,
+                                            **batch_options))
+    except ValueError as e:
+        # Malformed inbox data surfaces while streaming, not up front
+        print(f"\n❌ Error reading {args.input}: {e}")
+        results = []
+    except KeyboardInterrupt:
+        if journal:
+            print(f"\n\n💾 Progress saved to {args.journal} - rerun the same command to resume")
+        raise
+    finally:
+        # Close the sink first: its final flush still records into the journal.
+        # The journal is closed even if that flush fails, so its entries are kept
+        try:
+            if sink:
+                sink.close()
+        finally:
+            if journal:
+                journal.close()
+    
+    if not results:
+        print("\n❌ No emails to process!")
+        return []
+    
+    if sink:
+        print(f"\n💾 {sink.written} drafts written to {args.output_path or DEFAULT_OUTPUTS[args.output]}")
+    
+    if prefilter.stats['deferred']:
+        already = prefilter.stats['deferred'] - prefilter.stats['appended']
+        print(f"\n📨 {prefilter.stats['appended']} deferred emails appended to {prefilter.deferred_path}"
+              + (f" ({already} already there)" if already else ""))
+    
+    failed = sum(1 for result in results if not result['success'] and not result.get('skipped'))
+    if failed:
+        print(f"\n⚠️  {failed} of {len(results)} emails failed")
+    
+    show_session_stats()
+    return results
+
+def import_history(path, fmt=None):
+    """Load past emails (e.g. an exported mailbox) into the context store"""
+    try:
+        emails = read_emails(path, fmt)
+        start = time.perf_counter()
+        count = context.import_emails(emails)
+    except (FileNotFoundError, ValueError) as e:
+        print(f"❌ Error loading emails: {e}")
+        return
+    print(f"🧵 Imported {count} emails into {context.path} in {time.perf_counter() - start:.1f}s")
+
+def parse_args():
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="AI Email Responder Pro")
+    parser.add_argument("--input", default=DEFAULT_INBOX,
+                        help=f"inbox file or Maildir directory (default: {DEFAULT_INBOX})")
+    parser.add_argument("--format", choices=sorted(READERS),
+                        help="inbox format (default: detected from --input)")
+    parser.add_argument("--batch", action="store_true",
+                        help="process all emails without prompts")
+    parser.add_argument("--batch-job", action="store_true",
+                        help="process all emails as offline batch jobs (cheaper, but can take hours)")
+    parser.add_argument("--batch-backend", choices=("openai", "local"), default=DEFAULT_BATCH_BACKEND,
+                        help="where batch jobs run: the OpenAI Batch API, or one call at a time locally "
+                             f"(default: {DEFAULT_BATCH_BACKEND})")
+    parser.add_argument("--batch-dir", default=DEFAULT_BATCH_DIR,
+                        help=f"where batch job request/result files are kept (default: {DEFAULT_BATCH_DIR})")
+    parser.add_argument("--poll-interval", type=float, default=DEFAULT_POLL_SECONDS,
+                        help=f"seconds between batch job status checks (default: {DEFAULT_POLL_SECONDS:g})")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_MAX_IN_FLIGHT,
+                        help=f"max emails in flight in batch mode (default: {DEFAULT_MAX_IN_FLIGHT})")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="worker processes for batch mode; the rate limit is split between them")
+    parser.add_argument("--no-save", action="store_true",
+                        help="do not save drafts in batch mode")
+    parser.add_argument("--output", choices=sorted(DEFAULT_OUTPUTS), default="jsonl",
+                        help="where batch mode writes drafts (default: jsonl)")
+    parser.add_argument("--output-path",
+                        help="output file, or directory for text drafts (default depends on --output)")
+    parser.add_argument("--flush-every", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"drafts buffered per write (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--background-writer", action="store_true",
+                        help="write drafts on a background thread")
+    parser.add_argument("--combined", action="store_true",
+                        help="analyze and respond with one model call per email (batch mode)")
+    parser.add_argument("--prioritize", action="store_true",
+                        help="analyze ahead and draft urgent emails first (batch mode)")
+    parser.add_argument("--aging", type=float, default=DEFAULT_AGING_SECONDS,
+                        help=f"seconds of waiting that raise an email one priority level "
+                             f"(default: {DEFAULT_AGING_SECONDS:g})")
+    parser.add_argument("--lookahead", type=int, default=DEFAULT_LOOKAHEAD,
+                        help=f"analyzed emails waiting to be drafted (default: {DEFAULT_LOOKAHEAD})")
+    parser.add_argument("--cluster", action="store_true",
+                        help="draft once per cluster of near-duplicate emails (batch mode)")
+    parser.add_argument("--cluster-threshold", type=float, default=DEFAULT_CLUSTER_THRESHOLD,
+                        help=f"min similarity for emails to share a draft (default: {DEFAULT_CLUSTER_THRESHOLD:g})")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH,
+                        help=f"checkpoint journal for resuming batch runs (default: {DEFAULT_JOURNAL_PATH})")
+    parser.add_argument("--no-journal", action="store_true",
+                        help="do not record or resume batch progress")
+    parser.add_argument("--fresh", action="store_true",
+                        help="ignore the journal from a previous run and start over")
+    parser.add_argument("--metrics-json",
+                        help="write latency/token/cost metrics to this JSON file at the end")
+    parser.add_argument("--metrics-prom",
+                        help="write metrics in Prometheus text format to this file at the end")
+    parser.add_argument("--no-prefilter", action="store_true",
+                        help="send newsletters and no-reply emails to the model too")
+    parser.add_argument("--prefilter-rules",
+                        help="JSON file with extra keep/skip/defer pre-filter rules")
+    parser.add_argument("--deferred-path", default=prefilter.deferred_path,
+                        help=f"where deferred emails are appended (default: {prefilter.deferred_path})")
+    parser.add_argument("--analysis-body-tokens", type=int, default=budget.budgets["analysis"],
+                        help=f"max email body tokens in analysis prompts (default: {budget.budgets['analysis']})")
+    parser.add_argument("--response-body-tokens", type=int, default=budget.budgets["generation"],
+                        help=f"max email body tokens in response prompts (default: {budget.budgets['generation']})")
+    parser.add_argument("--body-fit", choices=FIT_MODES, default=budget.mode,
+                        help=f"how over-budget bodies are shortened (default: {budget.mode})")
+    parser.add_argument("--no-body-budget", action="store_true",
+                        help="send email bodies as-is, quoted history and all")
+    parser.add_argument("--prompt-version", action="append", default=[], metavar="NAME=VERSION",
+                        help="use another registered prompt template version, e.g. for an A/B run "
+                             f"(in use: {', '.join(f'{n}={v}' for n, v in prompts.active.items())})")
+    parser.add_argument("--analysis-model", help=f"model for analysis calls (default: {model_for('analysis')})")
+    parser.add_argument("--analysis-base-url",
+                        help="OpenAI-compatible endpoint for analysis calls, e.g. a local server")
+    parser.add_argument("--generation-model",
+                        help=f"model for drafting and combined calls (default: {model_for('generation')})")
+    parser.add_argument("--generation-base-url",
+                        help="OpenAI-compatible endpoint for drafting and combined calls")
+    parser.add_argument("--no-stream", action="store_true",
+                        help="show drafts only once complete instead of streaming them (interactive mode)")
+    parser.add_argument("--prefetch", type=int, default=DEFAULT_PREFETCH_DEPTH, metavar="N",
+                        help=f"analyze the next N emails while you read the current one, interactive mode "
+                             f"(default: {DEFAULT_PREFETCH_DEPTH}, 0 = off)")
+    parser.add_argument("--prefetch-drafts", action="store_true",
+                        help="draft the prefetched emails too; drafts you decline are wasted spend")
+    parser.add_argument("--history-tokens", type=int, default=context.max_tokens,
+                        help=f"max tokens of earlier emails with the sender in response prompts "
+                             f"(default: {context.max_tokens})")
+    parser.add_argument("--no-history", action="store_true",
+                        help="draft without earlier emails from the context store, and record nothing")
+    parser.add_argument("--import-history", metavar="PATH",
+                        help="load past emails from an inbox file or Maildir into the context store and exit")
+    parser.add_argument("--no-adaptive-concurrency", action="store_true",
+                        help="keep every email's model calls in flight instead of adapting the limit to "
+                             "the endpoint's latency and throttling")
+    parser.add_argument("--hedge", action="store_true",
+                        help="send a backup request when a call is much slower than usual (the loser may "
+                             "still be billed)")
+    parser.add_argument("--no-fast-path", action="store_true",
+                        help="always use the LLM for analysis")
+    parser.add_argument("--fast-path-threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help=f"min local classifier confidence (default: {DEFAULT_THRESHOLD})")
+    return parser.parse_args()
+
+def main(path=DEFAULT_INBOX, fmt=None):
     """Main function"""
     print("\n" + "┏" + "━"*68 + "┓")
     print("┃" + " "*68 + "┃")
@@ -277,13 +1637,13 @@ def main():
     print("┃" + " "*68 + "┃")
     print("┗" + "━"*68 + "┛")
     
-    emails = load_sample_emails()
+    emails = load_sample_emails(path, fmt)
     
     if not emails:
         print("\n❌ No emails to process!")
         return
     
-    print(f"\n✅ Loaded {len(emails)} sample emails")
+    print(f"\n✅ Loaded {len(emails)} emails")
     print("\n📋 This tool will:")
     print("   1. Analyze each email (type, sentiment, priority)")
     print("   2. Generate intelligent responses")
@@ -292,23 +1652,64 @@ def main():
     
     input("\n👉 Press Enter to begin...")
     
+    # The next emails are analyzed ahead on a background thread; what the operator waits for runs right here
+    prefetcher = None
+    if prefetching["depth"] > 0:
+        draft = None
+        if prefetching["drafts"]:
+            draft = lambda email, analysis: generate_response_smart(email['subject'], email['body'], analysis,
+                                                                    email['from'])
+        prefetcher = Prefetcher(lambda email: analyze_email_quick(email['subject'], email['body'], email['from']),
+                                draft, prefetching["depth"])
+    
+    try:
+        review_emails(emails, prefetcher)
+    finally:
+        if prefetcher:
+            prefetcher.close()
+            prefetching["stats"] = prefetcher.stats
+            # Drafts nobody saw were counted when generated
+            count_stat("responses_generated", -prefetcher.stats["wasted_drafts"])
+    
+    # Show final statistics
+    show_session_stats()
+
+def review_emails(emails, prefetcher=None):
+    """The interactive loop: show each email and its analysis, then draft and save on request"""
     for i, email in enumerate(emails, 1):
-        session_stats["emails_processed"] += 1
+        count_stat("emails_processed")
         
         display_email_card(email, i)
         
+        skipped = prefiltered_result(i, email)
+        if skipped:
+            print(f"\n⏭️  {skipped['error']} - no model calls made")
+            if i < len(emails):
+                input("\n👉 Press Enter for next email...")
+            continue
+        
         print("\n🔄 Step 1: Analyzing email...")
         
-        # Analyze email
-        analysis_result = analyze_email_quick(email['subject'], email['body'])
+        # Analyze email (probably done already, while the previous one was on screen)
+        if prefetcher:
+            analysis_result = prefetcher.take_analysis(i, email)
+            for ahead in range(i + 1, min(len(emails), i + prefetcher.depth) + 1):
+                if prefilter.check(emails[ahead - 1]) is None:
+                    prefetcher.prefetch(ahead, emails[ahead - 1])
+        else:
+            analysis_result = analyze_email_quick(email['subject'], email['body'], email['from'])
         
         if not analysis_result['success']:
             print(f"❌ Analysis failed: {analysis_result['error']}")
             continue
         
         analysis = analysis_result['analysis']
+        record_interaction(email, analysis)
         display_analysis_card(analysis)
-        print(f"💰 Analysis cost: ${analysis_result['cost']:.6f}")
+        cached_note = " (cached)" if analysis_result.get('cached') else ""
+        if analysis_result.get('local'):
+            cached_note = f" (⚡ local, {analysis_result['confidence']:.0%} confident)"
+        print(f"💰 Analysis cost: ${analysis_result['cost']:.6f}{cached_note}")
         
         # Ask user if they want to generate response
         choice = input("\n👉 Generate response? (y/n/s=skip all remaining): ").strip().lower()
@@ -318,6 +1719,8 @@ def main():
             break
         
         if choice != 'y':
+            if prefetcher:
+                prefetcher.skip_draft(i)
             print("⏭️  Skipped")
             if i < len(emails):
                 input("\n👉 Press Enter for next email...")
@@ -325,25 +1728,48 @@ def main():
         
         print("\n🔄 Step 2: Generating smart response...")
         
-        # Generate response
-        response_result = generate_response_smart(
-            email['subject'],
-            email['body'],
-            analysis
-        )
+        # Drafted ahead while the operator was reading, if drafts are prefetched
+        response_result = prefetcher.take_draft(i) if prefetcher else None
+        prefetched = response_result is not None
+        card = None
+        if not prefetched:
+            # Generate response (streamed into the card as it is written)
+            if streaming["enabled"]:
+                card = StreamingResponseCard()
+                card.start()
+            request = (email['subject'], email['body'], analysis, email['from'], card.write if card else None)
+            if prefetcher:
+                response_result = prefetcher.run(generate_response_smart, *request)
+            else:
+                response_result = generate_response_smart(*request)
         
-        if response_result['success']:
+        if card and response_result['success']:
+            card.finish(
+                response_result['tokens'],
+                response_result['cost'],
+                response_result.get('ttft'),
+                response_result.get('tokens_per_second')
+            )
+        elif card:
+            # Close whatever part of the card was drawn before the failure
+            card.finish(0, 0.0)
+        elif response_result['success']:
             display_response_card(
                 response_result['response'],
                 response_result['tokens'],
                 response_result['cost']
             )
-            
+            if prefetched:
+                print("⚡ Drafted ahead while you were reading")
+        
+        if response_result['success']:
             # Ask to save
             save_choice = input("\n💾 Save this response? (y/n): ").strip().lower()
             
             if save_choice == 'y':
-                filename = save_response(email, response_result['response'], analysis)
+                with metrics.timer("save"):
+                    filename = save_response(email, response_result['response'], analysis)
+                record_interaction(email, analysis, response_result['response'])
                 print(f"✅ Saved to: {filename}")
         else:
             print(f"❌ Response generation failed: {response_result['error']}")
@@ -353,13 +1779,48 @@ def main():
             cont = input("\n👉 Press Enter for next email (or 'q' to quit): ")
             if cont.lower() == 'q':
                 break
-    
-    # Show final statistics
-    show_session_stats()
 
 if __name__ == "__main__":
+    args = parse_args()
+    fast_path["enabled"] = fast_path["enabled"] and not args.no_fast_path
+    fast_path["threshold"] = args.fast_path_threshold
+    prefilter.enabled = prefilter.enabled and not args.no_prefilter
+    prefilter.deferred_path = args.deferred_path
+    HEDGING["enabled"] = HEDGING["enabled"] or args.hedge
+    ADAPTIVE["enabled"] = ADAPTIVE["enabled"] and not args.no_adaptive_concurrency
+    streaming["enabled"] = streaming["enabled"] and not args.no_stream
+    prefetching["depth"] = max(0, args.prefetch)
+    prefetching["drafts"] = args.prefetch_drafts
+    context.enabled = context.enabled and not args.no_history
+    context.max_tokens = args.history_tokens
+    budget.enabled = budget.enabled and not args.no_body_budget
+    budget.mode = args.body_fit
+    budget.budgets.update(analysis=args.analysis_body_tokens, generation=args.response_body_tokens,
+                          combined=args.response_body_tokens)
+    if args.prefilter_rules:
+        try:
+            prefilter.add_rules(load_rules(args.prefilter_rules))
+        except (OSError, ValueError) as e:
+            print(f"❌ Error loading pre-filter rules: {e}")
+            sys.exit(1)
+    configure_backend("analysis", args.analysis_model, args.analysis_base_url)
+    configure_backend("generation", args.generation_model, args.generation_base_url)
     try:
-        main()
+        for spec in args.prompt_version:
+            prompts.select_all(spec)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    try:
+        if args.import_history:
+            import_history(args.import_history, args.format)
+        elif args.batch or args.batch_job:
+            main_batch(args)
+        else:
+            main(args.input, args.format)
     except KeyboardInterrupt:
         print("\n\n⚠️  Program interrupted")
-        show_session_stats()
\ No newline at end of file
+        show_session_stats()
+    finally:
+        prefilter.close()
+        export_metrics(args)
\ No newline at end of file
@@ -0,0 +1,171 @@
+"""Lazy email readers for JSON, JSON Lines, mbox and Maildir inboxes"""
+import os
+import json
+
+DEFAULT_INBOX = os.getenv("EMAIL_INBOX", "sample_emails.json")
+CHUNK_SIZE = 64 * 1024
+
+
+def normalize_email(record, default_id=None):
+    """Make sure every email dict has the keys the scripts rely on"""
+    record.setdefault("id", default_id)
+    record["from"] = record.get("from") or ""
+    record["subject"] = record.get("subject") or ""
+    record["body"] = record.get("body") or ""
+    return record
+
+
+def iter_json_emails(path, chunk_size=CHUNK_SIZE):
+    """
+    Stream the entries of a {"emails": [...]} file one object at a time.
+
+    Reads the file in chunks and decodes each email with raw_decode, so
+    memory stays bounded by the largest single email, not the file.
+    """
+    decoder = json.JSONDecoder()
+
+    with open(path, "r", encoding="utf-8") as f:
+        buffer = ""
+        eof = False
+
+        def fill():
+            nonlocal buffer, eof
+            chunk = f.read(chunk_size)
+            if not chunk:
+                eof = True
+            buffer += chunk
+
+        # Find the opening bracket of the "emails" array
+        while True:
+            key = buffer.find('"emails"')
+            start = buffer.find("[", key) if key != -1 else -1
+            if start != -1:
+                pos = start + 1
+                break
+            if eof:
+                raise ValueError(f"{path}: no \"emails\" array found")
+            fill()
+
+        index = 0
+        while True:
+            # Skip separators between objects
+            while True:
+                while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                    pos += 1
+                if pos < len(buffer) or eof:
+                    break
+                fill()
+
+            if pos >= len(buffer):
+                raise ValueError(f"{path}: unexpected end of file inside \"emails\"")
+            if buffer[pos] == "]":
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                fill()
+                continue
+
+            index += 1
+            yield normalize_email(record, index)
+
+            # Drop what has been consumed so the buffer does not grow
+            buffer = buffer[end:]
+            pos = 0
+
+
+def iter_jsonl_emails(path):
+    """Stream emails from a JSON Lines file (one email object per line)"""
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, 1):
+            if line.strip():
+                yield normalize_email(json.loads(line), line_number)
+
+
+def decode_header_value(value):
+    """Decode RFC 2047 encoded headers like =?utf-8?...?="""
+    if not value:
+        return ""
+    from email.header import decode_header, make_header
+    try:
+        return str(make_header(decode_header(value)))
+    except (UnicodeDecodeError, LookupError):
+        return str(value)
+
+
+def message_body(message):
+    """Return the first text/plain part of a message as a string"""
+    parts = message.walk() if message.is_multipart() else [message]
+    for part in parts:
+        if part.get_content_type() == "text/plain" and not part.get_filename():
+            payload = part.get_payload(decode=True) or b""
+            charset = part.get_content_charset() or "utf-8"
+            try:
+                return payload.decode(charset, errors="replace")
+            except LookupError:
+                return payload.decode("utf-8", errors="replace")
+    return ""
+
+
+def message_to_email(message, key):
+    """Convert an email.message.Message into the scripts' email dict"""
+    return normalize_email({
+        "id": message.get("Message-ID") or str(key),
+        "from": decode_header_value(message.get("From")),
+        "subject": decode_header_value(message.get("Subject")),
+        "body": message_body(message),
+        "headers": {name.lower(): decode_header_value(value) for name, value in message.items()}
+    })
+
+
+def iter_mbox_emails(path):
+    """Stream emails from an mbox file; only message offsets are kept in memory"""
+    # mailbox (and the email package) only load for mbox/Maildir inboxes
+    import mailbox
+    box = mailbox.mbox(path, create=False)
+    try:
+        for key in box.iterkeys():
+            yield message_to_email(box.get_message(key), key)
+    finally:
+        box.close()
+
+
+def iter_maildir_emails(path):
+    """Stream emails from a Maildir directory (cur/ and new/)"""
+    import mailbox
+    box = mailbox.Maildir(path, factory=None, create=False)
+    for key in box.iterkeys():
+        yield message_to_email(box.get_message(key), key)
+
+
+READERS = {
+    "json": iter_json_emails,
+    "jsonl": iter_jsonl_emails,
+    "mbox": iter_mbox_emails,
+    "maildir": iter_maildir_emails
+}
+
+
+def detect_format(path):
+    """Guess the inbox format from the path"""
+    if os.path.isdir(path):
+        return "maildir"
+    extension = os.path.splitext(path)[1].lower()
+    if extension in (".jsonl", ".ndjson"):
+        return "jsonl"
+    if extension in (".mbox", ".mbx"):
+        return "mbox"
+    return "json"
+
+
+def read_emails(path=DEFAULT_INBOX, fmt=None):
+    """Return a lazy iterator of email dicts from path (format auto-detected)"""
+    fmt = fmt or detect_format(path)
+    if fmt not in READERS:
+        raise ValueError(f"Unknown inbox format: {fmt} (choose from {', '.join(READERS)})")
+    if not os.path.exists(path):
+        raise FileNotFoundError(f"{path} not found")
+    return READERS[fmt](path)
@@ -0,0 +1,37 @@
+"""Load .env before the modules that read their settings from the environment at import"""
+import os
+import sys
+
+_state = {"loaded": False}
+
+
+def find_env_file():
+    """The nearest .env, searching up from the running script's directory (like load_dotenv())"""
+    main = sys.modules.get("__main__")
+    main_file = getattr(main, "__file__", None)
+    path = os.path.dirname(os.path.abspath(main_file)) if main_file else os.getcwd()
+    while True:
+        candidate = os.path.join(path, ".env")
+        if os.path.isfile(candidate):
+            return candidate
+        parent = os.path.dirname(path)
+        if parent == path:
+            return None
+        path = parent
+
+
+def load_env():
+    """
+    Load the nearest .env into os.environ, once.
+
+    python-dotenv is only imported when there is a file to read, so a
+    deployment that sets its environment directly never pays for it.
+    Variables already set in the environment win, as with load_dotenv().
+    """
+    if _state["loaded"]:
+        return
+    _state["loaded"] = True
+    path = find_env_file()
+    if path:
+        from dotenv import load_dotenv
+        load_dotenv(path)
@@ -0,0 +1,251 @@
+"""Local fast-path email classifier (hashed bag-of-words + linear model)"""
+import os
+import re
+import sys
+import json
+import math
+import zlib
+
+from analysis_record import Analysis
+
+DEFAULT_MODEL_PATH = os.getenv("FAST_CLASSIFIER_PATH", ".fast_classifier.json")
+DEFAULT_THRESHOLD = float(os.getenv("FAST_CLASSIFIER_THRESHOLD", "0.85"))
+# A model trained on fewer labelled emails is never trusted (the 8 samples are far too few)
+MIN_TRAINING_EMAILS = int(os.getenv("FAST_CLASSIFIER_MIN_EXAMPLES", "200"))
+N_BUCKETS = 2 ** 18
+
+# Analysis fields the model can learn, keyed by the label name in training data
+FIELDS = {"type": "TYPE", "sentiment": "SENTIMENT", "priority": "PRIORITY", "tone": "TONE"}
+
+WORD = re.compile(r"[a-z0-9']+")
+SHOUTING = re.compile(r"\b[A-Z]{3,}\b")
+
+# Cue words for fields the training data does not label
+ANGRY_WORDS = ("unacceptable", "ridiculous", "worst", "furious", "terrible", "scam")
+NEGATIVE_WORDS = ("not working", "frustrat", "problem", "issue", "broken", "disappoint",
+                  "refund", "waiting", "error", "complain")
+POSITIVE_WORDS = ("thank", "great", "love", "amazing", "happy", "excellent", "appreciate",
+                  "wonderful", "looking forward")
+# Confidence of a guessed sentiment (and the tone picked from it): a cue word is some evidence,
+# no cue at all ("neutral") hardly any, so those emails go to the LLM at the default threshold
+CUE_CONFIDENCE = float(os.getenv("FAST_CLASSIFIER_CUE_CONFIDENCE", "0.85"))
+NO_CUE_CONFIDENCE = 0.5
+
+
+def extract_features(subject, body, sender=""):
+    """Turn an email into a list of hashed feature buckets"""
+    features = [f"w:{word}" for word in WORD.findall(body.lower())]
+    features += [f"s:{word}" for word in WORD.findall(subject.lower())]
+    features += [f"f:{word}" for word in WORD.findall(sender.split('@')[0].lower())]
+
+    text = f"{subject} {body}"
+    if SHOUTING.search(text):
+        features.append("cue:shouting")
+    if "!!" in text:
+        features.append("cue:exclaim")
+    if "?" in text:
+        features.append("cue:question")
+    features.append("cue:bias")
+
+    return [zlib.crc32(feature.encode("utf-8")) % N_BUCKETS for feature in features]
+
+
+def softmax(scores):
+    """Convert a {label: score} dict into probabilities"""
+    top = max(scores.values())
+    exps = {label: math.exp(score - top) for label, score in scores.items()}
+    total = sum(exps.values())
+    return {label: value / total for label, value in exps.items()}
+
+
+def guess_sentiment(subject, body):
+    """
+    Keyword fallback when no sentiment model has been trained: (sentiment, confidence).
+
+    >>> guess_sentiment("Refund", "This is unacceptable")
+    ('angry', 0.85)
+    >>> guess_sentiment("Plans", "Which plan fits a team of five?")
+    ('neutral', 0.5)
+    """
+    text = f"{subject} {body}".lower()
+    if any(word in text for word in ANGRY_WORDS) or "!!!" in text:
+        return "angry", CUE_CONFIDENCE
+    if any(word in text for word in NEGATIVE_WORDS):
+        return "negative", CUE_CONFIDENCE
+    if any(word in text for word in POSITIVE_WORDS):
+        return "positive", CUE_CONFIDENCE
+    return "neutral", NO_CUE_CONFIDENCE
+
+
+def guess_tone(email_type, sentiment, priority):
+    """Pick a tone the same way email_responder's auto mode does"""
+    if sentiment in ("angry", "negative") or priority == "urgent":
+        return "apologetic"
+    if email_type == "feedback" or sentiment == "positive":
+        return "enthusiastic"
+    if email_type == "sales":
+        return "friendly"
+    return "professional"
+
+
+class FastClassifier:
+    """
+    One sparse multinomial logistic regression per analysis field.
+
+    Weights are stored as {field: {label: {bucket: weight}}}, so only
+    features seen in training take memory and prediction is a handful of
+    dict lookups per word. examples is how many emails it was trained on.
+    """
+
+    def __init__(self, weights=None, examples=0):
+        self.weights = weights or {}
+        self.examples = examples
+
+    @property
+    def usable(self):
+        """Trained on enough emails for its confidence to mean something"""
+        return bool(self.weights) and self.examples >= MIN_TRAINING_EMAILS
+
+    def _scores(self, field, buckets):
+        return {
+            label: sum(label_weights.get(bucket, 0.0) for bucket in buckets)
+            for label, label_weights in self.weights[field].items()
+        }
+
+    def train(self, examples, epochs=30, learning_rate=0.5, l2=1e-4):
+        """
+        Fit on labelled emails.
+
+        Each example is a dict with subject, body, optional from, and any of
+        the lowercase labels type/sentiment/priority/tone (the same shape as
+        the entries in sample_emails.json).
+        """
+        featurized = [
+            (extract_features(e.get('subject', ''), e.get('body', ''), e.get('from', '')), e)
+            for e in examples
+        ]
+        self.examples = len(featurized)
+
+        for label_key, field in FIELDS.items():
+            labelled = [(buckets, e[label_key].lower()) for buckets, e in featurized
+                        if e.get(label_key)]
+            labels = sorted({label for _, label in labelled})
+            if len(labels) < 2:
+                continue
+
+            field_weights = {label: {} for label in labels}
+            self.weights[field] = field_weights
+            for _ in range(epochs):
+                for buckets, target in labelled:
+                    probs = softmax(self._scores(field, buckets))
+                    for label, prob in probs.items():
+                        gradient = learning_rate * ((label == target) - prob)
+                        label_weights = field_weights[label]
+                        for bucket in buckets:
+                            weight = label_weights.get(bucket, 0.0)
+                            label_weights[bucket] = weight * (1 - l2) + gradient
+        return self
+
+    def classify(self, subject, body, sender=""):
+        """
+        Predict an Analysis record like the one parse_analysis() makes.
+
+        Returns (analysis, confidence); confidence is the lowest top-class
+        probability among the trained fields, 0.0 if nothing is trained.
+        A sentiment and tone guessed from keywords (when they are not
+        trained) cap it at the guess's confidence, so an email is never
+        trusted more than its least certain label.
+
+        >>> bias = extract_features("", "")[-1]
+        >>> model = FastClassifier({"TYPE": {"support": {bias: 5.0}, "sales": {}}}, examples=500)
+        >>> analysis, confidence = model.classify("Login", "The app is not working")
+        >>> analysis.sentiment.value, analysis.tone.value, confidence
+        ('negative', 'apologetic', 0.85)
+        >>> model.classify("Plans", "Which plan fits a team of five?")[1]
+        0.5
+        """
+        buckets = extract_features(subject, body, sender)
+        analysis = {}
+        confidence = 1.0 if self.weights else 0.0
+
+        for field, label_weights in self.weights.items():
+            probs = softmax(self._scores(field, buckets))
+            label = max(probs, key=probs.get)
+            analysis[field] = label
+            confidence = min(confidence, probs[label])
+
+        if "SENTIMENT" not in analysis:
+            analysis["SENTIMENT"], guessed = guess_sentiment(subject, body)
+            confidence = min(confidence, guessed)
+        if "TONE" not in analysis:
+            # Picked from the labels above, so it is as certain as they are
+            analysis["TONE"] = guess_tone(analysis.get("TYPE", "general"),
+                                          analysis["SENTIMENT"],
+                                          analysis.get("PRIORITY", "medium"))
+
+        ordered = {field: analysis[field] for field in ("TYPE", "SENTIMENT", "PRIORITY", "TONE")
+                   if field in analysis}
+        return Analysis.from_dict(ordered), confidence
+
+    def save(self, path=DEFAULT_MODEL_PATH):
+        """Write the weights (and the training set size) to a JSON file"""
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"examples": self.examples, "weights": self.weights}, f)
+
+    @classmethod
+    def load(cls, path=DEFAULT_MODEL_PATH):
+        """Load weights saved with save()"""
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        # Files saved before the training set size was recorded hold only the weights
+        weights, examples = (data["weights"], data["examples"]) if "weights" in data else (data, 0)
+        # JSON turns the integer bucket keys into strings
+        return cls({
+            field: {label: {int(bucket): w for bucket, w in buckets.items()}
+                    for label, buckets in labels.items()}
+            for field, labels in weights.items()
+        }, examples)
+
+
+def load_training_file(path):
+    """Read labelled emails from a {"emails": [...]} JSON file or JSON Lines"""
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)["emails"]
+
+
+_classifier = None
+
+
+def get_classifier(path=DEFAULT_MODEL_PATH):
+    """
+    Load the saved model on first use.
+
+    Without one (train it with this script on your labelled history), the
+    model is empty and never confident, so every analysis goes to the LLM.
+    """
+    global _classifier
+    if _classifier is None:
+        _classifier = FastClassifier.load(path) if os.path.exists(path) else FastClassifier()
+    return _classifier
+
+
+if __name__ == "__main__":
+    # python fast_classifier.py labelled_history.json [model.json]
+    if len(sys.argv) < 2:
+        print("Usage: python fast_classifier.py <labelled emails .json/.jsonl> [model path]")
+        sys.exit(1)
+
+    examples = load_training_file(sys.argv[1])
+    model_path = sys.argv[2] if len(sys.argv) > 2 else DEFAULT_MODEL_PATH
+    model = FastClassifier().train(examples)
+    model.save(model_path)
+
+    correct = sum(model.classify(e['subject'], e['body'], e.get('from', ''))[0].get("TYPE") ==
+                  e.get('type', '').lower() for e in examples)
+    print(f"✅ Trained on {len(examples)} emails ({', '.join(model.weights)})")
+    print(f"   Training TYPE accuracy: {correct}/{len(examples)}")
+    print(f"💾 Saved to {model_path}")
+    if not model.usable:
+        print(f"⚠️  Fewer than {MIN_TRAINING_EMAILS} emails: the fast path stays off until it is trained on more")
@@ -0,0 +1,118 @@
+"""
+Shared connection-pooled OpenAI clients with per-stage timeouts and hedging delays.
+
+The SDK (httpx, pydantic and friends take most of a second to import) is
+only loaded when the first client is built, so the scripts start fast and
+their pure helpers can be imported without it.
+"""
+import os
+import threading
+
+from env_file import load_env
+
+DEFAULT_POOL_SIZE = int(os.getenv("OPENAI_POOL_SIZE", "16"))
+KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "30"))
+CONNECT_TIMEOUT = float(os.getenv("OPENAI_CONNECT_TIMEOUT", "5"))
+
+# Read timeouts per stage: a 50-token analysis should never hang for minutes
+STAGE_READ_TIMEOUTS = {
+    "analysis": float(os.getenv("OPENAI_ANALYSIS_TIMEOUT", "20")),
+    "generation": float(os.getenv("OPENAI_GENERATION_TIMEOUT", "60")),
+    "combined": float(os.getenv("OPENAI_GENERATION_TIMEOUT", "60"))
+}
+DEFAULT_READ_TIMEOUT = 60.0
+
+# Hedging: send a backup request when a call is slower than usual (opt-in: the loser may be billed)
+HEDGING = {"enabled": os.getenv("OPENAI_HEDGING", "0") in ("1", "true", "yes")}
+
+_lock = threading.Lock()
+# Clients are keyed by (base_url, api_key): one pool per endpoint (see model_backends)
+_state = {"pool_size": DEFAULT_POOL_SIZE, "clients": {}, "async_clients": {}, "async_loop": None}
+
+
+def _httpx():
+    try:
+        import httpx
+    except ImportError:  # newer SDK releases are built on the httpx2 fork
+        import httpx2 as httpx
+    return httpx
+
+
+def stage_timeout(stage):
+    """Connect/read/write/pool timeouts for one stage's requests"""
+    read = STAGE_READ_TIMEOUTS.get(stage, DEFAULT_READ_TIMEOUT)
+    return _httpx().Timeout(connect=CONNECT_TIMEOUT, read=read, write=10.0, pool=read)
+
+
+def hedge_delay(stage):
+    """
+    Longest wait before hedging a call of stage (half its read timeout), or None to not hedge.
+
+    The scheduler hedges sooner once it knows how long first attempts
+    usually take (see CallScheduler.hedge_delay).
+    """
+    if not HEDGING["enabled"]:
+        return None
+    return STAGE_READ_TIMEOUTS.get(stage, DEFAULT_READ_TIMEOUT) / 2
+
+
+def _limits():
+    # Headroom above the pool size for hedged requests and a second pipeline stage
+    pool_size = _state["pool_size"]
+    return _httpx().Limits(max_connections=pool_size * 2, max_keepalive_connections=pool_size,
+                        keepalive_expiry=KEEPALIVE_SECONDS)
+
+
+def configure_pool(pool_size):
+    """Size the connection pool for pool_size concurrent calls (drops existing clients)"""
+    with _lock:
+        _state["pool_size"] = max(1, pool_size)
+        _state["clients"] = {}
+        _state["async_clients"] = {}
+        _state["async_loop"] = None
+
+
+def get_client(base_url=None, api_key=None):
+    """
+    The process-wide blocking client for an endpoint, created on first use.
+
+    base_url None means the SDK default (OPENAI_BASE_URL or OpenAI itself);
+    api_key None means OPENAI_API_KEY.
+    """
+    with _lock:
+        client = _state["clients"].get((base_url, api_key))
+        if client is None:
+            load_env()
+            from openai import OpenAI, DefaultHttpxClient
+            client = _state["clients"][(base_url, api_key)] = OpenAI(
+                api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                base_url=base_url,
+                # Retries are handled by llm_scheduler, so disable the SDK's own retry loop
+                max_retries=0,
+                timeout=stage_timeout(None),
+                http_client=DefaultHttpxClient(limits=_limits(), timeout=stage_timeout(None))
+            )
+        return client
+
+
+def get_async_client(base_url=None, api_key=None):
+    """The async client for an endpoint and the running event loop (pooled connections are tied to a loop)"""
+    # Already imported by whoever started the loop
+    import asyncio
+    loop = asyncio.get_running_loop()
+    with _lock:
+        if _state["async_loop"] is not loop:
+            _state["async_clients"] = {}
+            _state["async_loop"] = loop
+        client = _state["async_clients"].get((base_url, api_key))
+        if client is None:
+            load_env()
+            from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+            client = _state["async_clients"][(base_url, api_key)] = AsyncOpenAI(
+                api_key=api_key or os.getenv("OPENAI_API_KEY"),
+                base_url=base_url,
+                max_retries=0,
+                timeout=stage_timeout(None),
+                http_client=DefaultAsyncHttpxClient(limits=_limits(), timeout=stage_timeout(None))
+            )
+        return client
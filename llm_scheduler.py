@@ -0,0 +1,434 @@
+"""Shared rate limiting and retry scheduling for all chat completion calls"""
+import os
+import time
+import random
+import threading
+
+from metrics import LatencyHistogram
+from concurrency_limit import AdaptiveLimiter
+
+# Defaults match the default model's (gpt-4o-mini) tier 1 limits; override via .env or the environment
+DEFAULT_RPM = int(os.getenv("OPENAI_RPM_LIMIT", "500"))
+DEFAULT_TPM = int(os.getenv("OPENAI_TPM_LIMIT", "200000"))
+DEFAULT_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+
+# Hedging: first attempts of a kind seen before their p95 is trusted, and the shortest delay used
+HEDGE_MIN_SAMPLES = 20
+HEDGE_MIN_DELAY = 0.5
+
+# HTTP statuses worth retrying: timeout, conflict, rate limit, server errors
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+RETRYABLE_ERRORS = {"APIConnectionError", "APITimeoutError"}
+
+
+def estimate_tokens(messages, max_tokens=0):
+    """
+    Estimate tokens a call will consume before sending it.
+
+    Uses the ~4 characters per token rule of thumb plus a few tokens of
+    per-message overhead, and counts max_tokens since the completion is
+    billed against the same tokens-per-minute budget.
+    """
+    chars = sum(len(message.get("content") or "") for message in messages)
+    return chars // 4 + 4 * len(messages) + 3 + (max_tokens or 0)
+
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at rate_per_minute"""
+
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        """
+        Take amount tokens, going into debt if needed.
+
+        Returns how many seconds the caller must wait before the
+        reservation is covered (0.0 when tokens were available).
+        """
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def refund(self, amount):
+        """Give back tokens that were reserved but not used"""
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class HeldStream:
+    """
+    A streamed response that keeps its limiter slot while it is read.
+
+    The slot is released, with the whole stream's duration, when the
+    stream is read to the end or fails, and given back without judging
+    the endpoint when it is closed early. Anything else is passed on to
+    the wrapped stream.
+    """
+
+    # Until __init__ has run, so __del__ and __getattr__ never recurse
+    stream = None
+    open = False
+
+    def __init__(self, stream, limiter, started, begin, kind):
+        self.stream = stream
+        self.limiter = limiter
+        self.started = started
+        self.begin = begin
+        self.kind = kind
+        self.open = True
+
+    def _finish(self, error=None, cancelled=False):
+        if not self.open:
+            return
+        self.open = False
+        if cancelled:
+            self.limiter.cancel(self.started)
+        else:
+            self.limiter.release(self.started, time.perf_counter() - self.begin, self.kind, error)
+
+    def __iter__(self):
+        try:
+            for chunk in self.stream:
+                yield chunk
+        except GeneratorExit:
+            # The reader stopped early (break, or dropped the iterator)
+            self._finish(cancelled=True)
+            raise
+        except Exception as e:
+            self._finish(e)
+            raise
+        self._finish()
+
+    def close(self):
+        try:
+            self.stream.close()
+        finally:
+            self._finish(cancelled=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __del__(self):
+        self._finish(cancelled=True)
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
+
+def is_retryable(error):
+    """True for rate limits, timeouts, connection drops and 5xx errors"""
+    if type(error).__name__ in RETRYABLE_ERRORS:
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+def retry_after_seconds(error):
+    """Read the server's Retry-After hint from an API error, if any"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except (TypeError, ValueError):
+        # Retry-After may also be an HTTP date; fall back to backoff
+        return None
+    return None
+
+
+class CallScheduler:
+    """
+    Enforces RPM/TPM budgets and retries transient failures.
+
+    Every chat completion goes through call() or call_async(), which wait
+    for the request and token buckets, then retry retryable errors with
+    jittered exponential backoff (honoring Retry-After when present).
+
+    With hedge_after, an attempt still running past the p95 latency of
+    earlier first attempts of its kind (at most hedge_after seconds) gets
+    an identical backup request, and whichever answers first wins.
+
+    Every request, backups included, holds a slot of an adaptive
+    concurrency limiter (see concurrency_limit), which learns how many
+    calls the endpoint handles at once from their latency, throttling and
+    errors. Backups are only sent when a slot and the budget are free
+    right away.
+    """
+
+    def __init__(self, rpm=DEFAULT_RPM, tpm=DEFAULT_TPM, max_retries=DEFAULT_MAX_RETRIES,
+                 base_delay=1.0, max_delay=60.0, name="default"):
+        self.set_budget(rpm, tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.stats = {
+            "calls": 0,
+            "throttled": 0,
+            "throttle_wait": 0.0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failures": 0,
+            "hedged": 0,
+            "hedge_wins": 0
+        }
+        self._executor = None
+        self.limiter = AdaptiveLimiter(name)
+        # First-attempt latency by _kind(), for the hedge delay
+        self.first_attempts = {}
+
+    def set_budget(self, rpm, tpm):
+        """Replace the requests/tokens per minute budget (e.g. a worker's share)"""
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_bucket = TokenBucket(rpm)
+        self.token_bucket = TokenBucket(tpm)
+
+    def _count(self, key, amount=1):
+        with self.lock:
+            self.stats[key] += amount
+
+    def _reserve(self, kwargs):
+        """Reserve budget for one call; returns (estimated tokens, wait seconds)"""
+        estimated = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        wait = max(self.request_bucket.reserve(1), self.token_bucket.reserve(estimated))
+        if wait > 0:
+            self._count("throttled")
+            self._count("throttle_wait", wait)
+        return estimated, wait
+
+    def _settle(self, estimated, response):
+        """Refund the part of the token estimate the call did not use"""
+        usage = getattr(response, "usage", None)
+        if usage is not None and usage.total_tokens < estimated:
+            self.token_bucket.refund(estimated - usage.total_tokens)
+
+    def _backoff(self, attempt, error):
+        """Delay before the next attempt: Retry-After, else full-jitter backoff"""
+        if getattr(error, "status_code", None) == 429:
+            self._count("rate_limited")
+        hinted = retry_after_seconds(error)
+        if hinted is not None:
+            return min(hinted, self.max_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    @staticmethod
+    def _kind(kwargs):
+        """Calls the limiter compares latencies between: same max_tokens, both streamed or not"""
+        return kwargs.get("max_tokens"), bool(kwargs.get("stream"))
+
+    def _record_first_attempt(self, kind, seconds):
+        with self.lock:
+            self.first_attempts.setdefault(kind, LatencyHistogram()).observe(seconds)
+
+    def hedge_delay(self, kwargs, hedge_after):
+        """
+        Seconds to wait before hedging this call, or None to not hedge.
+
+        The p95 latency of this kind of call's first attempts, which leaves
+        out rate-limit waits, retries and backoff; hedge_after is the upper
+        bound, and half of it is used until there are enough samples.
+        """
+        if not hedge_after:
+            return None
+        with self.lock:
+            histogram = self.first_attempts.get(self._kind(kwargs))
+            if histogram is None or histogram.count < HEDGE_MIN_SAMPLES:
+                return hedge_after / 2
+            return min(hedge_after, max(HEDGE_MIN_DELAY, histogram.percentile(95)))
+
+    def _reserve_hedge(self, kwargs):
+        """
+        Take a limiter slot and budget for a backup request without waiting.
+
+        Returns the slot's start time (see AdaptiveLimiter.acquire), or
+        False if the limiter or the budget has no room for it right now.
+        """
+        started = self.limiter.try_acquire()
+        if started is False:
+            return False
+        estimated = estimate_tokens(kwargs.get("messages", []), kwargs.get("max_tokens"))
+        wait = max(self.request_bucket.reserve(1), self.token_bucket.reserve(estimated))
+        if wait > 0:
+            self.request_bucket.refund(1)
+            self.token_bucket.refund(estimated)
+            self.limiter.cancel(started)
+            return False
+        self._count("hedged")
+        return started
+
+    def _run(self, create, kwargs, started):
+        """One request; frees the limiter slot taken at started once it is answered (a stream: once read)"""
+        begin = time.perf_counter()
+        try:
+            response = create(**kwargs)
+        except Exception as e:
+            self.limiter.release(started, time.perf_counter() - begin, self._kind(kwargs), e)
+            raise
+        if kwargs.get("stream"):
+            return HeldStream(response, self.limiter, started, begin, self._kind(kwargs))
+        self.limiter.release(started, time.perf_counter() - begin, self._kind(kwargs))
+        return response
+
+    async def _run_async(self, create, kwargs, started):
+        """Async version of _run(); a cancelled request frees its slot without judging the endpoint"""
+        import asyncio
+        begin = time.perf_counter()
+        try:
+            response = await create(**kwargs)
+        except asyncio.CancelledError:
+            self.limiter.cancel(started)
+            raise
+        except Exception as e:
+            self.limiter.release(started, time.perf_counter() - begin, self._kind(kwargs), e)
+            raise
+        self.limiter.release(started, time.perf_counter() - begin, self._kind(kwargs))
+        return response
+
+    def _attempt(self, create, kwargs, hedge_after, started):
+        """One attempt, hedged with a backup request if it is too slow"""
+        delay = self.hedge_delay(kwargs, hedge_after)
+        if not delay:
+            return self._run(create, kwargs, started)
+
+        from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait as wait_futures
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="hedge")
+        first = self._executor.submit(self._run, create, kwargs, started)
+        done, _ = wait_futures([first], timeout=delay)
+        if done:
+            return first.result()
+        hedge_started = self._reserve_hedge(kwargs)
+        if hedge_started is False:
+            return first.result()
+
+        # A blocking request can't be cancelled: the loser finishes (and frees its slot) in the background
+        pending = {first, self._executor.submit(self._run, create, kwargs, hedge_started)}
+        while True:
+            done, pending = wait_futures(pending, return_when=FIRST_COMPLETED)
+            winner = next((future for future in done if future.exception() is None), None)
+            if winner is not None:
+                if winner is not first:
+                    self._count("hedge_wins")
+                return winner.result()
+            if not pending:
+                # Both failed: surface the original request's error
+                return first.result()
+
+    async def _attempt_async(self, create, kwargs, hedge_after, started):
+        """Async version of _attempt(); the losing request is cancelled"""
+        import asyncio
+        delay = self.hedge_delay(kwargs, hedge_after)
+        if not delay:
+            return await self._run_async(create, kwargs, started)
+
+        first = asyncio.ensure_future(self._run_async(create, kwargs, started))
+        pending = {first}
+        try:
+            done, _ = await asyncio.wait({first}, timeout=delay)
+            if done:
+                return first.result()
+            hedge_started = self._reserve_hedge(kwargs)
+            if hedge_started is False:
+                return await first
+
+            pending.add(asyncio.ensure_future(self._run_async(create, kwargs, hedge_started)))
+            while True:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                winner = next((task for task in done if task.exception() is None), None)
+                if winner is not None:
+                    if winner is not first:
+                        self._count("hedge_wins")
+                    return winner.result()
+                if not pending:
+                    return first.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def call(self, create, hedge_after=None, on_start=None, **kwargs):
+        """
+        Run a blocking create(**kwargs) under the rate limits with retries.
+
+        hedge_after is the longest a call waits before it is hedged (None:
+        never). on_start() is called once the first attempt has its
+        concurrency slot, so callers can leave queueing out of their
+        timings. A stream keeps its limiter slot until it is read to the
+        end or closed.
+        """
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            estimated, wait = self._reserve(kwargs)
+            if wait > 0:
+                time.sleep(wait)
+            started = self.limiter.acquire()
+            begin = time.perf_counter()
+            if attempt == 0 and on_start is not None:
+                on_start()
+            try:
+                response = self._attempt(create, kwargs, hedge_after, started)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                time.sleep(self._backoff(attempt, e))
+                continue
+            if attempt == 0 and not kwargs.get("stream"):
+                self._record_first_attempt(self._kind(kwargs), time.perf_counter() - begin)
+            self._settle(estimated, response)
+            return response
+
+    async def call_async(self, create, hedge_after=None, on_start=None, **kwargs):
+        """Async version of call() for AsyncOpenAI clients"""
+        # Imported here so the blocking scripts never load asyncio; it is
+        # already in sys.modules whenever an event loop is running
+        import asyncio
+        self._count("calls")
+        for attempt in range(self.max_retries + 1):
+            estimated, wait = self._reserve(kwargs)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            started = await self.limiter.acquire_async()
+            begin = time.perf_counter()
+            if attempt == 0 and on_start is not None:
+                on_start()
+            try:
+                response = await self._attempt_async(create, kwargs, hedge_after, started)
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    self._count("failures")
+                    raise
+                self._count("retries")
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            if attempt == 0:
+                self._record_first_attempt(self._kind(kwargs), time.perf_counter() - begin)
+            self._settle(estimated, response)
+            return response
+
+
+# One scheduler per process so every module shares the same budget
+scheduler = CallScheduler()
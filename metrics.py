@@ -0,0 +1,363 @@
+"""Per-stage latency, token, cost and error metrics with JSON/Prometheus export"""
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+# Histogram bucket upper bounds in seconds (Prometheus-style, cumulative on export)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0,
+                   float("inf"))
+# Time from batch start to a draft: a large inbox takes minutes to hours, not seconds
+DRAFT_BUCKETS = (1.0, 5.0, 15.0, 30.0, 60.0, 120.0, 300.0, 600.0, 900.0, 1800.0, 3600.0, 7200.0,
+                 14400.0, 28800.0, float("inf"))
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[rank]
+
+
+def error_category(error):
+    """Bucket an exception into a small set of categories worth alerting on"""
+    status = getattr(error, "status_code", None)
+    name = type(error).__name__
+    if status == 429:
+        return "rate_limit"
+    if "Timeout" in name or status == 408:
+        return "timeout"
+    if "Connection" in name:
+        return "connection"
+    if status is not None and status >= 500:
+        return "server"
+    if status is not None and status >= 400:
+        return "client"
+    if isinstance(error, ValueError):
+        return "parse"
+    return "other"
+
+
+class LatencyHistogram:
+    """
+    Fixed-bucket latency histogram.
+
+    Memory is constant no matter how many calls are recorded; percentiles
+    are interpolated inside the bucket that contains them.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds):
+        for i, bound in enumerate(self.buckets):
+            if seconds <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def percentile(self, pct):
+        """Estimated latency (seconds) below which pct% of calls fall"""
+        if not self.count:
+            return 0.0
+        target = pct / 100 * self.count
+        seen = 0
+        lower = 0.0
+        for bound, bucket_count in zip(self.buckets, self.counts):
+            if bucket_count and seen + bucket_count >= target:
+                upper = min(bound, self.max)
+                fraction = (target - seen) / bucket_count
+                return lower + (max(upper, lower) - lower) * fraction
+            seen += bucket_count
+            lower = bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": self.total,
+            "max": self.max,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+            "buckets": {str(bound): count for bound, count in zip(self.buckets, self.counts)}
+        }
+
+
+def new_group(buckets=LATENCY_BUCKETS):
+    return {
+        "latency": LatencyHistogram(buckets),
+        "calls": 0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+        "cached_tokens": 0,
+        "cost": 0.0,
+        "errors": {}
+    }
+
+
+class Metrics:
+    """
+    Thread-safe registry of per-stage and per-email-type figures.
+
+    Stages are names like "analysis", "generation", "combined", "save";
+    email types come from the analysis (support, sales, ...). Priorities
+    hold the time from batch start until each email's draft was ready;
+    streams hold each streamed call's time to first token, plus the
+    tokens and seconds after it (for tokens/sec). Concurrency holds each
+    endpoint's adaptive in-flight limit and the decisions that moved it.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.stages = {}
+            self.types = {}
+            self.priorities = {}
+            self.streams = {}
+            self.concurrency = {}
+
+    def _groups(self, stage, email_type):
+        groups = [self.stages.setdefault(stage, new_group())]
+        if email_type:
+            groups.append(self.types.setdefault(email_type, new_group()))
+        return groups
+
+    def record_call(self, stage, seconds, usage=None, cost=0.0, email_type=None):
+        """Record one successful call (or unit of work) for a stage"""
+        prompt = getattr(usage, "prompt_tokens", 0) if usage is not None else 0
+        completion = getattr(usage, "completion_tokens", 0) if usage is not None else 0
+        # Prompt tokens the provider served from its prefix cache
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached = (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+        with self.lock:
+            for group in self._groups(stage, email_type):
+                group["latency"].observe(seconds)
+                group["calls"] += 1
+                group["prompt_tokens"] += prompt
+                group["completion_tokens"] += completion
+                group["cached_tokens"] += cached
+                group["cost"] += cost
+
+    def record_error(self, stage, error, email_type=None):
+        """Count a failed call under its error category"""
+        category = error_category(error)
+        with self.lock:
+            for group in self._groups(stage, email_type):
+                group["errors"][category] = group["errors"].get(category, 0) + 1
+
+    def record_draft(self, priority, seconds_since_start):
+        """Record when a draft of this priority was ready, relative to batch start"""
+        with self.lock:
+            group = self.priorities.setdefault(priority, new_group(DRAFT_BUCKETS))
+            group["latency"].observe(seconds_since_start)
+            group["calls"] += 1
+            first = group.get("first")
+            group["first"] = seconds_since_start if first is None else min(first, seconds_since_start)
+
+    def record_stream(self, stage, ttft, seconds, completion_tokens):
+        """Record a streamed call: time to first token, then seconds spent receiving completion_tokens"""
+        with self.lock:
+            group = self.streams.setdefault(stage, new_group())
+            group["latency"].observe(ttft)
+            group["calls"] += 1
+            group["completion_tokens"] += completion_tokens
+            group["stream_seconds"] = group.get("stream_seconds", 0.0) + seconds
+
+    def _limit_group(self, endpoint, limit):
+        return self.concurrency.setdefault(endpoint, {"limit": limit, "peak": limit, "low": limit, "increases": 0,
+                                                      "decreases": {}, "waits": 0, "wait_seconds": 0.0})
+
+    def record_limit(self, endpoint, limit, decision=None, reason=None):
+        """Record an endpoint's concurrency limit, and the decision ("increase"/"decrease") that changed it"""
+        with self.lock:
+            group = self._limit_group(endpoint, limit)
+            group["limit"] = limit
+            group["peak"] = max(group["peak"], limit)
+            group["low"] = min(group["low"], limit)
+            if decision == "increase":
+                group["increases"] += 1
+            elif decision == "decrease":
+                group["decreases"][reason] = group["decreases"].get(reason, 0) + 1
+
+    def record_limit_wait(self, endpoint, limit, seconds):
+        """Count a call that waited seconds for a slot under the endpoint's concurrency limit"""
+        with self.lock:
+            group = self._limit_group(endpoint, limit)
+            group["waits"] += 1
+            group["wait_seconds"] += seconds
+
+    def tokens_per_second(self, stage):
+        """Completion tokens per second after the first token, over a stage's streamed calls"""
+        with self.lock:
+            group = self.streams.get(stage)
+            seconds = group.get("stream_seconds", 0.0) if group else 0.0
+            return group["completion_tokens"] / seconds if seconds else 0.0
+
+    def time_to_first(self, priority):
+        """Seconds from batch start to the first draft of priority (None if none yet)"""
+        with self.lock:
+            return self.priorities.get(priority, {}).get("first")
+
+    @contextmanager
+    def timer(self, stage):
+        """Time a block of work (e.g. file I/O) as one call of stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_call(stage, time.perf_counter() - start)
+
+    def merge(self, snapshot):
+        """Add a snapshot() taken elsewhere (e.g. in a worker process)"""
+        with self.lock:
+            for key, groups, buckets in (("stages", self.stages, LATENCY_BUCKETS),
+                                         ("types", self.types, LATENCY_BUCKETS),
+                                         ("priorities", self.priorities, DRAFT_BUCKETS),
+                                         ("streams", self.streams, LATENCY_BUCKETS)):
+                for name, other in snapshot.get(key, {}).items():
+                    group = groups.setdefault(name, new_group(buckets))
+                    for field in ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "cost"):
+                        group[field] += other.get(field, 0)
+                    if "stream_seconds" in other:
+                        group["stream_seconds"] = group.get("stream_seconds", 0.0) + other["stream_seconds"]
+                    for category, count in other["errors"].items():
+                        group["errors"][category] = group["errors"].get(category, 0) + count
+                    histogram = group["latency"]
+                    latency = other["latency"]
+                    for i, count in enumerate(latency["buckets"].values()):
+                        histogram.counts[i] += count
+                    histogram.count += latency["count"]
+                    histogram.total += latency["sum"]
+                    histogram.max = max(histogram.max, latency["max"])
+                    if other.get("first") is not None:
+                        first = group.get("first")
+                        group["first"] = other["first"] if first is None else min(first, other["first"])
+            # Each worker process has its own limiters: their limits add up
+            for endpoint, other in snapshot.get("concurrency", {}).items():
+                group = self.concurrency.get(endpoint)
+                if group is None:
+                    self.concurrency[endpoint] = {**other, "decreases": dict(other["decreases"])}
+                    continue
+                for field in ("limit", "peak", "low", "increases", "waits", "wait_seconds"):
+                    group[field] += other[field]
+                for reason, count in other["decreases"].items():
+                    group["decreases"][reason] = group["decreases"].get(reason, 0) + count
+
+    def snapshot(self):
+        """All metrics as plain JSON-friendly dicts"""
+        def dump(groups):
+            return {
+                name: {**{k: v for k, v in group.items() if k != "latency"},
+                       "errors": dict(group["errors"]),
+                       "latency": group["latency"].to_dict()}
+                for name, group in groups.items()
+            }
+        with self.lock:
+            return {"stages": dump(self.stages), "types": dump(self.types),
+                    "priorities": dump(self.priorities), "streams": dump(self.streams),
+                    "concurrency": {endpoint: {**group, "decreases": dict(group["decreases"])}
+                                    for endpoint, group in self.concurrency.items()}}
+
+    def write_json(self, path, extra=None):
+        """Dump a snapshot (plus any extra figures) to a JSON file"""
+        data = self.snapshot()
+        if extra:
+            data.update(extra)
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f, indent=2, default=str)
+
+    def write_prometheus(self, path, prefix="email_responder"):
+        """Dump metrics in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = []
+
+        def emit_group(label_name, groups):
+            for name, group in groups.items():
+                labels = f'{label_name}="{name}"'
+                latency = group["latency"]
+                cumulative = 0
+                for bound, count in latency["buckets"].items():
+                    cumulative += count
+                    le = "+Inf" if bound == "inf" else bound
+                    lines.append(f'{prefix}_{label_name}_latency_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f'{prefix}_{label_name}_latency_seconds_sum{{{labels}}} {latency["sum"]}')
+                lines.append(f'{prefix}_{label_name}_latency_seconds_count{{{labels}}} {latency["count"]}')
+                lines.append(f'{prefix}_{label_name}_prompt_tokens_total{{{labels}}} {group["prompt_tokens"]}')
+                lines.append(f'{prefix}_{label_name}_completion_tokens_total{{{labels}}} {group["completion_tokens"]}')
+                lines.append(f'{prefix}_{label_name}_cached_prompt_tokens_total{{{labels}}} {group["cached_tokens"]}')
+                lines.append(f'{prefix}_{label_name}_cost_dollars_total{{{labels}}} {group["cost"]}')
+                for category, count in group["errors"].items():
+                    lines.append(f'{prefix}_{label_name}_errors_total{{{labels},category="{category}"}} {count}')
+
+        for label_name, groups in (("stage", snapshot["stages"]), ("type", snapshot["types"])):
+            lines.append(f"# TYPE {prefix}_{label_name}_latency_seconds histogram")
+            emit_group(label_name, groups)
+
+        # Time from batch start until drafts of each priority were ready
+        lines.append(f"# TYPE {prefix}_time_to_draft_seconds histogram")
+        for name, group in snapshot["priorities"].items():
+            labels = f'priority="{name}"'
+            latency = group["latency"]
+            cumulative = 0
+            for bound, count in latency["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == "inf" else bound
+                lines.append(f'{prefix}_time_to_draft_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_time_to_draft_seconds_sum{{{labels}}} {latency["sum"]}')
+            lines.append(f'{prefix}_time_to_draft_seconds_count{{{labels}}} {latency["count"]}')
+        lines.append(f"# TYPE {prefix}_time_to_first_draft_seconds gauge")
+        for name, group in snapshot["priorities"].items():
+            lines.append(f'{prefix}_time_to_first_draft_seconds{{priority="{name}"}} {group["first"]}')
+
+        # Streamed calls: time to first token and generation speed after it
+        lines.append(f"# TYPE {prefix}_time_to_first_token_seconds histogram")
+        for name, group in snapshot["streams"].items():
+            labels = f'stage="{name}"'
+            latency = group["latency"]
+            cumulative = 0
+            for bound, count in latency["buckets"].items():
+                cumulative += count
+                le = "+Inf" if bound == "inf" else bound
+                lines.append(f'{prefix}_time_to_first_token_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            lines.append(f'{prefix}_time_to_first_token_seconds_sum{{{labels}}} {latency["sum"]}')
+            lines.append(f'{prefix}_time_to_first_token_seconds_count{{{labels}}} {latency["count"]}')
+        lines.append(f"# TYPE {prefix}_stream_tokens_per_second gauge")
+        for name, group in snapshot["streams"].items():
+            seconds = group.get("stream_seconds", 0.0)
+            rate = group["completion_tokens"] / seconds if seconds else 0.0
+            lines.append(f'{prefix}_stream_tokens_per_second{{stage="{name}"}} {rate}')
+
+        # Adaptive concurrency: each endpoint's current limit and what moved it
+        lines.append(f"# TYPE {prefix}_concurrency_limit gauge")
+        for endpoint, group in snapshot["concurrency"].items():
+            lines.append(f'{prefix}_concurrency_limit{{endpoint="{endpoint}"}} {group["limit"]}')
+        lines.append(f"# TYPE {prefix}_concurrency_decisions_total counter")
+        for endpoint, group in snapshot["concurrency"].items():
+            labels = f'endpoint="{endpoint}"'
+            lines.append(f'{prefix}_concurrency_decisions_total{{{labels},decision="increase",reason="healthy"}} '
+                         f'{group["increases"]}')
+            for reason, count in group["decreases"].items():
+                lines.append(f'{prefix}_concurrency_decisions_total{{{labels},decision="decrease",reason="{reason}"}} '
+                             f'{count}')
+        lines.append(f"# TYPE {prefix}_concurrency_wait_seconds_total counter")
+        for endpoint, group in snapshot["concurrency"].items():
+            lines.append(f'{prefix}_concurrency_wait_seconds_total{{endpoint="{endpoint}"}} {group["wait_seconds"]}')
+
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+
+# Shared registry for the scripts
+metrics = Metrics()
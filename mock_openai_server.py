@@ -0,0 +1,389 @@
+"""
+Local stand-in for the OpenAI chat-completions API, for offline benchmarks.
+
+The Files and Batches endpoints are emulated too, so --batch-job runs can
+use the real Batch API backend against it.
+
+Point any script at it with:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 OPENAI_API_KEY=mock python email_responder_pro.py
+"""
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+ANALYSIS_REPLY = "TYPE: {type}\nSENTIMENT: {sentiment}\nPRIORITY: {priority}\nTONE: {tone}"
+
+DRAFT_REPLY = """Hi there,
+
+Thank you for reaching out about "{subject}". We have looked into your message and
+want to make sure everything is handled properly. Our team will follow up with the
+details you asked for shortly.
+
+Please let us know if there is anything else we can help with in the meantime.
+
+Best regards,
+Customer Support Team"""
+
+# Streamed replies: share of the latency spent before the first token, and chunk size
+FIRST_TOKEN_SHARE = 0.2
+STREAM_CHUNK = re.compile(r"\s*\S+")
+
+LABELS = [
+    {"type": "support", "sentiment": "negative", "priority": "high", "tone": "apologetic"},
+    {"type": "sales", "sentiment": "positive", "priority": "medium", "tone": "friendly"},
+    {"type": "general", "sentiment": "neutral", "priority": "low", "tone": "professional"},
+    {"type": "feedback", "sentiment": "positive", "priority": "low", "tone": "enthusiastic"}
+]
+
+
+class MockSettings:
+    """Latency and failure behaviour of the mock server"""
+
+    def __init__(self, latency_ms=300.0, jitter=0.5, error_rate=0.0, rate_limit_rate=0.0,
+                 retry_after=1.0, seed=None, cache_min_tokens=1024, max_concurrent=0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.cache_min_tokens = cache_min_tokens
+        # Requests beyond this many at once are rejected with 429, like a saturated provider (0 = no limit)
+        self.max_concurrent = max_concurrent
+        self.in_flight = 0
+        self.prefixes = set()
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "errors": 0, "rate_limited": 0}
+        # Uploaded and generated files by id, and batches by id
+        self.files = {}
+        self.batches = {}
+
+    def sample_latency(self):
+        """Log-normal latency around latency_ms (jitter is the sigma)"""
+        with self.lock:
+            factor = self.random.lognormvariate(0, self.jitter) if self.jitter else 1.0
+        return self.latency_ms * factor / 1000
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def cached_prefix_tokens(self, prompt):
+        """
+        Emulate provider prefix caching: the longest previously seen prefix of
+        prompt, in 128-token steps from cache_min_tokens on, is "cached".
+        """
+        if not self.cache_min_tokens:
+            return 0
+        cached = 0
+        hit = True
+        with self.lock:
+            for end in range(self.cache_min_tokens * 4, len(prompt) + 1, 128 * 4):
+                key = hash(prompt[:end])
+                if hit and key in self.prefixes:
+                    cached = estimate_tokens(prompt[:end])
+                else:
+                    hit = False
+                    self.prefixes.add(key)
+        return cached
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def fake_completion(request):
+    """Build a plausible reply for the kind of prompt the scripts send"""
+    messages = request.get("messages", [])
+    prompt = "\n".join(message.get("content") or "" for message in messages)
+    subject = ""
+    for line in prompt.splitlines():
+        if line.startswith("Subject:"):
+            subject = line[len("Subject:"):].strip()
+            break
+
+    labels = LABELS[sum(map(ord, subject)) % len(LABELS)]
+    response_format = (request.get("response_format") or {}).get("type")
+    if response_format == "json_object":
+        content = json.dumps({**labels, "response": DRAFT_REPLY.format(subject=subject)})
+    elif "TYPE:" in prompt:
+        content = ANALYSIS_REPLY.format(**labels)
+    else:
+        content = DRAFT_REPLY.format(subject=subject)
+
+    prompt_tokens = estimate_tokens(prompt)
+    completion_tokens = min(estimate_tokens(content), request.get("max_tokens") or 4096)
+    return content, prompt, prompt_tokens, completion_tokens
+
+
+def completion_body(request, content, usage, number):
+    """A non-streamed chat.completion response"""
+    return {
+        "id": f"chatcmpl-mock-{number}",
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": request.get("model", "mock"),
+        "choices": [{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop"
+        }],
+        "usage": usage
+    }
+
+
+def usage_of(prompt_tokens, completion_tokens, cached_tokens=0):
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+        "prompt_tokens_details": {"cached_tokens": cached_tokens}
+    }
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    settings = MockSettings()
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up, e.g. a hedged request that lost the race
+            self.close_connection = True
+
+    def send_chunk(self, payload):
+        """One server-sent event in a chunked HTTP body (payload None ends the stream)"""
+        data = b"data: " + (json.dumps(payload).encode("utf-8") if payload is not None else b"[DONE]") + b"\n\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+        if payload is None:
+            self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def send_stream(self, request, content, usage, latency):
+        """Stream content word by word, spreading latency over the chunks"""
+        pieces = STREAM_CHUNK.findall(content) or [content]
+        base = {"id": f"chatcmpl-mock-{self.settings.stats['requests']}", "object": "chat.completion.chunk",
+                "created": int(time.time()), "model": request.get("model", "mock")}
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            for i, piece in enumerate(pieces):
+                time.sleep(latency * FIRST_TOKEN_SHARE if i == 0
+                           else latency * (1 - FIRST_TOKEN_SHARE) / max(1, len(pieces) - 1))
+                delta = {"role": "assistant", "content": piece} if i == 0 else {"content": piece}
+                self.send_chunk({**base, "choices": [{"index": 0, "delta": delta, "finish_reason": None}]})
+            self.send_chunk({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+            if (request.get("stream_options") or {}).get("include_usage"):
+                self.send_chunk({**base, "choices": [], "usage": usage})
+            self.send_chunk(None)
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+    def do_POST(self):
+        settings = self.settings
+        with settings.lock:
+            busy = 0 < settings.max_concurrent <= settings.in_flight
+            if not busy:
+                settings.in_flight += 1
+        if busy:
+            with settings.lock:
+                settings.stats["requests"] += 1
+                settings.stats["rate_limited"] += 1
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.send_json(429, {"error": {"message": "Too many concurrent requests (mock)",
+                                           "type": "rate_limit_exceeded"}}, {"retry-after": "0.2"})
+            return
+        try:
+            self.answer()
+        finally:
+            with settings.lock:
+                settings.in_flight -= 1
+
+    def answer(self):
+        length = int(self.headers.get("Content-Length", 0))
+        raw = self.rfile.read(length)
+        settings = self.settings
+
+        with settings.lock:
+            settings.stats["requests"] += 1
+
+        path = self.path.rstrip("/")
+        if path.endswith("/files"):
+            self.create_file(raw)
+            return
+        request = json.loads(raw or b"{}")
+        if path.endswith("/batches"):
+            self.create_batch(request)
+            return
+        if not path.endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+
+        if settings.roll(settings.rate_limit_rate):
+            with settings.lock:
+                settings.stats["rate_limited"] += 1
+            self.send_json(429, {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_exceeded"}},
+                           {"retry-after": str(settings.retry_after)})
+            return
+
+        latency = settings.sample_latency()
+        if not request.get("stream"):
+            time.sleep(latency)
+
+        if settings.roll(settings.error_rate):
+            with settings.lock:
+                settings.stats["errors"] += 1
+            self.send_json(500, {"error": {"message": "Internal error (mock)", "type": "server_error"}})
+            return
+
+        content, prompt, prompt_tokens, completion_tokens = fake_completion(request)
+        usage = usage_of(prompt_tokens, completion_tokens, settings.cached_prefix_tokens(prompt))
+        if request.get("stream"):
+            self.send_stream(request, content, usage, latency)
+            return
+        self.send_json(200, completion_body(request, content, usage, settings.stats['requests']))
+
+    def do_GET(self):
+        """Batches API status and Files API content, for the Batch API backend"""
+        settings = self.settings
+        path = self.path.rstrip("/")
+        batch = re.search(r"/batches/([^/]+)$", path)
+        content = re.search(r"/files/([^/]+)/content$", path)
+        with settings.lock:
+            settings.stats["requests"] += 1
+            if batch and batch.group(1) in settings.batches:
+                found = dict(settings.batches[batch.group(1)])
+            elif content and content.group(1) in settings.files:
+                found = settings.files[content.group(1)]["content"]
+            else:
+                found = None
+        if found is None:
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+        elif batch:
+            self.send_json(200, found)
+        else:
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(found)))
+            self.end_headers()
+            self.wfile.write(found)
+
+    def add_file(self, content, filename, purpose):
+        settings = self.settings
+        with settings.lock:
+            file_id = f"file-mock-{len(settings.files)}"
+            settings.files[file_id] = {"content": content}
+        return {"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                "filename": filename, "purpose": purpose, "status": "processed"}
+
+    def create_file(self, raw):
+        """Files API upload (multipart/form-data with "file" and "purpose" fields)"""
+        form = BytesParser(policy=HTTP).parsebytes(
+            b"Content-Type: " + self.headers.get("Content-Type", "").encode("latin-1") + b"\r\n\r\n" + raw)
+        fields = {part.get_param("name", header="content-disposition"): part for part in form.iter_parts()}
+        if "file" not in fields:
+            self.send_json(400, {"error": {"message": "Missing file", "type": "invalid_request_error"}})
+            return
+        purpose = fields["purpose"].get_content().strip() if "purpose" in fields else "batch"
+        self.send_json(200, self.add_file(fields["file"].get_payload(decode=True), fields["file"].get_filename(),
+                                          purpose))
+
+    def create_batch(self, request):
+        """Batches API: answer every request of the input file in the background, after one latency"""
+        settings = self.settings
+        with settings.lock:
+            source = settings.files.get(request.get("input_file_id"), {}).get("content")
+            batch_id = f"batch-mock-{len(settings.batches)}"
+        if source is None:
+            self.send_json(404, {"error": {"message": "Unknown input file", "type": "invalid_request_error"}})
+            return
+        lines = [json.loads(line) for line in source.decode("utf-8").splitlines() if line.strip()]
+        batch = {"id": batch_id, "object": "batch", "endpoint": request.get("endpoint"),
+                 "input_file_id": request["input_file_id"], "completion_window": request.get("completion_window"),
+                 "status": "in_progress", "created_at": int(time.time()), "output_file_id": None,
+                 "error_file_id": None, "metadata": request.get("metadata"),
+                 "request_counts": {"total": len(lines), "completed": 0, "failed": 0}}
+        with settings.lock:
+            settings.batches[batch_id] = batch
+        self.send_json(200, batch)
+        threading.Thread(target=self.run_batch, args=(batch, lines), daemon=True).start()
+
+    def run_batch(self, batch, lines):
+        settings = self.settings
+        time.sleep(settings.sample_latency())
+        output, errors = [], []
+        for number, line in enumerate(lines):
+            entry = {"id": f"batch_req_{number}", "custom_id": line["custom_id"], "error": None}
+            if settings.roll(settings.error_rate):
+                entry["response"] = {"status_code": 500,
+                                     "body": {"error": {"message": "Internal error (mock)", "type": "server_error"}}}
+                errors.append(entry)
+                continue
+            content, prompt, prompt_tokens, completion_tokens = fake_completion(line["body"])
+            usage = usage_of(prompt_tokens, completion_tokens, settings.cached_prefix_tokens(prompt))
+            entry["response"] = {"status_code": 200, "body": completion_body(line["body"], content, usage, number)}
+            output.append(entry)
+        files = {}
+        for key, entries in (("output_file_id", output), ("error_file_id", errors)):
+            if entries:
+                content = "".join(json.dumps(entry) + "\n" for entry in entries).encode("utf-8")
+                files[key] = self.add_file(content, f"{batch['id']}_{key[:-8]}.jsonl", "batch_output")["id"]
+        with settings.lock:
+            batch.update(files, status="completed",
+                         request_counts={"total": len(lines), "completed": len(output), "failed": len(errors)})
+
+
+def make_server(host="127.0.0.1", port=8765, settings=None):
+    """Create (but do not start) a mock server; port 0 picks a free port"""
+    handler = type("ConfiguredMockHandler", (MockHandler,), {"settings": settings or MockSettings()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Mock OpenAI chat-completions and Batch API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="median latency per call")
+    parser.add_argument("--jitter", type=float, default=0.5, help="log-normal sigma (0 = fixed latency)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of calls rejected with 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds on 429s")
+    parser.add_argument("--max-concurrent", type=int, default=0,
+                        help="reject requests beyond this many in flight with 429 (0 = no limit)")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--cache-min-tokens", type=int, default=1024,
+                        help="shortest prompt prefix the emulated prompt cache serves (0 = no caching)")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    settings = MockSettings(args.latency_ms, args.jitter, args.error_rate, args.rate_limit_rate,
+                            args.retry_after, args.seed, args.cache_min_tokens, args.max_concurrent)
+    server = make_server(args.host, args.port, settings)
+    print(f"🧪 Mock OpenAI server on http://{args.host}:{server.server_address[1]}/v1", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
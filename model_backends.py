@@ -0,0 +1,160 @@
+"""Per-stage model backends (model name and OpenAI-compatible endpoint) and per-model pricing"""
+import os
+import json
+import threading
+
+from llm_scheduler import scheduler, CallScheduler
+from llm_clients import get_client, get_async_client
+from prompt_templates import cached_tokens
+
+DEFAULT_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+
+# Dollars per 1K tokens: (input, cached input, output)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.00015, 0.000075, 0.0006),
+    "gpt-4o": (0.0025, 0.00125, 0.01),
+    "gpt-4.1": (0.002, 0.0005, 0.008),
+    "gpt-4.1-mini": (0.0004, 0.0001, 0.0016),
+    "gpt-4.1-nano": (0.0001, 0.000025, 0.0004)
+}
+FREE = (0.0, 0.0, 0.0)
+
+# Combined mode writes the draft, so it uses the generation backend
+BACKEND_OF_STAGE = {"analysis": "analysis", "generation": "generation", "combined": "generation"}
+
+# Requests/tokens per minute for endpoints other than the default one (e.g. a local server)
+ENDPOINT_RPM = int(os.getenv("EMAIL_ENDPOINT_RPM_LIMIT", "10000"))
+ENDPOINT_TPM = int(os.getenv("EMAIL_ENDPOINT_TPM_LIMIT", "100000000"))
+
+
+def backend_from_env(name):
+    prefix = f"EMAIL_{name.upper()}_"
+    return {
+        "model": os.getenv(prefix + "MODEL", DEFAULT_MODEL),
+        # None = the SDK default: OPENAI_BASE_URL, else api.openai.com
+        "base_url": os.getenv(prefix + "BASE_URL") or None,
+        "api_key": os.getenv(prefix + "API_KEY") or None
+    }
+
+
+# Settings per backend; EMAIL_ANALYSIS_MODEL / EMAIL_ANALYSIS_BASE_URL etc. override them
+BACKENDS = {name: backend_from_env(name) for name in ("analysis", "generation")}
+
+_lock = threading.Lock()
+_state = {"endpoint_share": 1.0, "schedulers": {}, "unpriced": set()}
+
+
+def load_prices(path):
+    """Add or override prices from a JSON file: {"model": [input, cached input, output] per 1K tokens}"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    for model, prices in data.items():
+        if len(prices) != 3:
+            raise ValueError(f"Price for {model!r} must be [input, cached input, output] per 1K tokens")
+        MODEL_PRICES[model] = tuple(float(price) for price in prices)
+
+
+if os.getenv("EMAIL_MODEL_PRICES"):
+    load_prices(os.getenv("EMAIL_MODEL_PRICES"))
+
+
+def backend(stage):
+    return BACKENDS[BACKEND_OF_STAGE.get(stage, "generation")]
+
+
+def configure_backend(name, model=None, base_url=None, api_key=None):
+    """Point the "analysis" or "generation" backend somewhere else (None keeps a setting)"""
+    settings = BACKENDS[name]
+    if model:
+        settings["model"] = model
+    if base_url:
+        settings["base_url"] = base_url
+    if api_key:
+        settings["api_key"] = api_key
+
+
+def set_endpoint_share(workers):
+    """Give this process 1/workers of every non-default endpoint's rate limits"""
+    _state["endpoint_share"] = 1.0 / max(1, workers)
+
+
+def model_for(stage):
+    return backend(stage)["model"]
+
+
+def client_for(stage):
+    settings = backend(stage)
+    return get_client(settings["base_url"], _api_key(settings))
+
+
+def async_client_for(stage):
+    settings = backend(stage)
+    return get_async_client(settings["base_url"], _api_key(settings))
+
+
+def _api_key(settings):
+    # Local OpenAI-compatible servers ignore the key, but the SDK insists on one
+    if settings["api_key"] or not settings["base_url"]:
+        return settings["api_key"]
+    return os.getenv("OPENAI_API_KEY") or "local"
+
+
+def scheduler_for(stage):
+    """
+    The rate limiter for a stage's endpoint.
+
+    The default endpoint shares the account-wide scheduler; any other
+    base URL (say, a local server for analysis) gets its own limits, so it
+    neither uses up nor waits for the hosted account's budget.
+    """
+    base_url = backend(stage)["base_url"]
+    if base_url is None:
+        return scheduler
+    with _lock:
+        endpoint = _state["schedulers"].get(base_url)
+        if endpoint is None:
+            share = _state["endpoint_share"]
+            endpoint = _state["schedulers"][base_url] = CallScheduler(ENDPOINT_RPM * share,
+                                                                      ENDPOINT_TPM * share, name=base_url)
+        return endpoint
+
+
+def scheduler_stats():
+    """Call/retry/throttle counters summed over every endpoint's scheduler"""
+    totals = dict(scheduler.stats)
+    with _lock:
+        endpoints = list(_state["schedulers"].values())
+    for endpoint in endpoints:
+        for key, value in endpoint.stats.items():
+            totals[key] += value
+    return totals
+
+
+def prices_of(model):
+    """(input, cached input, output) dollars per 1K tokens; dated snapshots use their base model's price"""
+    prices = MODEL_PRICES.get(model)
+    if prices is not None:
+        return prices
+    for known in sorted(MODEL_PRICES, key=len, reverse=True):
+        if model.startswith(known + "-"):
+            return MODEL_PRICES[known]
+    # Self-hosted models cost nothing per token; say so once rather than guess
+    if model not in _state["unpriced"]:
+        _state["unpriced"].add(model)
+        print(f"⚠️  No price for model {model!r} (see EMAIL_MODEL_PRICES); counting its tokens as free")
+    return FREE
+
+
+def cost_of(model, usage):
+    """Dollar cost of one completion's usage on model"""
+    input_price, cached_price, output_price = prices_of(model)
+    cached = cached_tokens(usage)
+    return ((usage.prompt_tokens - cached) / 1000) * input_price + \
+           (cached / 1000) * cached_price + \
+           (usage.completion_tokens / 1000) * output_price
+
+
+def describe(stage):
+    """ "model" or "model @ base_url" for headers and logs"""
+    settings = backend(stage)
+    return f"{settings['model']} @ {settings['base_url']}" if settings["base_url"] else settings["model"]
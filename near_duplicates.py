@@ -0,0 +1,178 @@
+"""MinHash/LSH near-duplicate detection so one draft can serve many similar emails"""
+import os
+import re
+import zlib
+import random
+import threading
+
+# Estimated Jaccard similarity above which two emails share a draft
+DEFAULT_THRESHOLD = float(os.getenv("EMAIL_DUPLICATE_THRESHOLD", "0.7"))
+
+# 16 bands x 4 rows: pairs at 0.7 similarity become candidates ~99% of the time
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS
+MERSENNE_PRIME = (1 << 61) - 1
+
+WORD = re.compile(r"[a-z]+|\d+")
+NUMBER = re.compile(r"\d+")
+GREETING = re.compile(r"^(dear|hi|hello|hey|good (?:morning|afternoon|evening))\b[^,!\n]*([,!])",
+                      re.IGNORECASE)
+
+# Mailbox names that are not a person's first name
+GENERIC_NAMES = {"info", "support", "sales", "admin", "contact", "team", "hello", "office", "customer",
+                 "client", "service", "help", "billing", "accounts", "mail", "email", "hr"}
+
+
+def shingles(text, size=3):
+    """Word size-grams of text, lowercased; numbers are words too (the index masks them first)"""
+    words = WORD.findall(text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+
+class MinHasher:
+    """Fixed random permutations, so signatures are comparable across runs and processes"""
+
+    def __init__(self, num_perm=NUM_PERM, seed=1):
+        rng = random.Random(seed)
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME))
+                             for _ in range(num_perm)]
+
+    def signature(self, text):
+        hashes = [zlib.crc32(shingle.encode("utf-8")) for shingle in shingles(text)]
+        return tuple(min((a * h + b) % MERSENNE_PRIME for h in hashes) for a, b in self.permutations)
+
+
+def similarity(first, second):
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return sum(a == b for a, b in zip(first, second)) / len(first)
+
+
+class NearDuplicateIndex:
+    """
+    Streaming LSH index that assigns each email to a cluster.
+
+    An email joins the first cluster whose representative (its first email)
+    is at least threshold similar; LSH bands keep that to a few candidate
+    comparisons instead of one per cluster. Numbers are masked before
+    hashing, so emails that differ only in an order or ticket number still
+    cluster; renumber() then puts each email's own numbers into the draft.
+
+    >>> index = NearDuplicateIndex()
+    >>> body = "My order has not arrived yet and the tracking page shows no update at all. Order #{}"
+    >>> index.assign("Late order", body.format(1111))
+    (0, True)
+    >>> index.assign("Late order", body.format(2222))
+    (0, False)
+    >>> index.assign("Password reset", "I cannot log in since the update, the reset link is broken")
+    (1, True)
+    """
+
+    def __init__(self, threshold=DEFAULT_THRESHOLD, hasher=None):
+        self.threshold = threshold
+        self.hasher = hasher or MinHasher()
+        self.buckets = [{} for _ in range(BANDS)]
+        self.representatives = []
+        self.sizes = []
+        self.lock = threading.Lock()
+
+    def assign(self, subject, body):
+        """Return (cluster id, True if the email started a new cluster)"""
+        text = f"{subject}\n{body}"
+        signature = self.hasher.signature(NUMBER.sub("0", text))
+        bands = [signature[i * ROWS:(i + 1) * ROWS] for i in range(BANDS)]
+
+        with self.lock:
+            checked = set()
+            for bucket, band in zip(self.buckets, bands):
+                for cluster in bucket.get(band, ()):
+                    if cluster in checked:
+                        continue
+                    checked.add(cluster)
+                    if similarity(signature, self.representatives[cluster]) >= self.threshold:
+                        self.sizes[cluster] += 1
+                        return cluster, False
+
+            cluster = len(self.representatives)
+            self.representatives.append(signature)
+            self.sizes.append(1)
+            for bucket, band in zip(self.buckets, bands):
+                bucket.setdefault(band, []).append(cluster)
+            return cluster, True
+
+    def stats(self):
+        with self.lock:
+            return {
+                "clusters": len(self.sizes),
+                "emails": sum(self.sizes),
+                "largest": max(self.sizes, default=0)
+            }
+
+
+def renumber(draft, source, target):
+    """
+    Rewrite the numbers draft quotes from the email source with target's, matched by position.
+
+    Numbers the draft makes up itself ("within 24 hours") are left alone.
+    Returns None when the draft quotes source's numbers but target does not
+    have a number in each of the same places, so it needs its own draft.
+
+    >>> renumber("Order 1111 ships in 2 days.", "Where is order 1111?", "Where is order 2222?")
+    'Order 2222 ships in 2 days.'
+    >>> renumber("Sorry about the delay.", "Order 1111 is late", "Orders 2222 and 3333 are late")
+    'Sorry about the delay.'
+    >>> renumber("Order 1111 ships today.", "Order 1111 is late", "Orders 2222 and 3333 are late") is None
+    True
+    """
+    source_numbers, target_numbers = NUMBER.findall(source), NUMBER.findall(target)
+    if not set(NUMBER.findall(draft)) & set(source_numbers):
+        return draft
+    if len(source_numbers) != len(target_numbers):
+        return None
+    numbers = {}
+    for old, new in zip(source_numbers, target_numbers):
+        if numbers.setdefault(old, new) != new:
+            return None
+    return NUMBER.sub(lambda match: numbers.get(match.group(0), match.group(0)), draft)
+
+
+def sender_first_name(sender):
+    """Best guess at a first name from an address like "John Smith <john.smith@x.com>" """
+    match = re.match(r'\s*"?([^"<@]+?)"?\s*<', sender or "")
+    candidates = match.group(1).split() if match else re.split(r"[._+\-\d]+", (sender or "").split("@")[0])
+    for candidate in candidates:
+        if candidate.isalpha() and len(candidate) > 1 and candidate.lower() not in GENERIC_NAMES:
+            return candidate.title()
+    return None
+
+
+def sender_names(sender):
+    """Name-like words of a sender's display name and mailbox ("John Smith <js@x.com>" -> {"john", "smith"})"""
+    match = re.match(r'\s*"?([^"<@]+?)"?\s*<([^>@]*)', sender or "")
+    if match:
+        words = match.group(1).split() + re.split(r"[._+\-\d]+", match.group(2))
+    else:
+        words = re.split(r"[._+\-\d]+", (sender or "").split("@")[0])
+    return {word.lower() for word in words
+            if word.isalpha() and len(word) > 1 and word.lower() not in GENERIC_NAMES}
+
+
+def names_sender(draft, sender):
+    """True if draft mentions any of sender's names, so it cannot be handed to someone else"""
+    words = set(WORD.findall(draft.lower()))
+    return bool(words & sender_names(sender))
+
+
+def personalize(draft, sender):
+    """Re-address a cluster's template draft to another sender by rewriting its greeting"""
+    name = sender_first_name(sender)
+
+    def greet(match):
+        word, punctuation = match.group(1), match.group(2)
+        if name:
+            return f"{word} {name}{punctuation}"
+        return f"{word} Customer{punctuation}" if word.lower() == "dear" else f"{word} there{punctuation}"
+
+    return GREETING.sub(greet, draft.lstrip(), count=1)
@@ -0,0 +1,209 @@
+"""Speculative prefetch: analyze (and optionally draft) upcoming emails while the operator reads"""
+import os
+import heapq
+import itertools
+import threading
+
+# Emails analyzed ahead of the one on screen
+DEFAULT_DEPTH = int(os.getenv("EMAIL_PREFETCH_DEPTH", "2"))
+
+# Queue order: upcoming analyses, then upcoming drafts (work the operator waits for never queues)
+ANALYSIS_AHEAD = 1
+DRAFT_AHEAD = 2
+
+
+class Job:
+    """One queued call and, once run, its result"""
+
+    def __init__(self, fn, args):
+        self.fn = fn
+        self.args = args
+        self.started = False
+        self.cancelled = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.fn(*self.args)
+        except BaseException as e:
+            self.error = e
+        finally:
+            self.done.set()
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class Prefetcher:
+    """
+    Runs speculative model work of the interactive loop on one background thread.
+
+    While the operator reads an email and answers the prompts, the next
+    depth emails are analyzed (and drafted too, if draft is given) so the
+    results are ready the moment the operator gets to them. Work the
+    operator is waiting for runs right away on the operator's thread,
+    never behind a speculative call; while it runs, the background thread
+    starts nothing new, so at most one speculative call overlaps it.
+
+    analyze(email) returns an analysis result dict; draft(email, analysis)
+    a response result dict. Prefetched results the operator never uses
+    count as wasted, with their cost.
+    """
+
+    def __init__(self, analyze, draft=None, depth=DEFAULT_DEPTH):
+        self.analyze = analyze
+        self.draft = draft
+        self.depth = depth
+        self.heap = []
+        self.order = itertools.count()
+        self.cond = threading.Condition()
+        self.analyses = {}
+        self.drafts = {}
+        self.prefetched = set()
+        self.taken = set()
+        self.closed = False
+        self.thread = None
+        # Operator requests running now; the background thread waits for them
+        self.urgent = 0
+        self.stats = {
+            "analyses": 0,
+            "drafts": 0,
+            "ready": 0,
+            "waited": 0,
+            "wasted_analyses": 0,
+            "wasted_drafts": 0,
+            "wasted_cost": 0.0
+        }
+
+    def _submit(self, priority, fn, *args):
+        job = Job(fn, args)
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._loop, name="prefetch", daemon=True)
+                self.thread.start()
+            heapq.heappush(self.heap, (priority, next(self.order), job))
+            self.cond.notify()
+        return job
+
+    def _loop(self):
+        while True:
+            with self.cond:
+                while (not self.heap or self.urgent) and not self.closed:
+                    self.cond.wait()
+                if not self.heap:
+                    return
+                _, _, job = heapq.heappop(self.heap)
+                # Jobs the operator already ran, and cancelled ones, are dropped
+                if job.started or job.cancelled:
+                    continue
+                job.started = True
+            job.run()
+
+    def _claim(self, job):
+        """True if the caller gets to run job (nobody has started it)"""
+        with self.cond:
+            if job.started:
+                return False
+            job.started = True
+            return True
+
+    def _run_now(self, job):
+        """Run a job the operator is waiting for on the calling thread, ahead of every queued one"""
+        with self.cond:
+            self.urgent += 1
+        try:
+            job.run()
+        finally:
+            with self.cond:
+                self.urgent -= 1
+                self.cond.notify()
+        return job.wait()
+
+    def _draft_after(self, analysis_job, email):
+        # Normally the analysis ran first; if the draft was taken ahead of it, run it here
+        if self._claim(analysis_job):
+            analysis_job.run()
+        result = analysis_job.wait()
+        if not result["success"]:
+            return None
+        return self.draft(email, result["analysis"])
+
+    def prefetch(self, key, email):
+        """Queue an upcoming email's analysis (and draft); no-op if already queued"""
+        if key in self.analyses or self.closed:
+            return
+        analysis_job = self.analyses[key] = self._submit(ANALYSIS_AHEAD, self.analyze, email)
+        self.prefetched.add(analysis_job)
+        if self.draft is not None:
+            draft_job = self.drafts[key] = self._submit(DRAFT_AHEAD, self._draft_after, analysis_job, email)
+            self.prefetched.add(draft_job)
+
+    def _take(self, job):
+        """Wait for a job, running it right here if it has not started"""
+        self.taken.add(job)
+        if job.done.is_set():
+            self.stats["ready"] += 1
+            return job.wait()
+        self.stats["waited"] += 1
+        if self._claim(job):
+            return self._run_now(job)
+        return job.wait()
+
+    def take_analysis(self, key, email):
+        """An email's analysis result: instantly if it was prefetched in time"""
+        job = self.analyses.get(key)
+        if job is None:
+            job = self.analyses[key] = Job(self.analyze, (email,))
+            job.started = True
+            self.taken.add(job)
+            return self._run_now(job)
+        return self._take(job)
+
+    def take_draft(self, key):
+        """An email's prefetched response result, or None if drafts are not prefetched for it"""
+        job = self.drafts.get(key)
+        return self._take(job) if job is not None else None
+
+    def skip_draft(self, key):
+        """The operator declined to answer: drop the email's draft if it has not started"""
+        job = self.drafts.get(key)
+        if job is not None:
+            with self.cond:
+                job.cancelled = not job.started
+
+    def run(self, fn, *args):
+        """Run fn(*args) now on the calling thread, holding back speculative work until it is done"""
+        job = Job(fn, args)
+        job.started = True
+        return self._run_now(job)
+
+    def close(self):
+        """
+        Stop prefetching and tally the prefetched work, counting unused results as wasted.
+
+        Queued work is dropped; work already running is finished first, so
+        every call that was paid for is accounted for.
+        """
+        with self.cond:
+            self.closed = True
+            for _, _, job in self.heap:
+                job.cancelled = job.cancelled or not job.started
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join()
+
+        for kind, jobs in (("analyses", self.analyses), ("drafts", self.drafts)):
+            for job in jobs.values():
+                if job not in self.prefetched or not job.done.is_set():
+                    continue
+                self.stats[kind] += 1
+                result = job.result
+                if job in self.taken or job.error is not None or not result or not result["success"]:
+                    continue
+                self.stats[f"wasted_{kind}"] += 1
+                self.stats["wasted_cost"] += result.get("cost", 0.0)
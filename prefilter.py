@@ -0,0 +1,204 @@
+"""Rule-based pre-filter that skips or defers emails nobody should answer, before any model call"""
+import os
+import re
+import json
+import threading
+
+from checkpoint_journal import email_key
+
+# Actions, checked in this order: keep wins over skip, skip over defer
+KEEP = "keep"
+SKIP = "skip"
+DEFER = "defer"
+ACTIONS = (KEEP, SKIP, DEFER)
+
+# Fields a rule can match: sender, subject, the end of the body, and
+# "name: value" header lines (mbox/Maildir inboxes only)
+FIELDS = ("from", "subject", "footer", "headers")
+# The footer is the last third of the body, at most this long, so it never covers a short email's text
+FOOTER_CHARS = 600
+
+DEFAULT_DEFERRED_PATH = os.getenv("EMAIL_DEFERRED_PATH", "deferred_emails.jsonl")
+
+# Bulk-mail headers and footer wording, used as the second signal for bulk senders
+BULK_SIGNALS = [
+    {"field": "headers", "pattern": r"^(list-unsubscribe|list-id|x-campaign(id)?|feedback-id):"
+                                    r"|^precedence: *(bulk|list|junk)\b"},
+    {"field": "footer", "pattern": r"\bunsubscribe\b|\bopt[- ]out\b|email preferences"},
+]
+
+DEFAULT_RULES = [
+    {"name": "no-reply sender", "field": "from", "action": SKIP,
+     "pattern": r"\b(no[-_.]?reply|do[-_.]?not[-_.]?reply|mailer-daemon|postmaster|bounces?)\b"},
+    {"name": "auto-reply", "field": "subject", "action": SKIP,
+     "pattern": r"^\s*(auto(matic)?[- ]?reply|out of (the )?office|delivery status notification"
+                r"|undeliverable|mail delivery failed)\b"},
+    {"name": "auto-submitted header", "field": "headers", "action": SKIP,
+     "pattern": r"^auto-submitted: *auto-"},
+    # People write from news@ or updates@ too: the address alone is not enough
+    {"name": "bulk sender", "field": "from", "action": DEFER, "also": BULK_SIGNALS,
+     "pattern": r"(^|[<\s\"])(newsletters?|news|marketing|promo(tions)?|digest|notifications?|updates)@"},
+    {"name": "newsletter subject", "field": "subject", "action": DEFER,
+     "pattern": r"\b(newsletter|weekly digest|monthly digest)\b"},
+    # Only wording that mailing tools put in footers; "how do I unsubscribe?" is a real question
+    {"name": "unsubscribe footer", "field": "footer", "action": DEFER,
+     "pattern": r"click here to unsubscribe|unsubscribe from (this|our|these) (list|mailing list|newsletter|emails)"
+                r"|you are receiving this (e-?mail|message) because you|view this email in your browser"
+                r"|manage your email preferences"},
+    {"name": "mailing list header", "field": "headers", "action": DEFER,
+     "pattern": r"^(list-unsubscribe|list-id):|^precedence: *(bulk|list|junk)\b"},
+]
+
+
+def field_text(email, field):
+    """The text a rule on field looks at"""
+    if field == "footer":
+        body = (email.get("body") or "").rstrip()
+        return body[-min(FOOTER_CHARS, len(body) // 3):] if len(body) >= 3 else ""
+    if field == "headers":
+        headers = email.get("headers") or {}
+        return "\n".join(f"{name.lower()}: {value}" for name, value in headers.items())
+    return email.get(field) or ""
+
+
+def check_pattern(name, field, pattern):
+    if field not in FIELDS:
+        raise ValueError(f"Rule {name!r}: field must be one of {', '.join(FIELDS)}")
+    try:
+        re.compile(pattern)
+    except re.error as e:
+        raise ValueError(f"Rule {name!r}: bad pattern: {e}")
+
+
+def load_rules(path):
+    """
+    Read extra rules from a JSON file: a list of
+    {"name", "field", "pattern", "action"} objects, or {"rules": [...]}.
+    A rule may add "also": [{"field", "pattern"}, ...], in which case it
+    only matches if one of those matches too.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    rules = data.get("rules", []) if isinstance(data, dict) else data
+    for rule in rules:
+        name = rule.get("name")
+        if rule.get("action") not in ACTIONS:
+            raise ValueError(f"Rule {name!r}: action must be one of {', '.join(ACTIONS)}")
+        check_pattern(name, rule.get("field"), rule.get("pattern", ""))
+        for signal in rule.get("also", []):
+            check_pattern(name, signal.get("field"), signal.get("pattern", ""))
+        rule.setdefault("name", rule["pattern"])
+    return rules
+
+
+class PreFilter:
+    """
+    Matches emails against keep/skip/defer rules with precompiled regexes.
+
+    Rules for the same action and field are joined into one alternation,
+    so checking an email costs at most one regex search per field and
+    action. Rules that need a second signal ("also") are searched one by
+    one, after the joined rules of their action. Skipped emails are dropped; deferred ones are appended to a
+    JSON Lines file that can be fed back in later as an inbox. An email already in that file (same
+    checkpoint_journal.email_key) is not appended again, so rerunning an inbox does not duplicate it.
+
+    >>> import os, tempfile
+    >>> path = os.path.join(tempfile.mkdtemp(), "deferred.jsonl")
+    >>> email = {"id": 1, "from": "news@shop.com", "subject": "Weekly digest", "body": "Deals"}
+    >>> for run in range(2):
+    ...     run_filter = PreFilter(deferred_path=path)
+    ...     run_filter.record(email, *run_filter.check(email))
+    ...     run_filter.close()
+    >>> sum(1 for _ in open(path))
+    1
+    >>> run_filter.stats["deferred"], run_filter.stats["appended"]
+    (1, 0)
+    """
+
+    def __init__(self, rules=DEFAULT_RULES, enabled=True, deferred_path=DEFAULT_DEFERRED_PATH):
+        self.enabled = enabled
+        self.deferred_path = deferred_path
+        self.lock = threading.Lock()
+        self.stats = {"skipped": 0, "deferred": 0, "appended": 0, "saved_cost": 0.0, "rules": {}}
+        self._deferred = None
+        # email_key()s of the emails in the deferred file, read when it is first opened
+        self._deferred_keys = None
+        self.set_rules(rules)
+
+    def set_rules(self, rules):
+        self.rules = list(rules)
+        self.compiled = []
+        flags = re.IGNORECASE | re.MULTILINE
+        for action in ACTIONS:
+            for field in FIELDS:
+                group = [(i, rule) for i, rule in enumerate(self.rules)
+                         if rule["action"] == action and rule["field"] == field and not rule.get("also")]
+                if not group:
+                    continue
+                pattern = "|".join(f"(?P<r{i}>{rule['pattern']})" for i, rule in group)
+                self.compiled.append((action, field, re.compile(pattern, flags), ()))
+            for i, rule in enumerate(self.rules):
+                if rule["action"] == action and rule.get("also"):
+                    also = tuple((signal["field"], re.compile(signal["pattern"], flags)) for signal in rule["also"])
+                    self.compiled.append((action, rule["field"], re.compile(f"(?P<r{i}>{rule['pattern']})", flags),
+                                          also))
+
+    def add_rules(self, rules):
+        """Add rules in front of the current ones (e.g. from --prefilter-rules)"""
+        self.set_rules(list(rules) + self.rules)
+
+    def check(self, email):
+        """Return (action, rule name) for the first matching rule, or None"""
+        if not self.enabled:
+            return None
+        for action, field, regex, also in self.compiled:
+            match = regex.search(field_text(email, field))
+            if match and (not also or any(signal.search(field_text(email, name)) for name, signal in also)):
+                if action == KEEP:
+                    return None
+                return action, self.rules[int(match.lastgroup[1:])]["name"]
+        return None
+
+    def record(self, email, action, rule, saved_cost=0.0):
+        """Count a filtered email and write it out if it was deferred"""
+        with self.lock:
+            self.stats["skipped" if action == SKIP else "deferred"] += 1
+            self.stats["saved_cost"] += saved_cost
+            self.stats["rules"][rule] = self.stats["rules"].get(rule, 0) + 1
+            if action == DEFER and self.deferred_path:
+                if self._deferred is None:
+                    self._deferred_keys = self._read_deferred_keys()
+                    self._deferred = open(self.deferred_path, "a", encoding="utf-8")
+                key = email_key(email)
+                if key in self._deferred_keys:
+                    return
+                self._deferred_keys.add(key)
+                self._deferred.write(json.dumps({**email, "deferred_by": rule}, default=str) + "\n")
+                self._deferred.flush()
+                self.stats["appended"] += 1
+
+    def _read_deferred_keys(self):
+        keys = set()
+        if not os.path.exists(self.deferred_path):
+            return keys
+        with open(self.deferred_path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entry.pop("deferred_by", None)
+                keys.add(email_key(entry))
+        return keys
+
+    def close(self):
+        with self.lock:
+            if self._deferred is not None:
+                self._deferred.close()
+                self._deferred = None
+
+
+# Shared by the scripts; set EMAIL_PREFILTER_DISABLED=1 to send every email to the model
+prefilter = PreFilter(enabled=os.getenv("EMAIL_PREFILTER_DISABLED", "") not in ("1", "true", "yes"))
+if os.getenv("EMAIL_PREFILTER_RULES"):
+    prefilter.add_rules(load_rules(os.getenv("EMAIL_PREFILTER_RULES")))
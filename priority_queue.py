@@ -0,0 +1,75 @@
+"""Priority queue with aging so urgent emails are drafted first without starving the rest"""
+import os
+import time
+import heapq
+import itertools
+
+PRIORITY_RANK = {"low": 0, "medium": 1, "high": 2, "urgent": 3}
+DEFAULT_PRIORITY = "medium"
+
+# Seconds of waiting that lift an email by one priority level
+DEFAULT_AGING_SECONDS = float(os.getenv("EMAIL_PRIORITY_AGING_SECONDS", "30"))
+# Analyzed emails held ahead of response generation
+DEFAULT_LOOKAHEAD = int(os.getenv("EMAIL_PRIORITY_LOOKAHEAD", "1000"))
+
+
+def priority_of(email, analysis=None):
+    """
+    Priority of an email: the analysis's PRIORITY when there is one, else
+    the inbox's own "priority" field, else medium.
+    """
+    for value in ((analysis or {}).get("PRIORITY"), email.get("priority")):
+        value = (value or "").strip().lower()
+        if value in PRIORITY_RANK:
+            return value
+    return DEFAULT_PRIORITY
+
+
+class AgingPriorityQueue:
+    """
+    Bounded asyncio queue that hands out the highest effective priority first.
+
+    Effective priority is rank + waited / aging_seconds, so a low email
+    that has waited long enough overtakes fresh urgent ones. Every item ages
+    at the same rate, so the order only depends on
+    rank * aging_seconds - enqueued_at, which a plain heap can keep.
+
+    Producers call put() and then close(); get() returns None once the
+    queue is closed and drained.
+    """
+
+    def __init__(self, maxsize=DEFAULT_LOOKAHEAD, aging_seconds=DEFAULT_AGING_SECONDS):
+        self.maxsize = maxsize
+        self.aging_seconds = aging_seconds
+        self.heap = []
+        self.order = itertools.count()
+        self.closed = False
+        import asyncio
+        self.changed = asyncio.Condition()
+
+    def __len__(self):
+        return len(self.heap)
+
+    async def put(self, priority, item):
+        """Queue item, waiting while the lookahead window is full"""
+        async with self.changed:
+            await self.changed.wait_for(lambda: not self.maxsize or len(self.heap) < self.maxsize)
+            score = PRIORITY_RANK.get(priority, PRIORITY_RANK[DEFAULT_PRIORITY]) * self.aging_seconds
+            heapq.heappush(self.heap, (time.monotonic() - score, next(self.order), item))
+            self.changed.notify_all()
+
+    async def get(self):
+        """Pop the most urgent item, or None when closed and empty"""
+        async with self.changed:
+            await self.changed.wait_for(lambda: self.heap or self.closed)
+            if not self.heap:
+                return None
+            _, _, item = heapq.heappop(self.heap)
+            self.changed.notify_all()
+            return item
+
+    async def close(self):
+        """No more puts; wake consumers so they can drain and stop"""
+        async with self.changed:
+            self.closed = True
+            self.changed.notify_all()
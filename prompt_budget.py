@@ -0,0 +1,206 @@
+"""Trim email bodies before they go into prompts: strip quoted history, signatures and disclaimers, then fit a token budget"""
+import os
+import re
+import threading
+from functools import lru_cache
+
+try:
+    import tiktoken
+except ImportError:  # optional: fall back to ~4 characters per token
+    tiktoken = None
+
+# Body tokens allowed per stage; analysis only needs the gist
+DEFAULT_BUDGETS = {
+    "analysis": int(os.getenv("EMAIL_ANALYSIS_BODY_TOKENS", "400")),
+    "generation": int(os.getenv("EMAIL_RESPONSE_BODY_TOKENS", "1500")),
+    "combined": int(os.getenv("EMAIL_RESPONSE_BODY_TOKENS", "1500"))
+}
+# How an over-budget body is shortened: "summarize" (extractive) or "truncate"
+DEFAULT_FIT = os.getenv("EMAIL_BODY_FIT", "summarize")
+FIT_MODES = ("summarize", "truncate")
+
+GAP = "[...]"
+
+# Everything from one of these lines on is quoted history
+REPLY_HEADER = re.compile(
+    r"^\s*(On .{0,200}wrote:\s*$"
+    r"|-{2,}\s*Original Message\s*-{2,}"
+    r"|-{2,}\s*Forwarded message\s*-{2,}"
+    r"|_{10,}\s*$"
+    r"|From:\s.+$(?=\n\s*(Sent|Date):))",
+    re.IGNORECASE | re.MULTILINE
+)
+QUOTED_LINE = re.compile(r"^\s*>.*$\n?", re.MULTILINE)
+# RFC 3676 "-- " delimiter and mobile footers start a signature
+SIGNATURE = re.compile(r"^(--\s*|Sent from my .+|Get Outlook for .+)$", re.MULTILINE)
+DISCLAIMER = re.compile(
+    r"(this (e-?mail|message|communication)( and any attachments?)?\s+(is|are|may be|contains?)\s+"
+    r"(strictly )?(confidential|privileged|intended solely)"
+    r"|if you (have )?received this (e-?mail|message|communication) in error"
+    r"|please consider the environment before printing)",
+    re.IGNORECASE
+)
+BLANK_LINES = re.compile(r"\n\s*\n")
+SENTENCE = re.compile(r"[^.!?\n]+(?:[.!?]+|$)", re.MULTILINE)
+WORD = re.compile(r"[a-z']{3,}")
+STOPWORDS = {"the", "and", "for", "are", "but", "not", "you", "your", "with", "this", "that", "have",
+             "was", "were", "will", "from", "they", "them", "our", "can", "has", "had", "all", "any",
+             "would", "could", "should", "there", "their", "been", "about", "just", "please", "thanks",
+             "thank", "regards", "hi", "hello", "dear", "also", "into", "what", "when", "which", "more"}
+
+_encoding = None
+
+
+def count_tokens(text):
+    """Tokens in text, with tiktoken when installed, else the ~4 chars/token estimate"""
+    global _encoding
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base")
+        except ValueError:
+            _encoding = tiktoken.get_encoding("cl100k_base")
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+@lru_cache(maxsize=1024)
+def clean_body(body):
+    """Drop quoted replies, signatures and disclaimer paragraphs from an email body"""
+    text = body.replace("\r\n", "\n")
+
+    header = REPLY_HEADER.search(text)
+    if header and header.start() > 0:
+        text = text[:header.start()]
+    text = QUOTED_LINE.sub("", text)
+
+    signature = SIGNATURE.search(text)
+    if signature and signature.start() > 0:
+        text = text[:signature.start()]
+
+    paragraphs = [p for p in BLANK_LINES.split(text) if p.strip() and not DISCLAIMER.search(p)]
+    cleaned = "\n\n".join(p.strip() for p in paragraphs)
+    # Never send an empty body: an email that is all quote is answered from the quote
+    return cleaned or body.strip()
+
+
+def truncate(text, max_tokens):
+    """Keep the start and the end of text (where the ask usually is) within max_tokens"""
+    chars_per_token = len(text) / max(1, count_tokens(text))
+    keep = int(max(0, max_tokens - 2) * chars_per_token)
+    head = int(keep * 0.75)
+    return text[:head].rstrip() + f"\n{GAP}\n" + text[len(text) - (keep - head):].lstrip()
+
+
+def summarize(text, max_tokens):
+    """
+    Extractive summary: keep the highest scoring sentences, in their
+    original order, until max_tokens is used.
+
+    Sentences score by how many of the email's frequent words they contain,
+    with a bonus for the opening sentence, questions and the closing line.
+    """
+    sentences = [s.strip() for s in SENTENCE.findall(text) if s.strip()]
+    if len(sentences) < 2:
+        return truncate(text, max_tokens)
+
+    frequency = {}
+    for word in WORD.findall(text.lower()):
+        if word not in STOPWORDS:
+            frequency[word] = frequency.get(word, 0) + 1
+
+    def score(position):
+        sentence = sentences[position]
+        words = [w for w in WORD.findall(sentence.lower()) if w not in STOPWORDS]
+        value = sum(frequency[w] for w in words) / (len(words) + 1)
+        if position == 0 or sentence.endswith("?"):
+            value *= 2
+        elif position == len(sentences) - 1:
+            value *= 1.5
+        return value
+
+    chosen = []
+    used = 0
+    for position in sorted(range(len(sentences)), key=score, reverse=True):
+        tokens = count_tokens(sentences[position]) + 1
+        if used + tokens <= max_tokens:
+            chosen.append(position)
+            used += tokens
+    if not chosen:
+        return truncate(text, max_tokens)
+
+    parts = []
+    previous = -1
+    for position in sorted(chosen):
+        if position != previous + 1:
+            parts.append(GAP)
+        parts.append(sentences[position])
+        previous = position
+    if previous != len(sentences) - 1:
+        parts.append(GAP)
+    return " ".join(parts)
+
+
+@lru_cache(maxsize=4096)
+def fit_body(body, max_tokens, mode=DEFAULT_FIT):
+    """
+    Clean body and shorten it to max_tokens.
+
+    Returns (text, original tokens, tokens after cleaning, tokens sent).
+    """
+    original = count_tokens(body)
+    text = clean_body(body)
+    cleaned = count_tokens(text) if text != body else original
+    if max_tokens and cleaned > max_tokens:
+        text = summarize(text, max_tokens) if mode == "summarize" else truncate(text, max_tokens)
+    return text, original, cleaned, count_tokens(text)
+
+
+def new_stage_stats():
+    return {"bodies": 0, "original_tokens": 0, "cleaned_tokens": 0, "sent_tokens": 0, "shortened": 0}
+
+
+class PromptBudget:
+    """Per-stage body token budgets, with counts of the tokens they save"""
+
+    def __init__(self, budgets=None, mode=DEFAULT_FIT, enabled=True):
+        self.budgets = dict(DEFAULT_BUDGETS if budgets is None else budgets)
+        self.mode = mode
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def fit(self, stage, body, record=True):
+        """The body to put in a stage's prompt; record=False for estimates that send nothing"""
+        if not self.enabled:
+            return body
+        text, original, cleaned, sent = fit_body(body, self.budgets.get(stage, 0), self.mode)
+        if record:
+            with self.lock:
+                stats = self.stats.setdefault(stage, new_stage_stats())
+                stats["bodies"] += 1
+                stats["original_tokens"] += original
+                stats["cleaned_tokens"] += cleaned
+                stats["sent_tokens"] += sent
+                stats["shortened"] += sent < cleaned
+        return text
+
+    def merge(self, stats):
+        """Add stats collected elsewhere (e.g. in a worker process)"""
+        with self.lock:
+            for stage, other in stats.items():
+                ours = self.stats.setdefault(stage, new_stage_stats())
+                for field, value in other.items():
+                    ours[field] += value
+
+    def tokens_saved(self):
+        """(body tokens saved, share of original body tokens saved)"""
+        with self.lock:
+            original = sum(stats["original_tokens"] for stats in self.stats.values())
+            sent = sum(stats["sent_tokens"] for stats in self.stats.values())
+        saved = original - sent
+        return saved, saved / original if original else 0.0
+
+
+# Shared by the scripts; set EMAIL_BODY_BUDGET_DISABLED=1 to always send bodies untouched
+budget = PromptBudget(enabled=os.getenv("EMAIL_BODY_BUDGET_DISABLED", "") not in ("1", "true", "yes"))
@@ -0,0 +1,243 @@
+"""Versioned prompt templates with the invariant instructions first and the email content last"""
+import os
+import zlib
+import threading
+
+EMAIL_SECTION = "Subject: {subject}\nBody: {body}"
+
+# Role lines for the smart response, chosen by the analysis TYPE
+PERSONAS = {
+    "support": "You are a helpful customer support rep. Be empathetic and solution-focused.",
+    "sales": "You are a friendly sales rep. Be enthusiastic and informative.",
+    "urgent": "You are handling an urgent matter. Be apologetic and provide immediate solutions.",
+    "feedback": "You are responding to feedback. Be grateful and warm.",
+    "general": "You are a professional communicator. Be clear and courteous."
+}
+
+SENTIMENT_INSTRUCTIONS = {
+    "angry": " The sender seems upset, so be extra empathetic and apologetic.",
+    "negative": " The sender seems upset, so be extra empathetic and apologetic.",
+    "positive": " The sender seems happy, so match their positive energy."
+}
+
+# Longer role descriptions used by email_responder.py
+DETAILED_PERSONAS = {
+    "support": "You are a helpful customer support representative. Generate professional, empathetic email "
+               "responses that address the customer's concerns clearly. Always acknowledge their issue, "
+               "provide helpful information, and offer next steps.",
+    "sales": "You are a friendly sales representative. Generate engaging email responses that answer "
+             "questions, highlight value, and move conversations forward. Be enthusiastic but not pushy.",
+    "general": "You are a professional business communicator. Generate clear, concise email responses that "
+               "address all points raised while maintaining a courteous and professional tone.",
+    "urgent": "You are responding to an urgent matter. Generate a response that acknowledges the urgency, "
+              "apologizes for any delays, and provides immediate next steps. Be empathetic but solution-focused.",
+    "feedback": "You are responding to customer feedback. Generate a warm, appreciative response that thanks "
+                "them sincerely and reinforces their decision to share their experience."
+}
+
+TONE_INSTRUCTIONS = {
+    "professional": "Keep the tone strictly professional and formal.",
+    "friendly": "Use a warm, friendly tone while remaining professional.",
+    "apologetic": "Be apologetic and empathetic. Acknowledge mistakes if any.",
+    "enthusiastic": "Be enthusiastic and energetic while staying professional."
+}
+
+
+def cached_tokens(usage):
+    """Prompt tokens the provider served from its prefix cache (0 if not reported)"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", 0) or 0) if details is not None else 0
+
+
+class PromptTemplate:
+    """
+    One prompt, laid out so providers can cache its prefix.
+
+    The system message and the instructions never change, so they are built
+    once and always come first; a short per-call context (persona, tone...)
+    follows, and the email itself comes last. Prefix caching only applies
+    to the identical leading part of a prompt, so everything before the
+    context is shared by every call of this template.
+
+    version names the prompt for A/B runs; cache_version adds a checksum of
+    the text, so editing a prompt without bumping version still invalidates
+    cached responses.
+    """
+
+    def __init__(self, name, version, system, instructions, context=""):
+        self.name = name
+        self.version = version
+        self.context = context
+        self.system_message = {"role": "system", "content": system}
+        self.prefix = instructions + "\n\n"
+        checksum = zlib.crc32("\0".join((system, instructions, context, EMAIL_SECTION)).encode("utf-8"))
+        self.cache_version = f"{version}-{checksum:08x}"
+
+    def messages(self, subject, body, **context):
+        """Chat messages for one email; context fills the template's context fields"""
+        tail = EMAIL_SECTION.format(subject=subject, body=body)
+        if self.context:
+            tail = self.context.format(**context) + "\n\n" + tail
+        return [self.system_message, {"role": "user", "content": self.prefix + tail}]
+
+
+def new_usage_stats():
+    return {"calls": 0, "prompt_tokens": 0, "cached_tokens": 0}
+
+
+class PromptRegistry:
+    """Templates by name, which version of each is in use, and token usage per version"""
+
+    def __init__(self):
+        self.versions = {}
+        self.active = {}
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def register(self, template, active=False):
+        """Add a template version; the first one registered under a name is active"""
+        self.versions.setdefault(template.name, {})[template.version] = template
+        if active or template.name not in self.active:
+            self.active[template.name] = template.version
+        return template
+
+    def get(self, name):
+        return self.versions[name][self.active[name]]
+
+    def select(self, name, version):
+        """Use another registered version of a template (e.g. for an A/B run)"""
+        if version not in self.versions.get(name, {}):
+            known = ", ".join(f"{n}={v}" for n, versions in self.versions.items() for v in versions)
+            raise ValueError(f"Unknown prompt version {name}={version} (registered: {known})")
+        self.active[name] = version
+
+    def select_all(self, spec):
+        """Apply a "name=version,name=version" list"""
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            name, _, version = item.partition("=")
+            self.select(name.strip(), version.strip())
+
+    def record(self, template, usage):
+        """Count one call's prompt tokens, and how many were served from the prefix cache"""
+        with self.lock:
+            stats = self.stats.setdefault(template.version, new_usage_stats())
+            stats["calls"] += 1
+            stats["prompt_tokens"] += getattr(usage, "prompt_tokens", 0) or 0
+            stats["cached_tokens"] += cached_tokens(usage)
+
+    def merge(self, stats):
+        """Add usage collected elsewhere (e.g. in a worker process)"""
+        with self.lock:
+            for version, other in stats.items():
+                ours = self.stats.setdefault(version, new_usage_stats())
+                for field, value in other.items():
+                    ours[field] += value
+
+    def cached_share(self):
+        """(cached prompt tokens, all prompt tokens, cached fraction) over every template"""
+        with self.lock:
+            cached = sum(stats["cached_tokens"] for stats in self.stats.values())
+            prompt = sum(stats["prompt_tokens"] for stats in self.stats.values())
+        return cached, prompt, cached / prompt if prompt else 0.0
+
+
+# Shared by the scripts; EMAIL_PROMPT_VERSIONS="response=..." picks other registered versions
+prompts = PromptRegistry()
+
+prompts.register(PromptTemplate(
+    "analysis", "quick-analysis-v2",
+    system="You are an email analyst. Be concise.",
+    instructions="""Analyze the email at the end of this message briefly.
+
+Return ONLY these 4 lines (no extra text):
+TYPE: [support/sales/general/feedback/urgent]
+SENTIMENT: [positive/negative/neutral/angry]
+PRIORITY: [low/medium/high/urgent]
+TONE: [professional/friendly/apologetic/enthusiastic]"""
+))
+
+prompts.register(PromptTemplate(
+    "response", "smart-response-v2",
+    system="You write replies to the emails a business receives.",
+    instructions="Generate a complete, ready-to-send response (2-4 paragraphs) to the email at the end of "
+                 "this message, following the role, context and tone given just before it. Include greeting "
+                 "and sign-off.",
+    context="{persona}\nContext: This is a {email_type} email with {sentiment} sentiment and {priority} "
+            "priority.\nTone: Use a {tone} tone.{sentiment_instructions}"
+))
+
+# Adds the sender's name and earlier emails with them (see context_store)
+prompts.register(PromptTemplate(
+    "response", "smart-response-v3",
+    system="You write replies to the emails a business receives.",
+    instructions="Generate a complete, ready-to-send response (2-4 paragraphs) to the email at the end of "
+                 "this message, following the role, context and tone given just before it. Include greeting "
+                 "and sign-off. Greet the sender by name when it is given, and never leave placeholders such "
+                 "as [Customer's Name] in the reply. If earlier emails are listed, stay consistent with them "
+                 "and do not repeat what was already said.",
+    context="{persona}\nContext: This is a {email_type} email with {sentiment} sentiment and {priority} "
+            "priority.\nTone: Use a {tone} tone.{sentiment_instructions}\nSender: {sender_name}{history}"
+), active=True)
+
+prompts.register(PromptTemplate(
+    "combined", "combined-v2",
+    system="You are an email analyst and customer communication expert. Reply with JSON only.",
+    instructions="""Analyze the email at the end of this message and write a reply to it.
+
+Return ONLY a JSON object with these keys:
+"type": one of support/sales/general/feedback/urgent/newsletter
+"sentiment": one of positive/negative/neutral/angry
+"priority": one of low/medium/high/urgent
+"tone": one of professional/friendly/apologetic/enthusiastic
+"response": a complete, ready-to-send reply (2-4 paragraphs) in the chosen tone, with greeting and sign-off.
+If the sender is upset, be extra empathetic and apologetic."""
+))
+
+# Same sender name and history block as smart-response-v3, so both modes draft from the same context
+prompts.register(PromptTemplate(
+    "combined", "combined-v3",
+    system="You are an email analyst and customer communication expert. Reply with JSON only.",
+    instructions="""Analyze the email at the end of this message and write a reply to it.
+
+Return ONLY a JSON object with these keys:
+"type": one of support/sales/general/feedback/urgent/newsletter
+"sentiment": one of positive/negative/neutral/angry
+"priority": one of low/medium/high/urgent
+"tone": one of professional/friendly/apologetic/enthusiastic
+"response": a complete, ready-to-send reply (2-4 paragraphs) in the chosen tone, with greeting and sign-off.
+If the sender is upset, be extra empathetic and apologetic. Greet the sender by name when it is given, and never
+leave placeholders such as [Customer's Name] in the reply. If earlier emails are listed, stay consistent with them
+and do not repeat what was already said.""",
+    context="Sender: {sender_name}{history}"
+), active=True)
+
+prompts.register(PromptTemplate(
+    "detailed-analysis", "analysis-v2",
+    system="You are an expert email analyst. Analyze emails quickly and accurately.",
+    instructions="""Analyze the email at the end of this message and provide a structured analysis.
+
+Provide the analysis in this exact format:
+TYPE: [support/sales/general/feedback/newsletter/other]
+SENTIMENT: [positive/negative/neutral/angry/urgent]
+PRIORITY: [low/medium/high/urgent]
+KEY_POINTS: [list 2-3 main points to address in response]
+TONE_RECOMMENDATION: [professional/friendly/apologetic/enthusiastic]
+
+Be concise and clear."""
+))
+
+prompts.register(PromptTemplate(
+    "basic-response", "response-v2",
+    system="You write replies to the emails a business receives.",
+    instructions="""Generate a complete, ready-to-send response to the email at the end of this message, following the role and tone requirement given just before it. Include:
+- Appropriate greeting
+- Clear response addressing all points
+- Professional sign-off
+- Do NOT include "Subject:" line (we'll keep the same subject)
+
+Keep the response concise (2-4 paragraphs).""",
+    context="{persona}\nTone requirement: {tone_instruction}"
+))
+
+if os.getenv("EMAIL_PROMPT_VERSIONS"):
+    prompts.select_all(os.getenv("EMAIL_PROMPT_VERSIONS"))
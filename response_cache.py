@@ -0,0 +1,137 @@
+"""Persistent content-addressed cache for model responses (SQLite)"""
+import os
+import re
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+DEFAULT_CACHE_PATH = os.getenv("EMAIL_CACHE_PATH", ".email_cache.sqlite")
+DEFAULT_TTL = float(os.getenv("EMAIL_CACHE_TTL_HOURS", "168")) * 3600
+DEFAULT_MAX_ENTRIES = int(os.getenv("EMAIL_CACHE_MAX_ENTRIES", "50000"))
+
+WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text):
+    """Lowercase and collapse whitespace so trivially different emails match"""
+    return WHITESPACE.sub(" ", (text or "").strip().lower())
+
+
+def make_key(model, template_version, temperature, subject, body, **extra):
+    """
+    Build a cache key from everything that affects the model's output.
+
+    extra holds any other prompt inputs (tone, email type, analysis...)
+    and must be JSON serializable.
+    """
+    payload = json.dumps({
+        "model": model,
+        "template": template_version,
+        "temperature": temperature,
+        "subject": normalize_text(subject),
+        "body": normalize_text(body),
+        "extra": extra
+    }, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """
+    SQLite-backed cache with a TTL and LRU eviction beyond max_entries.
+
+    Values are dicts like {"content": ..., "tokens": ..., "cost": ...};
+    the stored cost is what a hit saves.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 enabled=True):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "saved_cost": 0.0}
+        self._conn = None
+
+    @property
+    def conn(self):
+        # Opened on first use so importing the module never touches disk
+        if self._conn is None:
+            # Worker processes share the file, so wait for locks instead of failing
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                cost REAL NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+            self._conn.execute("CREATE INDEX IF NOT EXISTS idx_last_used ON entries(last_used)")
+            self._conn.commit()
+        return self._conn
+
+    def get(self, key):
+        """Return the cached value for key, or None on a miss"""
+        if not self.enabled:
+            return None
+
+        now = time.time()
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value, cost, created FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or now - row[2] > self.ttl:
+                if row is not None:
+                    self.conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    self.conn.commit()
+                self.stats["misses"] += 1
+                return None
+
+            self.conn.execute("UPDATE entries SET last_used = ? WHERE key = ?", (now, key))
+            self.conn.commit()
+            self.stats["hits"] += 1
+            self.stats["saved_cost"] += row[1]
+            return json.loads(row[0])
+
+    def put(self, key, value):
+        """Store value under key, evicting expired and least recently used entries"""
+        if not self.enabled:
+            return
+
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), value.get("cost", 0.0), now, now)
+            )
+            self._evict(now)
+            self.conn.commit()
+
+    def _evict(self, now):
+        self.conn.execute("DELETE FROM entries WHERE created < ?", (now - self.ttl,))
+        count = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if count > self.max_entries:
+            self.conn.execute(
+                "DELETE FROM entries WHERE key IN "
+                "(SELECT key FROM entries ORDER BY last_used LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def hit_rate(self):
+        """Fraction of lookups served from the cache"""
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return self.stats["hits"] / lookups if lookups else 0.0
+
+    def clear(self):
+        """Remove every cached entry"""
+        with self.lock:
+            self.conn.execute("DELETE FROM entries")
+            self.conn.commit()
+
+
+# Shared by all scripts; set EMAIL_CACHE_DISABLED=1 to always call the model
+cache = ResponseCache(enabled=os.getenv("EMAIL_CACHE_DISABLED", "") not in ("1", "true", "yes"))
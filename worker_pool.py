@@ -0,0 +1,248 @@
+"""Multi-process batch mode: shard an inbox across worker processes"""
+import queue
+import threading
+
+# Worker -> parent message kinds
+RESULT = "result"
+DONE = "done"
+
+SUMMED_STATS = ("emails_processed", "responses_generated", "total_cost", "cache_hits",
+                "cache_misses", "cache_saved_cost", "fast_path_hits", "combined_fallbacks",
+                "clusters", "cluster_reuses", "cluster_saved_cost", "history_lookups", "history_hits",
+                "history_tokens")
+
+
+def worker_main(worker_id, task_queue, result_queue, options):
+    """
+    Entry point of one worker process.
+
+    Pulls (index, email) pairs from task_queue until it sees None, runs them
+    through the async batch pipeline and sends each result back. Saving and
+    journaling stay in the parent so there is a single writer for each.
+    """
+    import asyncio
+    import email_responder_pro as pro
+    from llm_scheduler import scheduler
+    from response_cache import cache
+    from metrics import metrics
+    from prefilter import prefilter
+    from prompt_budget import budget
+    from prompt_templates import prompts
+    from context_store import context
+    from llm_clients import configure_pool, HEDGING
+    from concurrency_limit import ADAPTIVE
+    from model_backends import BACKENDS, set_endpoint_share, scheduler_stats
+
+    # Each worker gets an equal share of the account-wide budget, and of every other endpoint's
+    workers = options["workers"]
+    scheduler.set_budget(options["rpm"] / workers, options["tpm"] / workers)
+    set_endpoint_share(workers)
+    for name, settings in options["backends"].items():
+        BACKENDS[name].update(settings)
+    pro.fast_path.update(options["fast_path"])
+    cache.enabled = options["cache_enabled"]
+    # The parent pre-filters before queueing, and is the only writer of deferred emails
+    prefilter.enabled = False
+    configure_pool(options["concurrency"])
+    HEDGING["enabled"] = options["hedging"]
+    ADAPTIVE.update(options["adaptive"])
+    budget.enabled = options["budget"]["enabled"]
+    budget.mode = options["budget"]["mode"]
+    budget.budgets.update(options["budget"]["budgets"])
+    for name, version in options["prompts"].items():
+        prompts.select(name, version)
+    context.enabled = options["history"]["enabled"]
+    context.max_tokens = options["history"]["max_tokens"]
+    # A connection inherited through fork must not be shared between processes
+    cache._conn = None
+    context._conn = None
+
+    def tasks():
+        while True:
+            # Blocks only when the parent has not read ahead, i.e. near the end
+            item = task_queue.get()
+            if item is None:
+                return
+            yield item
+
+    def send(result):
+        # The parent still has the email; don't pickle it back
+        result_queue.put((RESULT, {k: v for k, v in result.items() if k != "email"}))
+
+    try:
+        asyncio.run(pro.run_batch(tasks(), options["concurrency"], combined=options["combined"],
+                                  indexed=True, on_result=send, **options["batch"]))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        result_queue.put((DONE, {
+            "worker": worker_id,
+            "session": {key: pro.session_stats[key] for key in SUMMED_STATS},
+            "scheduler": scheduler_stats(),
+            "metrics": metrics.snapshot(),
+            "budget": budget.stats,
+            "prompts": prompts.stats
+        }))
+
+
+def merge_worker_stats(session_stats, summary):
+    """Fold one worker's final counters into this process's stats"""
+    from llm_scheduler import scheduler
+    from metrics import metrics
+    from prompt_budget import budget
+    from prompt_templates import prompts
+
+    for key, value in summary["session"].items():
+        session_stats[key] += value
+    for key, value in summary["scheduler"].items():
+        scheduler.stats[key] += value
+    metrics.merge(summary["metrics"])
+    budget.merge(summary["budget"])
+    prompts.merge(summary["prompts"])
+
+
+def run_workers(pro, emails, workers, max_in_flight, sink=None, combined=False, journal=None,
+                verbose=True, **batch_options):
+    """
+    Process emails with a pool of worker processes fed from a shared queue.
+
+    Each worker runs the async pipeline with max_in_flight emails in flight
+    and an equal share of the rate-limit budget. The parent reads the inbox,
+    skips emails already in the journal, writes drafts and merges every
+    worker's statistics into one session_stats summary.
+
+    pro is the calling email_responder_pro module; it is passed in because
+    when the script runs as __main__, importing it here would create a
+    second copy with its own session_stats. batch_options (prioritize,
+    aging_seconds, lookahead, cluster, cluster_threshold) are passed on
+    to each worker's run_batch, so with cluster each worker only groups
+    the emails it pulls from the queue: near-duplicates that land on
+    different workers are drafted separately.
+
+    If every worker process dies, the emails still queued or in flight
+    are reported as failed (and retried on resume) instead of waiting
+    for results that never come.
+
+    Returns one result dict per email, in inbox order.
+    """
+    from llm_scheduler import scheduler
+    from response_cache import cache
+    from prompt_budget import budget
+    from prompt_templates import prompts
+    from llm_clients import HEDGING
+    from concurrency_limit import ADAPTIVE
+    from model_backends import BACKENDS
+    from checkpoint_journal import email_key
+    import context_store
+    import multiprocessing
+
+    context = multiprocessing.get_context("spawn")
+    # Enough read-ahead to keep every worker's pipeline full
+    task_queue = context.Queue(maxsize=workers * max_in_flight * 2)
+    result_queue = context.Queue()
+    options = {
+        "workers": workers,
+        "concurrency": max_in_flight,
+        "combined": combined,
+        "rpm": scheduler.rpm,
+        "tpm": scheduler.tpm,
+        "fast_path": dict(pro.fast_path),
+        "cache_enabled": cache.enabled,
+        "hedging": HEDGING["enabled"],
+        "adaptive": dict(ADAPTIVE),
+        "budget": {"enabled": budget.enabled, "mode": budget.mode, "budgets": budget.budgets},
+        "prompts": dict(prompts.active),
+        "history": {"enabled": context_store.context.enabled, "max_tokens": context_store.context.max_tokens},
+        "backends": {name: dict(settings) for name, settings in BACKENDS.items()},
+        "batch": batch_options
+    }
+
+    processes = [
+        context.Process(target=worker_main, args=(worker_id, task_queue, result_queue, options),
+                        daemon=True)
+        for worker_id in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    results = {}
+    pending = {}
+    lock = threading.Lock()
+
+    def collect():
+        finished = 0
+        while finished < workers:
+            try:
+                kind, payload = result_queue.get(timeout=1.0)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if kind == DONE:
+                merge_worker_stats(pro.session_stats, payload)
+                finished += 1
+                continue
+            with lock:
+                email, key = pending.pop(payload['index'])
+            payload["email"] = email
+            results[payload['index']] = payload
+            pro.finish_result(payload, sink, journal, key, verbose)
+
+    collector = threading.Thread(target=collect, name="result-collector")
+    collector.start()
+
+    def put(item):
+        # The queue is bounded: don't block forever on it once nobody is reading
+        while True:
+            try:
+                task_queue.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                if not any(process.is_alive() for process in processes):
+                    raise RuntimeError("All worker processes exited")
+
+    interrupted = False
+    try:
+        for index, email in enumerate(emails, 1):
+            key = email_key(email) if journal else None
+            if journal and journal.is_done(key):
+                results[index] = pro.resumed_result(index, email, journal.get(key))
+                continue
+            skipped = pro.prefiltered_result(index, email)
+            if skipped:
+                results[index] = skipped
+                pro.finish_result(skipped, verbose=verbose)
+                continue
+            with lock:
+                pending[index] = (email, key)
+            try:
+                put((index, email))
+            except RuntimeError as e:
+                # Emails not read yet stay unjournaled, so a rerun picks them up
+                print(f"❌ {e}; stopping the batch early")
+                break
+    except BaseException:
+        interrupted = True
+        raise
+    finally:
+        if interrupted:
+            # Finished emails are already journaled; drop the in-flight ones
+            for process in processes:
+                process.terminate()
+        else:
+            try:
+                for _ in processes:
+                    put(None)
+            except RuntimeError:
+                pass
+        collector.join()
+        for process in processes:
+            process.join()
+        if not interrupted:
+            # Left over only if workers died: report them so a rerun retries them
+            for index, (email, key) in sorted(pending.items()):
+                results[index] = {"index": index, "email": email, "success": False,
+                                  "error": "Worker process exited before finishing this email"}
+                pro.finish_result(results[index], sink, journal, key, verbose)
+
+    return [results[index] for index in sorted(results)]